@@ -0,0 +1,261 @@
+import os
+import bisect
+from pathlib import Path
+from Lexicon import Lexicon
+
+# binary postings format
+# a token's postings are stored as (doc_id gap, quantized tf) pairs, sorted by doc_id
+# every number is variable-byte encoded: 7 bits per byte, the high bit is set on every byte except the last
+# tf is stored as an integer in hundredths, the text indexes round tf to 2 decimals so nothing is lost
+# tokens with more than SKIP_INTERVAL postings also get a skip table in {field}.skips, so a conjunctive search can
+# jump to the block of SKIP_INTERVAL postings holding a doc_id without decoding the blocks before it
+# skip entry: doc_id of the last posting before the block, byte offset of the block in the token's postings,
+# both stored as gaps from the previous entry
+
+# fields written to the binary index, 'frequency' plus one per importance tag
+FIELDS = ['frequency', 'b', 'em', 'h1', 'h2', 'h3', 'i', 'strong', 'title']
+
+# tf is stored in hundredths
+TF_SCALE = 100
+
+# number of postings between two skip entries
+SKIP_INTERVAL = 64
+
+
+# appends a variable-byte encoded integer to the buffer
+def encode_varint(value, buffer):
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+# reads a variable-byte encoded integer starting at data[position], returns (value, next position)
+def decode_varint(data, position):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+# encodes a list of (doc_id, tf) sorted by doc_id
+# if skips is a list, a skip entry (last doc_id, byte offset) is appended to it before every block after the first
+def encode_postings(postings, skips=None):
+    buffer = bytearray()
+    previous_doc_id = 0
+    for position, (doc_id, tf) in enumerate(postings):
+        if skips is not None and position and not position % SKIP_INTERVAL:
+            skips.append((previous_doc_id, len(buffer)))
+        encode_varint(doc_id - previous_doc_id, buffer)
+        encode_varint(quantize_tf(tf), buffer)
+        previous_doc_id = doc_id
+    return bytes(buffer)
+
+
+# decodes the postings stored in buffer[offset:offset + length] into {doc_id : tf}
+def decode_postings(buffer, offset, length):
+    postings = {}
+    doc_id = 0
+    value = 0
+    shift = 0
+    is_doc_gap = True
+    for byte in buffer[offset:offset + length]:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        if is_doc_gap:
+            doc_id += value
+        else:
+            postings[doc_id] = value / TF_SCALE
+        is_doc_gap = not is_doc_gap
+        value = 0
+        shift = 0
+    return postings
+
+
+# encodes a list of skip entries (last doc_id, byte offset)
+def encode_skips(skips):
+    buffer = bytearray()
+    previous_doc_id = 0
+    previous_offset = 0
+    for doc_id, offset in skips:
+        encode_varint(doc_id - previous_doc_id, buffer)
+        encode_varint(offset - previous_offset, buffer)
+        previous_doc_id = doc_id
+        previous_offset = offset
+    return bytes(buffer)
+
+
+# decodes the skip entries stored in buffer[offset:offset + length] into the lists (last doc_ids, byte offsets)
+def decode_skips(buffer, offset, length):
+    doc_ids = []
+    offsets = []
+    doc_id = 0
+    block_offset = 0
+    position = offset
+    while position < offset + length:
+        gap, position = decode_varint(buffer, position)
+        offset_gap, position = decode_varint(buffer, position)
+        doc_id += gap
+        block_offset += offset_gap
+        doc_ids.append(doc_id)
+        offsets.append(block_offset)
+    return doc_ids, offsets
+
+
+# return the index of the first value >= target in the sorted values, searching from low
+# the distance probed doubles until it passes target, so the cost grows with the log of the distance moved
+# rather than the length of values, which suits targets visited in increasing order
+def gallop_left(values, target, low=0):
+    step = 1
+    high = low
+    while high < len(values) and values[high] < target:
+        low = high + 1
+        high += step
+        step *= 2
+    return bisect.bisect_left(values, target, low, min(high, len(values)))
+
+
+# returns {doc_id : tf} of the postings stored in buffer[offset:offset + length] for the sorted doc_ids,
+# and the number of bytes decoded
+# skips are the decoded skip entries of the postings, each doc_id's block is galloped to from the block of the
+# doc_id before it, then decoded only up to the doc_id, so the postings far from every doc_id are never decoded
+def lookup_postings(buffer, offset, length, skips, doc_ids):
+    last_doc_ids, block_offsets = skips
+    postings = {}
+    bytes_read = 0
+    block = 0
+    position = offset
+    end = offset + length
+    previous_doc_id = 0                 # the doc_id the next gap is added to
+    doc_id = -1                         # the last doc_id decoded, or the last one before the block
+    for target in doc_ids:
+        # block i > 0 starts after last_doc_ids[i - 1]
+        next_block = gallop_left(last_doc_ids, target, block)
+        if next_block != block:
+            block = next_block
+            position = offset + block_offsets[block - 1]
+            previous_doc_id = doc_id = last_doc_ids[block - 1]
+
+        # most gaps and tfs fit in a single byte, they are read without a call
+        start = position
+        while doc_id < target and position < end:
+            gap = buffer[position]
+            if gap & 0x80:
+                gap, position = decode_varint(buffer, position)
+            else:
+                position += 1
+            tf = buffer[position]
+            if tf & 0x80:
+                tf, position = decode_varint(buffer, position)
+            else:
+                position += 1
+            previous_doc_id += gap
+            doc_id = previous_doc_id
+        bytes_read += position - start
+        if doc_id == target:
+            postings[target] = tf / TF_SCALE
+    return postings, bytes_read
+
+
+# lexicon field of the skip tables of a field
+def get_skips_field(field):
+    return f'{field}.skips'
+
+
+# convert a tf to its stored integer form
+def quantize_tf(tf):
+    return int(round(tf * TF_SCALE))
+
+
+# reads a merged text index file and yields (token, idf, [(doc_id, tf)]) for each token in the file
+def read_text_postings(file_path):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        token = None
+        idf = None
+        postings = []
+        for line in file:
+            if line.startswith('token = '):
+                token = line.strip().split(' = ')[1]
+            elif line.startswith('idf = '):
+                idf = float(line.strip().split(' = ')[1])
+            elif line.startswith('('):
+                data = line.strip("()\n").split(',')
+                postings.append((int(data[0]), float(data[1])))
+            # a blank line ends the token's postings
+            elif token is not None:
+                yield token, idf, postings
+                token = None
+                idf = None
+                postings = []
+        if token is not None:
+            yield token, idf, postings
+
+
+# returns the merged text index files for a field, in token order
+def get_text_index_files(field, frequency='Frequency_Index', importance='Importance_Index'):
+    if field == 'frequency':
+        path = Path(frequency)
+    else:
+        path = Path(os.path.join(importance, field))
+    if not path.exists():
+        return []
+    return sorted(path.glob('*.txt'), key=lambda file: file.name)
+
+
+# converts the merged text indexes into the binary format
+# each field is written to a single file, e.g. Binary_Index/frequency.bin, with its own lexicon
+# and the skip tables of its longer postings to Binary_Index/frequency.skips
+# returns the lexicon written, None if there is no text index to convert
+def convert_text_index_to_binary(frequency='Frequency_Index', importance='Importance_Index',
+                                 output_folder='Binary_Index'):
+    if not os.path.exists(frequency) or not os.path.exists(importance):
+        print(f"Output folder '{frequency} or {importance}' does not exist!")
+        return
+
+    Path(output_folder).mkdir(parents=False, exist_ok=True)
+    lexicon = Lexicon()
+    text_size = 0
+    binary_size = 0
+    skips_size = 0
+
+    for field in FIELDS:
+        binary_path = os.path.join(output_folder, f'{field}.bin')
+        skips_path = os.path.join(output_folder, f'{field}.skips')
+        with open(binary_path, 'wb') as output, open(skips_path, 'wb') as skips_output:
+            offset = 0
+            skips_offset = 0
+            for file_path in get_text_index_files(field, frequency, importance):
+                text_size += os.path.getsize(file_path)
+                for token, idf, postings in read_text_postings(file_path):
+                    skips = []
+                    encoded = encode_postings(postings, skips)
+                    output.write(encoded)
+                    lexicon.add_entry(field, token, binary_path, offset, len(encoded), len(postings), idf,
+                                      (max(tf for _, tf in postings),))
+                    offset += len(encoded)
+
+                    if skips:
+                        encoded_skips = encode_skips(skips)
+                        skips_output.write(encoded_skips)
+                        lexicon.add_entry(get_skips_field(field), token, skips_path, skips_offset,
+                                          len(encoded_skips), len(skips), idf)
+                        skips_offset += len(encoded_skips)
+        binary_size += os.path.getsize(binary_path)
+        skips_size += os.path.getsize(skips_path)
+
+    lexicon.write_lexicon_to_file(os.path.join(output_folder, 'Lexicon.txt'))
+    print(f"Binary index written! text postings: {text_size} bytes, binary postings: {binary_size} bytes, "
+          f"skip tables: {skips_size} bytes")
+    return lexicon
+
+
+# migrate an existing text index without re-crawling
+if __name__ == '__main__':
+    convert_text_index_to_binary()
@@ -1,18 +1,28 @@
+from DocStore import write_doc_store
+
+
 # maintains document id and url associations
 class DocManager:
     def __init__(self):
         self._assign_doc_id = 0                         # assign a document an id
         self._doc_id_manager = {}                       # {doc_id : (file_name, url)}
         self._urls = set()                              # set of all url's
+        self._url_doc_ids = {}                          # {url : doc_id}, finds a url's document id at once
         self._duplicate_urls = set()                    # set of all duplicate url's
 
     # adds a document/url to the document manager
     def add_doc(self, json_file_name, json_handle):
-        url = self._normalize_url(json_handle['url'])
+        return self.add_url(json_file_name, json_handle['url'])
+
+    # adds a document by its raw url, returns its document id, the id of the first document with the same url
+    # for a duplicate
+    def add_url(self, json_file_name, raw_url):
+        url = self._normalize_url(raw_url)
         if self._add_url_to_set(url) is True:
             self._doc_id_manager[self._assign_doc_id] = (json_file_name, url)
+            self._url_doc_ids[url] = self._assign_doc_id
             self._increment_doc_id()
-        return self.get_doc_id(json_handle['url'])
+        return self._url_doc_ids[url]
 
     # given a document id, return its associated contents (file_name, url)
     def get_doc_info(self, doc_id):
@@ -21,17 +31,16 @@ class DocManager:
     # given a raw_url, return its document id if found
     def get_doc_id(self, raw_url=None):
         if raw_url is not None:
-            url = self._normalize_url(raw_url)
-            for doc_id, info in self._doc_id_manager.items():
-                if url == info[1]:
-                    return doc_id
+            return self._url_doc_ids.get(self._normalize_url(raw_url))
 
     # write the document manager to a text file
+    # also writes the binary document store used by the search engine to resolve doc_ids
     def write_doc_manager_to_file(self):
         if self._doc_id_manager:
             with open('DocumentManager.txt', 'w', encoding='utf-8') as output:
                 for doc_id, info in self._doc_id_manager.items():
                     output.write(f"Doc_ID = {doc_id}\tInfo = {info}\n")
+            write_doc_store(self._doc_id_manager)
             with open('Duplicates.txt', 'w', encoding='utf-8') as output:
                 for url in self._duplicate_urls:
                     output.write(f"{url}\n")
@@ -0,0 +1,89 @@
+import mmap
+import struct
+
+# binary document store, lets a doc_id be resolved to its url without reading DocumentManager.txt
+# layout: header (magic, number of documents), offsets array, packed blob
+# the offsets array has number of documents + 1 fixed width entries, entry i is where doc_id i starts in the blob
+# each blob entry is the url and the json file name separated by a null byte
+MAGIC = b'DOCS'
+HEADER = struct.Struct('<4sI')
+OFFSET = struct.Struct('<Q')
+
+
+# writes {doc_id : (file_name, url)} to a binary document store
+def write_doc_store(doc_id_manager, file_name='DocumentStore.bin'):
+    # doc ids are assigned sequentially, a missing id gets an empty entry so ids stay aligned with offsets
+    num_docs = max(doc_id_manager) + 1 if doc_id_manager else 0
+
+    offsets = [0]
+    blob = bytearray()
+    for doc_id in range(num_docs):
+        info = doc_id_manager.get(doc_id)
+        if info is not None:
+            json_file_name, url = info
+            blob += url.encode('utf-8') + b'\x00' + json_file_name.encode('utf-8')
+        offsets.append(len(blob))
+
+    with open(file_name, 'wb') as output:
+        output.write(HEADER.pack(MAGIC, num_docs))
+        output.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+        output.write(blob)
+
+
+# memory mapped reader for the binary document store
+class DocStore:
+    def __init__(self):
+        self._buffer = None                 # memory mapped document store
+        self._num_docs = 0                  # number of doc_ids in the store
+        self._blob_start = 0                # byte position of the packed blob
+
+    # memory map a document store, returns False if it does not exist or is not a document store
+    def open_doc_store(self, file_name='DocumentStore.bin'):
+        try:
+            with open(file_name, 'rb') as file:
+                self._buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return False
+
+        magic, self._num_docs = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            self.close()
+            return False
+        self._blob_start = HEADER.size + (self._num_docs + 1) * OFFSET.size
+        return True
+
+    # release the memory map
+    def close(self):
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+
+    # number of doc_ids in the store
+    def __len__(self):
+        return self._num_docs
+
+    # given a doc_id, return its (file_name, url), None if the doc_id is not in the store
+    def get_doc_info(self, doc_id):
+        entry = self._get_entry(doc_id)
+        if not entry:
+            return None
+        url, json_file_name = entry.split(b'\x00')
+        return json_file_name.decode('utf-8'), url.decode('utf-8')
+
+    # given a doc_id, return its url, None if the doc_id is not in the store
+    def get_url(self, doc_id):
+        entry = self._get_entry(doc_id)
+        if not entry:
+            return None
+        return entry[:entry.index(b'\x00')].decode('utf-8')
+
+    # given a list of doc_ids, return their urls in the same order
+    def get_urls(self, doc_ids):
+        return [self.get_url(doc_id) for doc_id in doc_ids]
+
+    # return the raw blob entry for a doc_id
+    def _get_entry(self, doc_id):
+        if self._buffer is None or not 0 <= doc_id < self._num_docs:
+            return None
+        start, end = struct.unpack_from('<2Q', self._buffer, HEADER.size + doc_id * OFFSET.size)
+        return self._buffer[self._blob_start + start:self._blob_start + end]
@@ -0,0 +1,127 @@
+import os
+import heapq
+from itertools import groupby
+from pathlib import Path
+from Lexicon import Lexicon
+from BinaryPostings import FIELDS, TF_SCALE, encode_varint, decode_varint, quantize_tf
+from BinaryPostings import read_text_postings, get_text_index_files
+
+# fielded postings format
+# one record per (token, doc_id) holding the body tf and the count of every importance tag,
+# so a single lookup returns everything needed to score a token
+# record: doc_id gap, quantized body tf, tag mask (bit i set if IMPORTANCE_FIELDS[i] is present),
+# then the count of every present tag, all variable-byte encoded like the binary format
+
+# importance fields in the order of their bits in the tag mask
+IMPORTANCE_FIELDS = FIELDS[1:]
+
+# every token of the fielded index is stored under this lexicon field
+FIELDED = 'fielded'
+
+
+# encodes a list of (doc_id, tf, [tag counts]) sorted by doc_id
+def encode_fielded_postings(postings):
+    buffer = bytearray()
+    previous_doc_id = 0
+    for doc_id, tf, tag_counts in postings:
+        encode_varint(doc_id - previous_doc_id, buffer)
+        encode_varint(quantize_tf(tf), buffer)
+        tag_mask = 0
+        for tag_index, count in enumerate(tag_counts):
+            if count:
+                tag_mask |= 1 << tag_index
+        buffer.append(tag_mask)
+        for count in tag_counts:
+            if count:
+                encode_varint(int(round(count)), buffer)
+        previous_doc_id = doc_id
+    return bytes(buffer)
+
+
+# decodes the fielded postings stored in buffer[offset:offset + length]
+# returns the body postings {doc_id : tf} and a list of importance postings {doc_id : count}, one per tag
+def decode_fielded_postings(buffer, offset, length):
+    data = buffer[offset:offset + length]
+    frequency_postings = {}
+    importance_postings = [{} for _ in IMPORTANCE_FIELDS]
+    doc_id = 0
+    position = 0
+    while position < length:
+        gap, position = decode_varint(data, position)
+        doc_id += gap
+        tf, position = decode_varint(data, position)
+        if tf:
+            frequency_postings[doc_id] = tf / TF_SCALE
+        tag_mask = data[position]
+        position += 1
+        tag_index = 0
+        while tag_mask:
+            if tag_mask & 1:
+                count, position = decode_varint(data, position)
+                importance_postings[tag_index][doc_id] = float(count)
+            tag_mask >>= 1
+            tag_index += 1
+    return frequency_postings, importance_postings
+
+
+# yields (token, field_index, idf, postings) for every token of a field's merged text index
+def _read_field(field_index, frequency, importance):
+    for file_path in get_text_index_files(FIELDS[field_index], frequency, importance):
+        for token, idf, postings in read_text_postings(file_path):
+            yield token, field_index, idf, postings
+
+
+# yields (token, idf, {doc_id : [tf, b, em, h1, h2, h3, i, strong, title]}) for every token of the merged text indexes
+# the nine fields are merged token by token, only the current token of each field is held in memory
+def read_fielded_records(frequency='Frequency_Index', importance='Importance_Index'):
+    fields = [_read_field(field_index, frequency, importance) for field_index in range(len(FIELDS))]
+    merged_fields = groupby(heapq.merge(*fields), key=lambda field_entry: field_entry[0])
+
+    for token, field_entries in merged_fields:
+        records = {}
+        idf = None
+        for _, field_index, field_idf, postings in field_entries:
+            # importance postings are scored with the frequency idf, a token only seen inside
+            # importance tags falls back to the idf of the first tag it appears in
+            if idf is None:
+                idf = field_idf
+            for doc_id, value in postings:
+                if doc_id not in records:
+                    records[doc_id] = [0] * len(FIELDS)
+                records[doc_id][field_index] = value
+        yield token, idf, records
+
+
+# converts the merged text indexes into the fielded format, Fielded_Index/postings.bin and its lexicon
+# returns the lexicon written, None if there is no text index to convert
+def convert_text_index_to_fielded(frequency='Frequency_Index', importance='Importance_Index',
+                                  output_folder='Fielded_Index'):
+    if not os.path.exists(frequency) or not os.path.exists(importance):
+        print(f"Output folder '{frequency} or {importance}' does not exist!")
+        return
+
+    Path(output_folder).mkdir(parents=False, exist_ok=True)
+    lexicon = Lexicon()
+    postings_path = os.path.join(output_folder, 'postings.bin')
+
+    with open(postings_path, 'wb') as output:
+        offset = 0
+        for token, idf, records in read_fielded_records(frequency, importance):
+            encoded = encode_fielded_postings((doc_id, record[0], record[1:])
+                                              for doc_id, record in sorted(records.items()))
+            output.write(encoded)
+
+            # the largest tf of every field, used for score upper bounds
+            max_tfs = [float(max(record[field_index] for record in records.values()))
+                       for field_index in range(len(FIELDS))]
+            lexicon.add_entry(FIELDED, token, postings_path, offset, len(encoded), len(records), idf, max_tfs)
+            offset += len(encoded)
+
+    lexicon.write_lexicon_to_file(os.path.join(output_folder, 'Lexicon.txt'))
+    print(f"Fielded index written! postings: {os.path.getsize(postings_path)} bytes")
+    return lexicon
+
+
+# migrate an existing text index without re-crawling
+if __name__ == '__main__':
+    convert_text_index_to_fielded()
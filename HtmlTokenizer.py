@@ -0,0 +1,110 @@
+import re
+from lxml import etree
+from Postings import IMPORTANCE_TAGS
+
+# tokens are runs of ascii letters and digits, like the search engine's queries
+TOKEN_PATTERN = re.compile(r'\b[a-zA-Z0-9]+\b')
+
+# text inside these tags is not document text (beautiful soup keeps it apart from the other strings)
+HIDDEN_TEXT_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+
+
+# tokenizes a document's HTML in a single pass over lxml's parser events, without building a tree
+# the tokens are the ones the indexer used to find with beautiful soup (lxml parser): the text tokens are the
+# tokens of every string of the document in order, a string ending at every tag, comment, doctype or processing
+# instruction, and each importance tag has the tokens of all of its text joined, so a token can span its child tags
+# text within the hidden text tags, comments, doctypes and processing instructions is left out of both
+# the parser, and its broken HTML recovery, is the one beautiful soup uses, fed the document the same way
+class HtmlTokenizer:
+    def __init__(self):
+        self._parser = etree.HTMLParser(target=self, recover=True)
+        self._reset()
+
+    # return (text tokens, {tag : [tokens of each element with this importance tag]}) of a document
+    # elements of the same tag are in the order they start in, e.g. an outer <b> before a <b> nested in it
+    def tokenize(self, content):
+        # lxml misreads a unicode document starting with a byte order mark
+        if content and content[0] == '\N{BYTE ORDER MARK}':
+            content = content[1:]
+        try:
+            self._parser.feed(content)
+            return self._parser.close()
+        except Exception:
+            # a document lxml rejects leaves the parser in the middle of it
+            self._parser = etree.HTMLParser(target=self, recover=True)
+            raise
+        finally:
+            self._reset()
+
+    def _reset(self):
+        self._data = []                 # pieces of the string being read, lxml can split a string across events
+        self._strings = []              # strings read since the outermost open importance element started
+        self._text_tokens = []          # tokens of every string of the document
+        self._importance = {tag: [] for tag in IMPORTANCE_TAGS}     # {tag : [tokens of each element]}
+        self._open = []                 # per open element, (its tokens, index of its first string) if important
+        self._open_importance = 0       # open elements with an importance tag
+        self._hidden_depths = []        # depth of every open hidden text tag
+
+    # end the current string, called before every event that is not text
+    def _end_string(self):
+        if not self._data:
+            return
+        string = ''.join(self._data)
+        self._data = []
+        if self._hidden_depths:
+            return
+        self._text_tokens.extend(TOKEN_PATTERN.findall(string))
+        if self._open_importance:
+            self._strings.append(string)
+
+    # lxml parser target events
+
+    def start(self, tag, attrib):
+        self._end_string()
+        tokens = self._importance.get(tag)
+        if tokens is None:
+            self._open.append(None)
+        else:
+            element_tokens = []
+            tokens.append(element_tokens)
+            self._open.append((element_tokens, len(self._strings)))
+            self._open_importance += 1
+        if tag in HIDDEN_TEXT_TAGS:
+            self._hidden_depths.append(len(self._open))
+
+    def end(self, tag):
+        self._end_string()
+        if self._hidden_depths and self._hidden_depths[-1] == len(self._open):
+            self._hidden_depths.pop()
+        element = self._open.pop()
+        if element is not None:
+            self._end_importance(element)
+
+    def data(self, data):
+        self._data.append(data)
+
+    def comment(self, text):
+        self._end_string()
+
+    def doctype(self, name, pubid, system):
+        self._end_string()
+
+    def pi(self, target, data):
+        self._end_string()
+
+    def close(self):
+        self._end_string()
+        # elements still open hold the text up to the end of the document
+        while self._open:
+            element = self._open.pop()
+            if element is not None:
+                self._end_importance(element)
+        return self._text_tokens, self._importance
+
+    # the tokens of an importance element are the tokens of all of its text joined
+    def _end_importance(self, element):
+        element_tokens, first_string = element
+        element_tokens.extend(TOKEN_PATTERN.findall(''.join(self._strings[first_string:])))
+        self._open_importance -= 1
+        if not self._open_importance:
+            self._strings = []
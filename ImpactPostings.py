@@ -0,0 +1,128 @@
+import os
+from itertools import groupby
+from pathlib import Path
+from Lexicon import Lexicon
+from BinaryPostings import encode_varint, decode_varint
+from FieldedPostings import read_fielded_records
+from ScoreBounds import score_fielded_record
+
+# impact ordered postings format
+# the score a token adds to a document, every field combined, is computed at build time and quantized to an
+# integer impact, so searching only adds integers
+# a token's postings are grouped in segments of documents with the same impact, highest impact first
+# segment: impact, number of documents, then the doc_id gaps of its documents in increasing doc_id order
+# every number is variable-byte encoded like the binary format
+
+# impacts are scaled so the largest score a token adds to a document in the index gets this impact
+IMPACT_LEVELS = 255
+
+# every token of the impact index is stored under this lexicon field
+IMPACT = 'impact'
+
+
+# convert a score to its impact, a document containing a token always gets an impact of at least 1
+# unless the token adds nothing to its score
+def quantize_impact(score, scale):
+    if score <= 0:
+        return 0
+    return max(1, int(round(score * scale)))
+
+
+# encodes a list of (impact, doc_id) into impact segments, highest impact first
+def encode_impact_postings(impacts):
+    buffer = bytearray()
+    for impact, segment in groupby(sorted(impacts, key=lambda posting: (-posting[0], posting[1])),
+                                   key=lambda posting: posting[0]):
+        doc_ids = [doc_id for _, doc_id in segment]
+        encode_varint(impact, buffer)
+        encode_varint(len(doc_ids), buffer)
+        previous_doc_id = 0
+        for doc_id in doc_ids:
+            encode_varint(doc_id - previous_doc_id, buffer)
+            previous_doc_id = doc_id
+    return bytes(buffer)
+
+
+# yields (impact, [doc_id], bytes of the segment) for each segment stored in buffer[offset:offset + length],
+# highest impact first
+# segments are only decoded as they are requested, so a search that stops early skips the rest
+def read_impact_segments(buffer, offset, length):
+    position = offset
+    end = offset + length
+    while position < end:
+        start = position
+        impact, position = decode_varint(buffer, position)
+        count, position = decode_varint(buffer, position)
+        doc_ids = []
+        doc_id = 0
+        for _ in range(count):
+            gap, position = decode_varint(buffer, position)
+            doc_id += gap
+            doc_ids.append(doc_id)
+        yield impact, doc_ids, position - start
+
+
+# write the scale and weights the impacts were computed with
+def write_impact_settings(file_name, scale, weights):
+    with open(file_name, 'w', encoding='utf-8') as output:
+        output.write(f'scale\t{scale!r}\n')
+        output.write('weights\t' + ','.join(f'{tag}={weight}' for tag, weight in weights) + '\n')
+
+
+# load the scale and weights the impacts were computed with, returns None if the file does not exist
+def load_impact_settings(file_name):
+    try:
+        with open(file_name, 'r', encoding='utf-8') as settings_file:
+            scale = float(settings_file.readline().rstrip('\n').split('\t')[1])
+            weights = []
+            for tag_weight in settings_file.readline().rstrip('\n').split('\t')[1].split(','):
+                tag, weight = tag_weight.split('=')
+                weights.append((tag, float(weight)))
+    except FileNotFoundError:
+        return None
+    return scale, weights
+
+
+# converts the merged text indexes into impact ordered postings, Impact_Index/postings.bin and its lexicon
+# weights and score_function are the search engine's importance weights and tf-idf weight
+# the first pass finds the largest score to scale the impacts, the second one writes them
+# returns the lexicon written, None if there is no text index to convert
+def convert_text_index_to_impact(weights, score_function, frequency='Frequency_Index',
+                                 importance='Importance_Index', output_folder='Impact_Index'):
+    if not os.path.exists(frequency) or not os.path.exists(importance):
+        print(f"Output folder '{frequency} or {importance}' does not exist!")
+        return
+
+    max_score = 0.0
+    for _, idf, records in read_fielded_records(frequency, importance):
+        for record in records.values():
+            max_score = max(max_score, score_fielded_record(record, idf, weights, score_function))
+    scale = IMPACT_LEVELS / max_score if max_score > 0 else 1.0
+
+    Path(output_folder).mkdir(parents=False, exist_ok=True)
+    lexicon = Lexicon()
+    postings_path = os.path.join(output_folder, 'postings.bin')
+
+    with open(postings_path, 'wb') as output:
+        offset = 0
+        for token, idf, records in read_fielded_records(frequency, importance):
+            impacts = [(quantize_impact(score_fielded_record(record, idf, weights, score_function), scale), doc_id)
+                       for doc_id, record in records.items()]
+            encoded = encode_impact_postings(impacts)
+            output.write(encoded)
+
+            # the highest impact is the token's first segment, kept in the lexicon as its upper bound
+            lexicon.add_entry(IMPACT, token, postings_path, offset, len(encoded), len(records), idf,
+                              (max(impact for impact, _ in impacts),))
+            offset += len(encoded)
+
+    lexicon.write_lexicon_to_file(os.path.join(output_folder, 'Lexicon.txt'))
+    write_impact_settings(os.path.join(output_folder, 'Settings.txt'), scale, weights)
+    print(f"Impact index written! postings: {os.path.getsize(postings_path)} bytes")
+    return lexicon
+
+
+# migrate an existing text index without re-crawling
+if __name__ == '__main__':
+    from Scoring import calculate_tfidf_weight, IMPORTANCE_WEIGHTS
+    convert_text_index_to_impact(IMPORTANCE_WEIGHTS, calculate_tfidf_weight)
@@ -0,0 +1,151 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+# read only index file shared by every searching thread
+# reads name the offset they start at and never move a shared file position, so concurrent reads cannot interleave
+# each other's seeks, os.pread reads at an offset in a single call and releases the GIL while waiting on the disk
+# where os.pread does not exist (windows), the seek and read of each read are done under a lock instead
+class IndexFile:
+    def __init__(self, file_path):
+        self._fd = os.open(file_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        self._size = os.fstat(self._fd).st_size     # the index is not written to while it is searched
+        self._lock = None if hasattr(os, 'pread') else threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # a closed file reads as missing, like a letter without an index file
+    def __bool__(self):
+        return self._fd is not None
+
+    # return length bytes starting at offset, fewer at the end of the file
+    def read(self, offset, length):
+        if self._lock is None:
+            data = os.pread(self._fd, length, offset)
+            # a regular file is only read short at its end, but a read is not guaranteed to return everything
+            while len(data) < length and offset + len(data) < self._size:
+                chunk = os.pread(self._fd, length - len(data), offset + len(data))
+                if not chunk:
+                    break
+                data += chunk
+            return data
+
+        with self._lock:
+            os.lseek(self._fd, offset, os.SEEK_SET)
+            chunks = []
+            remaining = length
+            while remaining > 0:
+                chunk = os.read(self._fd, remaining)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                remaining -= len(chunk)
+            return b''.join(chunks)
+
+    # return the whole file
+    def read_all(self):
+        return self.read(0, self._size)
+
+    # size of the file in bytes
+    def get_size(self):
+        return self._size
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+# index files opened on their first read and shared by every searching thread
+# at most max_open_files are kept open, the least recently read one is closed to open another
+# a file is never closed while a thread reads from it, so more can be open at once while many reads are running
+class IndexFilePool:
+    def __init__(self, max_open_files=64):
+        self._lock = threading.Lock()           # the open files and counters are changed by every read
+        self._files = OrderedDict()             # {path : IndexFile}, least recently read first
+        self._readers = {}                      # {path : number of reads in progress}
+        self._max_open_files = max_open_files   # maximum number of files kept open
+        self._opens = 0                         # number of times a file was opened
+        self._closes = 0                        # number of files closed to respect the limit
+        self._peak_open = 0                     # most files open at once
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # return length bytes of a file starting at offset
+    def read(self, path, offset, length):
+        index_file = self._acquire(path)
+        try:
+            return index_file.read(offset, length)
+        finally:
+            self._release(path)
+
+    # return the whole file
+    def read_all(self, path):
+        index_file = self._acquire(path)
+        try:
+            return index_file.read_all()
+        finally:
+            self._release(path)
+
+    # size of a file in bytes
+    def get_size(self, path):
+        index_file = self._acquire(path)
+        try:
+            return index_file.get_size()
+        finally:
+            self._release(path)
+
+    # return the pool counters
+    def get_stats(self):
+        with self._lock:
+            return {'open': len(self._files), 'peak_open': self._peak_open, 'opens': self._opens,
+                    'closes': self._closes, 'max_open_files': self._max_open_files}
+
+    # close every file, they are opened again by the next read
+    def close(self):
+        with self._lock:
+            for index_file in self._files.values():
+                index_file.close()
+            self._files.clear()
+            self._readers.clear()
+
+    # return the open file of a path, opening it if needed, and count a read in progress
+    def _acquire(self, path):
+        with self._lock:
+            index_file = self._files.get(path)
+            if index_file is None:
+                index_file = self._files[path] = IndexFile(path)
+                self._opens += 1
+            else:
+                self._files.move_to_end(path)
+            self._readers[path] = self._readers.get(path, 0) + 1
+            self._close_idle_files()
+            self._peak_open = max(self._peak_open, len(self._files))
+            return index_file
+
+    # count a read of a path as done
+    def _release(self, path):
+        with self._lock:
+            readers = self._readers.pop(path, 0) - 1
+            if readers > 0:
+                self._readers[path] = readers
+            self._close_idle_files()
+
+    # close the least recently read files no thread is reading until the limit is respected, called under the lock
+    def _close_idle_files(self):
+        if len(self._files) <= self._max_open_files:
+            return
+        for path in [path for path in self._files if path not in self._readers]:
+            self._files.pop(path).close()
+            self._closes += 1
+            if len(self._files) <= self._max_open_files:
+                return
@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import uuid
+from pathlib import Path
+
+# version of the manifest layout, manifests of another version are ignored
+MANIFEST_VERSION = 1
+
+# a segment is a set of files searched together, named after its index format ('text', 'binary', 'fielded' or
+# 'impact'), or this one for the position index
+POSITIONS_SEGMENT = 'positions'
+
+
+# describes one complete build of the indexes, written once the build is done so the search engine can open it
+# without searching the index directories for their files
+# each segment lists its files with their size in bytes and their number of tokens per field
+# the generation id is new for every build, results cached for another generation are stale
+class IndexManifest:
+    def __init__(self, num_docs=0, index_format='text'):
+        self._generation = uuid.uuid4().hex     # identifies the build
+        self._created = None                    # when the build finished writing its indexes
+        self._num_docs = num_docs               # documents in the indexes
+        self._index_format = index_format       # format the indexes were built for
+        self._segments = {}                     # {segment : {file : {'bytes' : size, 'terms' : {field : count}}}}
+        self._files = {}                        # {file : size} of the files shared by every segment
+
+    # add a segment made of every file in the directories, the lexicon gives the tokens of each file
+    def add_segment(self, segment, directories, lexicon):
+        file_term_counts = lexicon.get_file_term_counts() if lexicon is not None else {}
+        files = {}
+        for directory in directories:
+            for file in sorted(Path(directory).rglob('*')):
+                if file.is_file():
+                    files[str(file)] = {'bytes': file.stat().st_size, 'terms': file_term_counts.get(str(file), {})}
+        self._segments[segment] = files
+
+    # add a file shared by every segment, e.g. the document store, if it exists
+    def add_file(self, file_name):
+        if os.path.exists(file_name):
+            self._files[file_name] = os.path.getsize(file_name)
+
+    # identifies the build
+    def get_generation(self):
+        return self._generation
+
+    # number of documents in the indexes
+    def get_document_count(self):
+        return self._num_docs
+
+    # return True if the build wrote the segment
+    def has_segment(self, segment):
+        return segment in self._segments
+
+    # return the files of a segment {file : {'bytes' : size, 'terms' : {field : count}}}, paths relative to the
+    # directory of the indexes
+    def get_segment_files(self, segment):
+        return self._segments.get(segment, {})
+
+    # return the number of files and bytes of every segment, and of the shared files
+    def get_summary(self):
+        summary = {segment: {'files': len(files), 'bytes': sum(info['bytes'] for info in files.values()),
+                             'terms': sum(sum(info['terms'].values()) for info in files.values())}
+                   for segment, files in self._segments.items()}
+        summary['shared'] = {'files': len(self._files), 'bytes': sum(self._files.values())}
+        return summary
+
+    # write the manifest to a JSON file
+    # it is written to a temporary file first, a manifest is never read half written
+    def write_manifest_to_file(self, file_name='IndexManifest.json'):
+        self._created = time.time()
+        manifest = {'version': MANIFEST_VERSION, 'generation': self._generation, 'created': self._created,
+                    'documents': self._num_docs, 'index_format': self._index_format, 'segments': self._segments,
+                    'files': self._files}
+        temporary_name = file_name + '.tmp'
+        with open(temporary_name, 'w', encoding='utf-8') as output:
+            json.dump(manifest, output, indent=1)
+        os.replace(temporary_name, file_name)
+
+    # load the manifest from a JSON file, returns False if it does not exist or is of another version
+    def load_manifest_from_file(self, file_name='IndexManifest.json'):
+        try:
+            with open(file_name, 'r', encoding='utf-8') as manifest_file:
+                manifest = json.load(manifest_file)
+        except (FileNotFoundError, ValueError):
+            return False
+        if manifest.get('version') != MANIFEST_VERSION:
+            return False
+
+        self._generation = manifest['generation']
+        self._created = manifest['created']
+        self._num_docs = manifest['documents']
+        self._index_format = manifest['index_format']
+        self._segments = manifest['segments']
+        self._files = manifest['files']
+        return True
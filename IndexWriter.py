@@ -0,0 +1,75 @@
+import os
+from collections import OrderedDict
+
+
+# buffers text written to many files and writes it grouped by file
+# at most max_open_files handles are kept open, the least recently used one is closed to open another
+class BufferedFileWriter:
+    def __init__(self, max_open_files=64, buffer_size=4 * 1024 * 1024):
+        self._buffers = {}                      # {file_name : [text]} waiting to be written
+        self._buffered = 0                      # characters currently buffered across every file
+        self._buffer_size = buffer_size         # flush every buffer once this many characters are buffered
+        self._handles = OrderedDict()           # {file_name : file handle}, least recently used first
+        self._max_open_files = max_open_files   # maximum number of handles kept open
+        self._directories = set()               # directories already created
+        self._bytes_written = 0                 # characters written to disk
+        self._opens = 0                         # number of times a file was opened
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # buffer text to be appended to a file
+    def write(self, file_name, text):
+        buffer = self._buffers.get(file_name)
+        if buffer is None:
+            buffer = self._buffers[file_name] = []
+        buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self._buffer_size:
+            self.flush()
+
+    # write every buffer to its file, one write per file
+    def flush(self):
+        for file_name, buffer in self._buffers.items():
+            text = ''.join(buffer)
+            self._get_handle(file_name).write(text)
+            self._bytes_written += len(text)
+        self._buffers = {}
+        self._buffered = 0
+
+    # flush the buffers and close every open handle
+    def close(self):
+        self.flush()
+        for handle in self._handles.values():
+            handle.close()
+        self._handles.clear()
+
+    # return the writer counters
+    def get_stats(self):
+        return {'bytes_written': self._bytes_written, 'opens': self._opens}
+
+    # return an open handle for a file from the pool, opening it if needed
+    def _get_handle(self, file_name):
+        handle = self._handles.get(file_name)
+        if handle is not None:
+            self._handles.move_to_end(file_name)
+            return handle
+
+        # close the least recently used handle once the pool is full
+        if len(self._handles) >= self._max_open_files:
+            _, least_recent = self._handles.popitem(last=False)
+            least_recent.close()
+
+        # create the file's directory the first time it is seen
+        directory = os.path.dirname(file_name)
+        if directory and directory not in self._directories:
+            os.makedirs(directory, exist_ok=True)
+            self._directories.add(directory)
+
+        handle = open(file_name, 'a', encoding='utf-8')
+        self._handles[file_name] = handle
+        self._opens += 1
+        return handle
@@ -1,37 +1,171 @@
 import os.path
 import re
 import json
-from Postings import Postings
+from Postings import Postings, IMPORTANCE_TAGS
 from DocManager import DocManager
-from nltk.stem import PorterStemmer
+from Lexicon import Lexicon
+from BinaryPostings import convert_text_index_to_binary, encode_skips, get_skips_field, FIELDS
+from FieldedPostings import convert_text_index_to_fielded
+from ImpactPostings import convert_text_index_to_impact
+from PositionalPostings import encode_positions, POSITIONS
+from ScoreBounds import ScoreBounds
+from Scoring import calculate_tfidf_weight, IMPORTANCE_WEIGHTS
+from Normalizer import Normalizer
+from IndexWriter import BufferedFileWriter
+from Instrumentation import Instrumentation
+from HtmlTokenizer import HtmlTokenizer
+from IndexManifest import IndexManifest, POSITIONS_SEGMENT
 from pathlib import Path
 from bs4 import BeautifulSoup
 from collections import defaultdict
 import math
+import time
+import shutil
+import heapq
+from itertools import groupby
+from operator import itemgetter
+from multiprocessing import Pool
+
+# resource is only available on unix, peak memory is not reported without it
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# partial dumps are written here as sorted runs, then merged into the indexes
+RUNS_FOLDER = 'Runs'
+
+# estimated bytes of in memory postings held before the partial index is spilled to a run
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
 
 
 # creates partial indexes
 class Indexer:
-    def __init__(self):
+    # index_format is 'text', 'binary', 'fielded' or 'impact', the last three are converted from the merged text index
+    # memory_budget is the estimated size in bytes the in memory postings can reach before they are spilled
+    # positional also keeps the position of every token in its document, written to the optional position index
+    # Position_Index used for phrase queries
+    # instrumentation receives the time of each stage of the build, nothing is recorded without it
+    # tokenizer is 'streaming' to tokenize documents in a single pass over the HTML, or 'bs4' to build a beautiful
+    # soup tree of every document, both index the same tokens
+    def __init__(self, index_format='text', memory_budget=DEFAULT_MEMORY_BUDGET, positional=False,
+                 instrumentation=None, tokenizer='streaming'):
         self._index = {}                                    # {token : Postings()}
         self._doc_manager = DocManager()                    # Indexer has a document manager
+        self._lexicon = Lexicon()                           # term dictionary built while merging
+        self._normalizer = Normalizer()                     # memoized stemming of raw tokens
         self._current_size = 0                              # Track number of JSON files visited (partial index dump)
-        self._threshold = 5000                              # JSON File limit (partial index dump)
+        self._memory_used = 0                               # estimated bytes of the in memory postings
+        self._memory_budget = memory_budget                 # spill the partial index once memory_used reaches this
+        self._run_count = 0                                 # number of partial dumps (sorted runs) written
+        self._run_prefix = ''                               # prefix of run names, identifies a parallel worker
+        self._spills = []                                   # report of every run spilled
+        self._chunk_size = 5000                             # JSON files handed to a parallel worker at a time
         self._num_docs = 0                                  # number of documents indexed
+        self._doc_ids = None                                # [doc_id] of each provisional doc_id of a parallel build
+        self._position_offsets = None                       # [tokens of the earlier visits] of each provisional doc_id
+        self._doc_lengths = {}                              # {doc_id : tokens of its visits}, only for positions
+        self._index_format = index_format                   # on disk format of the final index
+        self._positional = positional                       # keep token positions for the position index
+        self._timings = defaultdict(float)                  # {stage : seconds} spent in each stage of the build
+        self._instrumentation = instrumentation or Instrumentation()    # reports the stages of the build
+        self._tokenizer = tokenizer                         # 'streaming' or 'bs4'
+        self._html_tokenizer = HtmlTokenizer() if tokenizer == 'streaming' else None
+        self._manifest = None                               # segments written by the build, see IndexManifest.py
 
     # create index
-    def create_index(self, directory):
+    # workers > 1 spreads the JSON files across a process pool, the final index is identical to the serial one
+    # with instrumentation, the seconds of each stage are reported as index.<stage> once the index is built, and
+    # the merge of each field is timed as merge.<field> as it happens
+    def create_index(self, directory, workers=1):
         # check if directory exists
         path = Path(directory)
         if not path.exists():
             print("Invalid Directory!")
             return
+        self._instrumentation.start_trace('create_index', directory=str(directory), workers=workers,
+                                          index_format=self._index_format)
 
-        # Tokenization regex pattern
-        token_pattern = r'\b[a-zA-Z0-9]+\b'
+        # runs left behind by an interrupted build would be appended to and merged with this build's runs
+        shutil.rmtree(RUNS_FOLDER, ignore_errors=True)
+
+        if workers > 1:
+            self._create_index_parallel(path, workers)
+        else:
+            self._create_index_serial(path)
+        self._print_spill_summary()
+
+        self._write_doc_manager_to_file()
 
+        # persist the stems so the search engine can pre-warm its normalizer
+        self._normalizer.write_cache_to_file()
+        print(f"Stem cache: {self._normalizer.get_stats()}")
+
+        # merge indexes, recording the best score of every token so searches for the top results can skip documents
+        started = time.perf_counter()
+        self._manifest = IndexManifest(self._num_docs + 1, self._index_format)
+        self._merge_indexes()
+        merged = time.perf_counter()
+        self._timings['merge'] += merged - started
+
+        # write the compact binary postings alongside the text indexes
+        if self._index_format == 'binary':
+            self._manifest.add_segment('binary', ['Binary_Index'], convert_text_index_to_binary())
+
+        # write one record per (token, doc_id) holding every field alongside the text indexes
+        if self._index_format == 'fielded':
+            self._manifest.add_segment('fielded', ['Fielded_Index'], convert_text_index_to_fielded())
+
+        # write precomputed impacts ordered by impact, for score at a time searches
+        if self._index_format == 'impact':
+            self._manifest.add_segment('impact', ['Impact_Index'],
+                                       convert_text_index_to_impact(IMPORTANCE_WEIGHTS, calculate_tfidf_weight))
+        self._timings['convert'] += time.perf_counter() - merged
+
+        # the manifest is written last, once every file it lists is complete
+        self._write_manifest()
+        self._print_timings()
+        self._record_timings()
+
+    # report the time of each stage and the size of the build to the instrumentation
+    def _record_timings(self):
+        instrumentation = self._instrumentation
+        if not instrumentation.enabled:
+            return
+        for stage, seconds in self._timings.items():
+            instrumentation.record_time(f'index.{stage}', seconds)
+        instrumentation.increment('index.documents', self._num_docs + 1)
+        instrumentation.increment('index.runs', len(self._spills))
+        instrumentation.end_trace()
+
+    # return the seconds spent in each stage of the last build {stage : seconds}
+    # read, parse, tokenize, stem and index add up the time spent on the documents, spill the time writing runs,
+    # merge and convert the time spent after every document was indexed
+    # with a process pool the stages run in the workers are added up across workers
+    def get_timings(self):
+        return dict(self._timings)
+
+    # print the time spent in each stage of the build
+    def _print_timings(self):
+        total = sum(self._timings.values())
+        print(f"Build stages ({total:.1f}s): " + ', '.join(
+            f"{stage} {seconds:.2f}s ({100 * seconds / max(total, 1e-9):.0f}%)"
+            for stage, seconds in self._timings.items()))
+
+    # list every segment and shared file of the build in the index manifest, with a new generation id
+    def _write_manifest(self):
+        for file_name in ['Lexicon.txt', 'ScoreBounds.txt', 'StemCache.txt', 'DocumentManager.txt',
+                          'DocumentStore.bin']:
+            self._manifest.add_file(file_name)
+        self._manifest.write_manifest_to_file()
+        print(f"Index manifest written! generation {self._manifest.get_generation()}: "
+              f"{self._manifest.get_summary()}")
+
+    # index each JSON file in the directory one by one, spilling partial indexes as the memory budget is reached
+    def _create_index_serial(self, path):
         # Recursively go through each JSON file in the directory
         for file in path.rglob('*.json'):
+            started = time.perf_counter()
             with open(file, 'r', encoding='utf-8') as curr_json_file:
                 # For tracking progress
                 print(curr_json_file.name)
@@ -43,168 +177,457 @@ class Indexer:
                 # keep track of largest doc_id assigned (used for idf calculation at the end)
                 if self._num_docs < doc_id:
                     self._num_docs = doc_id
+                self._timings['read'] += time.perf_counter() - started
+
+                self._index_document(data['content'], doc_id)
 
-                # Parse HTML content
-                # lxml parser handles broken html
-                soup = BeautifulSoup(data['content'], 'lxml')
-
-                # parse important tags first
-                importance = ['title', 'h1', 'h2', 'h3', 'b', 'i', 'strong', 'em']
-                for tag in importance:
-                    important_words = soup.find_all(tag)
-                    for word in important_words:
-                        word = word.getText()
-                        token_list = re.findall(token_pattern, word)
-                        for token in token_list:
-                            token = self._normalize_token(token)
-                            # add importance posting to token
-                            self._add_token_to_index(token, doc_id, posting='importance', tag=tag)
-
-                # Process each section of the html
-                # a section is html content between tags as to not load entire html content at once
-                for section in soup.stripped_strings:
-                    token_list = re.findall(token_pattern, section)
-
-                    # Process each token in the section
-                    for token in token_list:
-                        token = self._normalize_token(token)
-                        # add frequency posting to token
-                        self._add_token_to_index(token, doc_id, posting='frequency')
-
-            # check if threshold has been reached - if it has, dump partial index
+            # check if the memory budget has been reached - if it has, spill partial index
             self._current_size += 1
-            if self._current_size >= self._threshold:
-                self._write_frequency_index_to_file()
-                self._write_importance_index_to_file()
-                self._reset_index()
+            if self._memory_used >= self._memory_budget:
+                self._spill()
 
         # Final write after indexing is complete
-        self._write_frequency_index_to_file()
-        self._write_importance_index_to_file()
-        self._write_doc_manager_to_file()
+        self._spill()
+
+    # index the JSON files with a process pool
+    # each file gets a provisional doc_id, its position in the serial mode's file order, without being read, then
+    # each worker indexes a chunk of files, spills it as sorted runs and returns the urls of its files
+    # the parent registers the urls in chunk order, so the documents get the serial mode's doc_ids, and the runs
+    # are merged exactly like the serial mode's runs, with the provisional doc_ids of files sharing a url
+    # replaced by the doc_id of the first one
+    # the memory budget is shared between the workers
+    def _create_index_parallel(self, path, workers):
+        files = [(str(file), doc_id) for doc_id, file in enumerate(path.rglob('*.json'))]
+
+        # split the files into chunks, one worker task each
+        worker_budget = self._memory_budget // workers
+        chunks = [(chunk_number, files[start:start + self._chunk_size], worker_budget, self._positional,
+                   self._tokenizer)
+                  for chunk_number, start in enumerate(range(0, len(files), self._chunk_size))]
+
+        doc_ids = []
+        position_offsets = []
+        with Pool(processes=workers) as pool:
+            # results are taken in chunk order, so the stems are added in the same order on every build
+            for chunk_number, urls, lengths, stems, spills, timings in pool.imap(_index_chunk, chunks):
+                for (file_name, _), url, length in zip(chunks[chunk_number][1], urls, lengths):
+                    doc_id = self._doc_manager.add_url(Path(file_name).name, url)
+                    if self._num_docs < doc_id:
+                        self._num_docs = doc_id
+                    doc_ids.append(doc_id)
+                    # a duplicate url's positions follow the tokens of the document's earlier visits
+                    position_offsets.append(self._doc_lengths.get(doc_id, 0))
+                    self._doc_lengths[doc_id] = position_offsets[-1] + length
+                self._normalizer.add_stems(stems)
+                self._spills.extend(spills)
+                for stage, seconds in timings.items():
+                    self._timings[stage] += seconds
+                print(f"Chunk {chunk_number + 1}/{len(chunks)} indexed")
+        self._spills.sort(key=lambda spill: spill['run'])
+        self._run_count = len(self._spills)
+
+        # the provisional doc_ids are final unless files shared a url
+        if doc_ids != list(range(len(doc_ids))):
+            self._doc_ids = doc_ids
+            self._position_offsets = position_offsets
+
+    # parse a document's HTML content and add its tokens to the index
+    # the importance tokens are added first, tag by tag, then the text tokens in document order, with either
+    # tokenizer, so the stems are also cached in the same order
+    # the time of each stage is added up element by element, the clock is read once between two stages
+    def _index_document(self, content, doc_id):
+        if self._tokenizer == 'bs4':
+            self._index_document_soup(content, doc_id)
+            return
 
-        # merge indexes
-        self._merge_indexes()
+        # the streaming tokenizer parses and tokenizes in the same pass, its time is counted as parse
+        timings = self._timings
+        clock = time.perf_counter()
+        text_tokens, importance_tokens = self._html_tokenizer.tokenize(content)
+        now = time.perf_counter()
+        timings['parse'] += now - clock
+
+        for tag in IMPORTANCE_TAGS:
+            for token_list in importance_tokens[tag]:
+                clock = time.perf_counter()
+                timings['index'] += clock - now
+                token_list = [self._normalize_token(token) for token in token_list]
+                now = time.perf_counter()
+                timings['stem'] += now - clock
+                for token in token_list:
+                    # add importance posting to token
+                    self._add_token_to_index(token, doc_id, posting='importance', tag=tag)
+
+        clock = time.perf_counter()
+        timings['index'] += clock - now
+        text_tokens = [self._normalize_token(token) for token in text_tokens]
+        now = time.perf_counter()
+        timings['stem'] += now - clock
+
+        # positions of each token in the text of the document {token : [positions]}, only for a positional index
+        doc_positions = defaultdict(list)
+        for position, token in enumerate(text_tokens):
+            # add frequency posting to token
+            self._add_token_to_index(token, doc_id, posting='frequency')
+            if self._positional:
+                doc_positions[token].append(position)
+
+        self._add_document_positions(doc_id, doc_positions, len(text_tokens))
+        timings['index'] += time.perf_counter() - now
+
+    # parse a document's HTML content with beautiful soup and add its tokens to the index
+    # the tree is searched once per importance tag, then its strings are read in document order
+    def _index_document_soup(self, content, doc_id):
+        timings = self._timings
+        clock = time.perf_counter()
+
+        # Tokenization regex pattern
+        token_pattern = r'\b[a-zA-Z0-9]+\b'
+
+        # Parse HTML content
+        # lxml parser handles broken html
+        soup = BeautifulSoup(content, 'lxml')
+
+        # parse important tags first
+        importance = ['title', 'h1', 'h2', 'h3', 'b', 'i', 'strong', 'em']
+        for tag in importance:
+            important_words = soup.find_all(tag)
+            for word in important_words:
+                word = word.getText()
+                now = time.perf_counter()
+                timings['parse'] += now - clock
+                token_list = re.findall(token_pattern, word)
+                clock = time.perf_counter()
+                timings['tokenize'] += clock - now
+                token_list = [self._normalize_token(token) for token in token_list]
+                now = time.perf_counter()
+                timings['stem'] += now - clock
+                for token in token_list:
+                    # add importance posting to token
+                    self._add_token_to_index(token, doc_id, posting='importance', tag=tag)
+                clock = time.perf_counter()
+                timings['index'] += clock - now
+
+        # positions of each token in the text of the document {token : [positions]}, only for a positional index
+        doc_positions = defaultdict(list)
+        position = 0
+
+        # Process each section of the html
+        # a section is html content between tags as to not load entire html content at once
+        for section in soup.stripped_strings:
+            now = time.perf_counter()
+            timings['parse'] += now - clock
+            token_list = re.findall(token_pattern, section)
+            clock = time.perf_counter()
+            timings['tokenize'] += clock - now
+            token_list = [self._normalize_token(token) for token in token_list]
+            now = time.perf_counter()
+            timings['stem'] += now - clock
+
+            # Process each token in the section
+            for token in token_list:
+                # add frequency posting to token
+                self._add_token_to_index(token, doc_id, posting='frequency')
+                if self._positional:
+                    doc_positions[token].append(position)
+                    position += 1
+            clock = time.perf_counter()
+            timings['index'] += clock - now
+
+        # positions are counted across sections, a phrase can span the end of a tag
+        self._add_document_positions(doc_id, doc_positions, position)
+        timings['index'] += time.perf_counter() - clock
+
+    # add the positions of every token of a document {token : [positions]} to the index
+    # a duplicate url revisiting a doc_id has all its positions placed after the num_tokens of the earlier visits
+    def _add_document_positions(self, doc_id, doc_positions, num_tokens):
+        if not self._positional:
+            return
+        offset = self._doc_lengths.get(doc_id, 0)
+        for token, positions in doc_positions.items():
+            self._memory_used += self._index[token].add_positions(doc_id, positions, offset)
+        self._doc_lengths[doc_id] = offset + num_tokens
 
     # adds a token to the index
     def _add_token_to_index(self, token, doc_id, *, posting, tag=None):
         # if a token does not exist in the index, create an entry for it with an empty postings
         if token not in self._index:
             self._index[token] = Postings()
+            self._memory_used += Postings.TOKEN_BYTES
 
         # get the current token's postings
         token_postings = self._get_token_postings(token)
 
         # update the token's frequency postings
         if posting == 'frequency':
-            token_postings.increment_frequency_posting(doc_id)
+            self._memory_used += token_postings.increment_frequency_posting(doc_id)
 
         # update the token's importance postings
         if posting == 'importance':
-            token_postings.increment_importance_postings(doc_id, tag)
+            self._memory_used += token_postings.increment_importance_postings(doc_id, tag)
 
-    # write the frequency index to file
-    def _write_frequency_index_to_file(self, output_folder="Frequency_Index"):
-        # locate the frequency index directory
-        cwd = os.getcwd()
-        path = Path(os.path.join(cwd, output_folder))
+    # write the current partial index as a sorted run, e.g. Runs/00003/Frequency_Index/a.txt, then reset it
+    def _spill(self):
+        if not self._index:
+            return
 
-        # make the directory if it does not exist
-        path.mkdir(parents=False, exist_ok=True)
+        started = time.perf_counter()
+        run_name = f'{self._run_prefix}{self._run_count:05d}'
+        run_folder = os.path.join(RUNS_FOLDER, run_name)
+        # output is buffered and grouped by letter file, so each file is opened once per flush
+        with BufferedFileWriter() as writer:
+            self._write_frequency_index_to_file(writer, os.path.join(run_folder, 'Frequency_Index'))
+            self._write_importance_index_to_file(writer, os.path.join(run_folder, 'Importance_Index'))
+            if self._positional:
+                self._write_position_index_to_file(writer, os.path.join(run_folder, 'Position_Index'))
+        self._run_count += 1
+
+        # report the spill, the estimated memory is the run's peak since postings only grow until a spill
+        spill = {
+            'run': run_name,
+            'documents': self._current_size,
+            'tokens': len(self._index),
+            'memory': self._memory_used,
+            'bytes': writer.get_stats()['bytes_written'],
+        }
+        self._spills.append(spill)
+        print(f"Spilled run {run_name}: {spill['documents']} documents, {spill['tokens']} tokens, "
+              f"{spill['memory'] / 2 ** 20:.1f} MB estimated in memory, {spill['bytes'] / 2 ** 20:.1f} MB written")
+
+        self._reset_index()
+        self._timings['spill'] += time.perf_counter() - started
+
+    # print the peak memory of every run spilled while indexing
+    def _print_spill_summary(self):
+        print(f"{len(self._spills)} runs spilled (memory budget {self._memory_budget / 2 ** 20:.1f} MB)")
+        for spill in self._spills:
+            print(f"  run {spill['run']}: {spill['documents']} documents, {spill['tokens']} tokens, "
+                  f"peak {spill['memory'] / 2 ** 20:.1f} MB estimated, {spill['bytes'] / 2 ** 20:.1f} MB written")
+
+        # ru_maxrss is reported in kilobytes on linux
+        if resource is not None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+            print(f"  peak resident memory: {peak:.1f} MB, largest worker: {children_peak:.1f} MB")
 
+    # write the frequency index to file
+    # tokens are written in sorted order with their raw counts, tf is applied once the runs are merged
+    def _write_frequency_index_to_file(self, writer, output_folder="Frequency_Index"):
         # write token and frequency postings to file from the current partial index
-        for token, postings in self._index.items():
-            # get the first letter of the token and open the corresponding file
+        for token in sorted(self._index):
+            postings = self._index[token]
+            # get the first letter of the token and buffer the postings for the corresponding file
             first_letter = token[0]
             file_name = os.path.join(output_folder, f'{first_letter}.txt')
-            with open(file_name, 'a', encoding='utf-8') as output:
-                # write token, doc_id and frequency to file
-                output.write(f'token = {token}\n')
-                for docID, frequency in postings.get_frequency_posting().items():
-                    frequency = self._calc_tf(frequency)
-                    output.write(f'({docID},{frequency})\n')
+            # write token, doc_id and frequency to file
+            lines = [f'token = {token}\n']
+            for docID, frequency in postings.get_frequency_posting():
+                lines.append(f'({docID},{frequency})\n')
+            writer.write(file_name, ''.join(lines))
 
     # write the importance index to file
-    def _write_importance_index_to_file(self, output_folder='Importance_Index'):
-        # locate the importance index directory
-        cwd = os.getcwd()
-        path = Path(os.path.join(cwd, output_folder))
-
-        # make the root directory if it does not exist
-        if not path.is_dir():
-            path.mkdir()
-
+    # tokens are written in sorted order so every tag file is a sorted run
+    def _write_importance_index_to_file(self, writer, output_folder='Importance_Index'):
         # write token and importance postings to file from the current partial index
-        for token, postings in self._index.items():
-            # get doc_id and tag_info for token [e.g. doc_id = 17, tag_info = (h1, 4)]
-            for doc_id, tag_info in postings.get_importance_posting().items():
-                # extract tag and frequency from tag_info
-                for tag, frequency in tag_info.items():
-                    # create subdirectory for the tag if it does not exist
-                    path = Path(os.path.join(cwd, output_folder, tag))
-                    if not path.is_dir():
-                        path.mkdir()
-
-                    # get the first letter of the token and open the file under its corresponding tag
-                    first_letter = token[0]
-                    file_name = os.path.join(cwd, output_folder, tag, f'{first_letter}.txt')
-                    with open(file_name, 'a', encoding='utf-8') as output:
-                        # write token, doc_id, and frequency to file
-                        output.write(f'token = {token}\n')
-                        output.write(f'({doc_id},{frequency})\n')
-
-    # merge indexes for frequency index and importance index
+        for token in sorted(self._index):
+            postings = self._index[token]
+            # group the token's postings by tag [e.g. {h1 : ['(17,4)']}]
+            tag_postings = defaultdict(list)
+            for doc_id, tag, frequency in postings.get_importance_posting():
+                tag_postings[tag].append(f'({doc_id},{frequency})\n')
+
+            # get the first letter of the token and buffer the postings for the file under each tag
+            first_letter = token[0]
+            for tag, lines in tag_postings.items():
+                file_name = os.path.join(output_folder, tag, f'{first_letter}.txt')
+                # write token, doc_id, and frequency to file
+                writer.write(file_name, f'token = {token}\n' + ''.join(lines))
+
+    # write the positions of every token of the current partial index
+    # position runs end with .pos so they are not merged with the frequency and importance runs
+    def _write_position_index_to_file(self, writer, output_folder='Position_Index'):
+        for token in sorted(self._index):
+            lines = [f'token = {token}\n']
+            for doc_id, positions in self._index[token].get_positions():
+                lines.append(f'({doc_id},{" ".join(map(str, positions))})\n')
+            if len(lines) > 1:
+                writer.write(os.path.join(output_folder, f'{token[0]}.pos'), ''.join(lines))
+
+    # merge the sorted runs into the frequency index and importance index
+    # each letter file is produced by a streaming k-way merge of that letter file from every run,
+    # only the current token of each run is held in memory
+    # the letter files of every field are merged side by side, so each token's postings of every field are at hand
+    # at once and its score bound, the best score it adds to a document, is computed without reading the merged
+    # indexes again
     def _merge_indexes(self, frequency="Frequency_Index", importance="Importance_Index"):
-        # Ensure the directories exists
-        if not os.path.exists(frequency) or not os.path.exists(importance):
-            print(f"Output folder '{frequency} or {importance}' does not exist!")
+        # Ensure the runs exist
+        if not os.path.exists(RUNS_FOLDER):
+            print(f"Runs folder '{RUNS_FOLDER}' does not exist!")
             return
 
-        # Process each file in each directory
-        folders = [frequency, importance]
-        for directory in folders:
-            # enter directory
-            path = Path(os.path.join(os.getcwd(), directory))
-
-            # recursively go through each txt file in directory
-            for file_name in path.rglob('*.txt'):
-                file_path = os.path.join(directory, file_name)
-
-                # Dictionary to store merged postings for tokens
-                merged_postings = defaultdict(dict)
-
-                # Read the file and aggregate postings
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    current_token = None
-                    for line in file:
-                        # get token
-                        if line.startswith('token ='):
-                            current_token = line.strip().split(' = ')[1]
-                        # get doc_id and frequency
-                        elif current_token and line.startswith('('):  # Posting line
-                            posting = line.strip("()\n").split(',')
-                            doc_id = int(posting[0])
-                            freq = float(posting[1])
-                            # aggregate duplicate tokens
-                            merged_postings[current_token][doc_id] = (
-                                    round(merged_postings[current_token].get(doc_id, 0) + freq, 2)
-                            )
-
-                # Rewrite the file with merged postings
-                with open(file_path, 'w', encoding='utf-8') as file:
-                    # sort tokens based on doc_id
-                    for token in sorted(merged_postings.keys()):
-                        # write token, idf, doc_id, and frequency
-                        file.write(f'token = {token}\n')
-                        doc_frequency = len(merged_postings.get(token))
-                        idf = round(self._calc_idf(doc_frequency), 2)
-                        file.write(f"idf = {idf}\n")
-                        for doc_id, freq in sorted(merged_postings[token].items()):  # Sorted postings
-                            file.write(f'({doc_id},{freq})\n')
-                        file.write('\n')
+        # group every run's letter files by the index file they are merged into, in run order, and the index files
+        # by letter, in field order
+        # e.g. {a.txt : {Frequency_Index/a.txt : [Runs/00000/Frequency_Index/a.txt, Runs/00001/...]}}
+        letter_files = defaultdict(lambda: defaultdict(list))
+        for run_folder in sorted(Path(RUNS_FOLDER).iterdir()):
+            for file_name in sorted(run_folder.rglob('*.txt')):
+                index_file = file_name.relative_to(run_folder)
+                letter_files[index_file.name][index_file].append(file_name)
+
+        score_bounds = ScoreBounds(IMPORTANCE_WEIGHTS, calculate_tfidf_weight)
+        for _, run_files in sorted(letter_files.items()):
+            # (token, field_index, idf, postings) of every field, merged token by token
+            merged_fields = []
+            for index_file, files in sorted(run_files.items()):
+                # field the file belongs to, 'frequency' or the importance tag (its parent directory)
+                field = 'frequency' if index_file.parts[0] == frequency else index_file.parent.name
+                merged_fields.append(self._merge_index_file(index_file, files, field))
+            for token, field_entries in groupby(heapq.merge(*merged_fields), key=itemgetter(0)):
+                score_bounds.add_field_postings(token, field_entries)
+
+        instrumentation = self._instrumentation
+
+        # the position runs are merged into their own index
+        if self._positional:
+            with instrumentation.timer('merge.positions'):
+                position_lexicon = self._merge_positions(frequency, importance)
+            self._manifest.add_segment(POSITIONS_SEGMENT, ['Position_Index'], position_lexicon)
+
+        # the runs are no longer needed once merged
+        with instrumentation.timer('merge.cleanup'):
+            shutil.rmtree(RUNS_FOLDER)
+
+        # write the term dictionary for the merged indexes
+        with instrumentation.timer('merge.lexicon'):
+            self._lexicon.write_lexicon_to_file()
+        self._manifest.add_segment('text', [frequency, importance], self._lexicon)
 
         print(f"Postings merged!")
 
+        score_bounds.write_score_bounds_to_file()
+        print("Score bounds written!")
+
+    # merge the sorted runs of one index file, e.g. Frequency_Index/a.txt, into the file and the lexicon
+    # yields (token, field_index, idf, [(doc_id, tf)]) once each token is written, the time spent merging the file
+    # is recorded once it is done
+    def _merge_index_file(self, index_file, files, field):
+        field_index = FIELDS.index(field)
+        relative_path = str(index_file)
+        index_file.parent.mkdir(parents=True, exist_ok=True)
+        started = time.perf_counter()
+        elapsed = 0.0
+        num_tokens = 0
+
+        # heap merge the runs by token, ties come out in run order
+        runs = [_read_run_file(file_name, run_index, self._doc_ids) for run_index, file_name in enumerate(files)]
+        merged_runs = groupby(heapq.merge(*runs), key=lambda run_entry: run_entry[0])
+
+        # write the merged file
+        # written as bytes so the lexicon can record the offset and length of every token's block
+        with open(index_file, 'wb') as file:
+            offset = 0
+            for token, run_entries in merged_runs:
+                # aggregate the token's counts across runs (a duplicate url can appear in several runs)
+                merged_postings = {}
+                for _, _, postings in run_entries:
+                    for doc_id, count in postings:
+                        merged_postings[doc_id] = merged_postings.get(doc_id, 0) + count
+
+                # tokens only seen inside importance tags have no frequency postings
+                if not merged_postings:
+                    continue
+
+                # write token, idf, doc_id, and frequency
+                doc_frequency = len(merged_postings)
+                idf = round(self._calc_idf(doc_frequency), 2)
+                block = [f'token = {token}\n', f'idf = {idf}\n']
+                postings = []
+                max_tf = 0.0
+                for doc_id, count in sorted(merged_postings.items()):  # Sorted postings
+                    if field == 'frequency':
+                        freq = round(self._calc_tf(count), 2)
+                    else:
+                        freq = float(count)
+                    max_tf = max(max_tf, freq)
+                    block.append(f'({doc_id},{freq})\n')
+                    postings.append((doc_id, freq))
+                block.append('\n')
+                block = ''.join(block).encode('utf-8')
+                file.write(block)
+
+                # record where the token's postings block lives, and its largest tf for score upper bounds
+                self._lexicon.add_entry(field, token, relative_path, offset, len(block), doc_frequency, idf,
+                                        (max_tf,))
+                offset += len(block)
+                num_tokens += 1
+
+                # the token's other fields are merged while it is handed over, that time is not this file's
+                elapsed += time.perf_counter() - started
+                yield token, field_index, idf, postings
+                started = time.perf_counter()
+        elapsed += time.perf_counter() - started
+        self._instrumentation.record_time(f'merge.{field}', elapsed)
+        self._instrumentation.increment(f'merge.{field}.tokens', num_tokens)
+
+    # merge the sorted position runs into the position index, Position_Index/positions.bin and its own lexicon,
+    # with the skip tables of its longer postings in Position_Index/positions.skips
+    # the runs of each letter are merged like the frequency index, the positions of a doc_id found in several runs
+    # (a duplicate url) were already moved past the tokens of its earlier visits, so they follow each other in
+    # run order
+    # returns the lexicon of the position index
+    def _merge_positions(self, frequency='Frequency_Index', importance='Importance_Index',
+                         output_folder='Position_Index'):
+        run_files = defaultdict(list)
+        for run_folder in sorted(Path(RUNS_FOLDER).iterdir()):
+            for file_name in sorted(run_folder.rglob('*.pos')):
+                run_files[file_name.name].append(file_name)
+
+        Path(output_folder).mkdir(parents=False, exist_ok=True)
+        lexicon = Lexicon()
+        positions_path = os.path.join(output_folder, 'positions.bin')
+        skips_path = os.path.join(output_folder, 'positions.skips')
+
+        with open(positions_path, 'wb') as output, open(skips_path, 'wb') as skips_output:
+            offset = 0
+            skips_offset = 0
+            for _, files in sorted(run_files.items()):
+                runs = [_read_position_run_file(file_name, run_index, self._doc_ids, self._position_offsets)
+                        for run_index, file_name in enumerate(files)]
+                for token, run_entries in groupby(heapq.merge(*runs), key=itemgetter(0)):
+                    merged_positions = {}
+                    for _, _, postings in run_entries:
+                        for doc_id, positions in postings:
+                            if doc_id in merged_positions:
+                                merged_positions[doc_id].extend(positions)
+                            else:
+                                merged_positions[doc_id] = positions
+
+                    skips = []
+                    encoded = encode_positions(sorted(merged_positions.items()), skips)
+                    output.write(encoded)
+                    idf = round(self._calc_idf(len(merged_positions)), 2)
+                    lexicon.add_entry(POSITIONS, token, positions_path, offset, len(encoded), len(merged_positions),
+                                      idf)
+                    offset += len(encoded)
+
+                    if skips:
+                        encoded_skips = encode_skips(skips)
+                        skips_output.write(encoded_skips)
+                        lexicon.add_entry(get_skips_field(POSITIONS), token, skips_path, skips_offset,
+                                          len(encoded_skips), len(skips), idf)
+                        skips_offset += len(encoded_skips)
+
+        lexicon.write_lexicon_to_file(os.path.join(output_folder, 'Lexicon.txt'))
+
+        # report the size the positions add to the merged text index
+        text_size = sum(os.path.getsize(file) for folder in [frequency, importance]
+                        for file in Path(folder).rglob('*.txt'))
+        positions_size = os.path.getsize(positions_path) + os.path.getsize(skips_path)
+        print(f"Position index written! positions: {os.path.getsize(positions_path)} bytes, "
+              f"skip tables: {os.path.getsize(skips_path)} bytes, "
+              f"{100 * positions_size / max(text_size, 1):.1f}% of the text index ({text_size} bytes)")
+        return lexicon
+
     # writes the document manager for this specific index into a text file
     def _write_doc_manager_to_file(self):
         self._doc_manager.write_doc_manager_to_file()
@@ -213,6 +636,7 @@ class Indexer:
     def _reset_index(self):
         self._index = {}
         self._current_size = 0
+        self._memory_used = 0
 
     # retrieve a token's postings value
     def _get_token_postings(self, token):
@@ -220,7 +644,7 @@ class Indexer:
 
     # normalize tokens by using porter stemmer
     def _normalize_token(self, token):
-        return PorterStemmer().stem(token.lower())
+        return self._normalizer.normalize(token)
 
     # calculates the term frequency for a given token's frequency
     def _calc_tf(self, count):
@@ -231,3 +655,82 @@ class Indexer:
     def _calc_idf(self, doc_count):
         # add 1 because num docs starts at 0
         return math.log10((self._num_docs + 1) / doc_count)
+
+
+# index one chunk of JSON files in a worker process, spilling sorted runs as its memory budget is reached
+# returns the chunk number, the url and number of tokens of each file so the parent can register the documents,
+# the worker's stems so the parent can persist them, the spill reports and the time spent in each stage
+def _index_chunk(chunk):
+    chunk_number, files, memory_budget, positional, tokenizer = chunk
+    indexer = Indexer(memory_budget=memory_budget, positional=positional, tokenizer=tokenizer)
+    indexer._run_prefix = f'{chunk_number:05d}-'
+    urls = []
+    for file_name, doc_id in files:
+        started = time.perf_counter()
+        with open(file_name, 'r', encoding='utf-8') as curr_json_file:
+            # For tracking progress
+            print(curr_json_file.name)
+            data = json.load(curr_json_file)
+        urls.append(data['url'])
+        indexer._timings['read'] += time.perf_counter() - started
+        indexer._index_document(data['content'], doc_id)
+        indexer._current_size += 1
+        if indexer._memory_used >= indexer._memory_budget:
+            indexer._spill()
+
+    indexer._spill()
+    lengths = [indexer._doc_lengths.get(doc_id, 0) for _, doc_id in files]
+    return chunk_number, urls, lengths, indexer._normalizer.get_stems(), indexer._spills, dict(indexer._timings)
+
+
+# reads a sorted run file and yields (token, run_index, [(doc_id, count)]) for each token
+# consecutive blocks of the same token (the importance runs repeat the token line per posting) are grouped
+# doc_ids [doc_id] replaces the provisional doc_ids of a parallel build, a duplicate url's postings then share a
+# doc_id and are no longer sorted, the merge adds them up
+def _read_run_file(file_name, run_index, doc_ids=None):
+    with open(file_name, 'r', encoding='utf-8') as file:
+        current_token = None
+        postings = []
+        for line in file:
+            # get token
+            if line.startswith('token ='):
+                token = line.strip().split(' = ')[1]
+                if token != current_token:
+                    if current_token is not None:
+                        yield current_token, run_index, postings
+                    current_token = token
+                    postings = []
+            # get doc_id and count
+            elif current_token and line.startswith('('):
+                posting = line.strip("()\n").split(',')
+                doc_id = int(posting[0])
+                postings.append((doc_ids[doc_id] if doc_ids else doc_id, int(posting[1])))
+        if current_token is not None:
+            yield current_token, run_index, postings
+
+
+# reads a sorted position run file and yields (token, run_index, [(doc_id, [positions])]) for each token
+# doc_ids [doc_id] replaces the provisional doc_ids of a parallel build like _read_run_file, and offsets moves the
+# positions of a duplicate url past the tokens of its earlier visits
+def _read_position_run_file(file_name, run_index, doc_ids=None, offsets=None):
+    with open(file_name, 'r', encoding='utf-8') as file:
+        current_token = None
+        postings = []
+        for line in file:
+            if line.startswith('token ='):
+                if current_token is not None:
+                    yield current_token, run_index, postings
+                current_token = line.strip().split(' = ')[1]
+                postings = []
+            elif current_token and line.startswith('('):
+                doc_id, positions = line.strip("()\n").split(',')
+                doc_id = int(doc_id)
+                if doc_ids:
+                    offset = offsets[doc_id]
+                    positions = [int(position) + offset for position in positions.split()]
+                    doc_id = doc_ids[doc_id]
+                else:
+                    positions = [int(position) for position in positions.split()]
+                postings.append((doc_id, positions))
+        if current_token is not None:
+            yield current_token, run_index, postings
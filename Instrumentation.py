@@ -0,0 +1,240 @@
+import sys
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+# buckets of the histogram sink per doubling of a duration, a bucket spans about 19% of its lower bound
+BUCKETS_PER_DOUBLING = 4
+
+
+# timers and counters of the stages of a search or a build, reported to pluggable sinks
+# a sink is any object with record_time(stage, seconds), record_count(counter, amount) and record_trace(trace)
+# methods, e.g. LogSink, HistogramSink or JsonLinesSink
+# with no sink and no trace, timer() hands out a shared timer doing nothing and increment() returns straight away,
+# so instrumented code costs a method call per stage
+# with trace, the stages and counters of each query or build are also gathered into one trace, dumped to the sinks
+# once it ends, or printed if there are no sinks
+# a trace belongs to the thread that started it, worker threads doing part of its work join it with use_trace()
+class Instrumentation:
+    def __init__(self, sinks=None, trace=False):
+        self._sinks = list(sinks or [])         # sinks every time, count and trace is reported to
+        self._trace = trace                     # gather and dump a trace of every query or build
+        self._local = threading.local()         # the trace being gathered by each thread
+        self._trace_lock = threading.Lock()     # worker threads may add to the trace of another thread
+        self.enabled = bool(self._sinks) or trace
+
+    # report to another sink from now on
+    def add_sink(self, sink):
+        self._sinks.append(sink)
+        self.enabled = True
+
+    # return a context manager timing a stage, stages nest, e.g. search.postings runs within search.rank
+    def timer(self, stage):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    # report the duration of a stage
+    def record_time(self, stage, seconds):
+        if not self.enabled:
+            return
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            with self._trace_lock:
+                trace['stages_ms'][stage] = trace['stages_ms'].get(stage, 0.0) + seconds * 1000
+        for sink in self._sinks:
+            sink.record_time(stage, seconds)
+
+    # add amount to a counter
+    def increment(self, counter, amount=1):
+        if not self.enabled:
+            return
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            with self._trace_lock:
+                trace['counters'][counter] = trace['counters'].get(counter, 0) + amount
+        for sink in self._sinks:
+            sink.record_count(counter, amount)
+
+    # start gathering the trace of a query or a build in the current thread, fields describe it
+    def start_trace(self, name, **fields):
+        if not self._trace:
+            return
+        self._local.trace = dict(fields, name=name, started=time.time(), stages_ms={}, counters={})
+
+    # return the trace being gathered by the current thread, None if there is none
+    def get_trace(self):
+        return getattr(self._local, 'trace', None)
+
+    # gather the stages and counters of the current thread into trace within the with block, e.g. the trace of the
+    # thread a worker does part of a query for, trace is returned by that thread's get_trace()
+    @contextmanager
+    def use_trace(self, trace):
+        previous = getattr(self._local, 'trace', None)
+        self._local.trace = trace
+        try:
+            yield
+        finally:
+            self._local.trace = previous
+
+    # end the trace of the current thread and dump it, fields are added to it, e.g. the number of results
+    def end_trace(self, **fields):
+        trace = getattr(self._local, 'trace', None)
+        if trace is None:
+            return
+        self._local.trace = None
+        trace.update(fields)
+        trace['total_ms'] = (time.time() - trace['started']) * 1000
+        if not self._sinks:
+            print(f"trace {json.dumps(trace)}")
+        for sink in self._sinks:
+            sink.record_trace(trace)
+
+
+# times a stage from entering to leaving its with block
+class _Timer:
+    __slots__ = ('_instrumentation', '_stage', '_started')
+
+    def __init__(self, instrumentation, stage):
+        self._instrumentation = instrumentation
+        self._stage = stage
+        self._started = 0.0
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._instrumentation.record_time(self._stage, time.perf_counter() - self._started)
+        return False
+
+
+# the timer handed out when nothing is recorded
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+# prints every time, count and trace as a line, to stdout unless another file is given
+class LogSink:
+    def __init__(self, file=None, times=True, counts=False):
+        self._file = file               # where lines are printed, stdout if None
+        self._times = times             # print every stage timed, otherwise only the traces
+        self._counts = counts           # also print every counter increment
+
+    def record_time(self, stage, seconds):
+        if self._times:
+            print(f"{stage}: {seconds * 1000:.3f} ms", file=self._file or sys.stdout)
+
+    def record_count(self, counter, amount):
+        if self._counts:
+            print(f"{counter}: +{amount}", file=self._file or sys.stdout)
+
+    def record_trace(self, trace):
+        print(f"trace {json.dumps(trace)}", file=self._file or sys.stdout)
+
+
+# keeps a histogram of the durations of every stage and the totals of every counter in memory
+# durations are counted in buckets growing geometrically from a microsecond, so percentiles are approximate,
+# reported as the upper bound of their bucket
+class HistogramSink:
+    def __init__(self, keep_traces=0):
+        self._lock = threading.Lock()   # stages can be timed from several threads
+        self._histograms = {}           # {stage : {bucket : count}}
+        self._totals = {}               # {stage : [count, total seconds, min seconds, max seconds]}
+        self._counters = defaultdict(int)   # {counter : total}
+        self._traces = []               # the last keep_traces traces
+        self._keep_traces = keep_traces
+
+    def record_time(self, stage, seconds):
+        bucket = int(math.log2(max(seconds * 1e6, 1.0)) * BUCKETS_PER_DOUBLING)
+        with self._lock:
+            histogram = self._histograms.setdefault(stage, defaultdict(int))
+            histogram[bucket] += 1
+            totals = self._totals.get(stage)
+            if totals is None:
+                self._totals[stage] = [1, seconds, seconds, seconds]
+            else:
+                totals[0] += 1
+                totals[1] += seconds
+                totals[2] = min(totals[2], seconds)
+                totals[3] = max(totals[3], seconds)
+
+    def record_count(self, counter, amount):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def record_trace(self, trace):
+        if not self._keep_traces:
+            return
+        with self._lock:
+            self._traces.append(trace)
+            del self._traces[:-self._keep_traces]
+
+    # return the count, mean, min, max and approximate percentiles of every stage in milliseconds, the counter
+    # totals, and the traces kept
+    def get_stats(self):
+        with self._lock:
+            stages = {}
+            for stage, (count, total, minimum, maximum) in sorted(self._totals.items()):
+                stats = {'count': count, 'total_ms': total * 1000, 'mean_ms': total / count * 1000,
+                         'min_ms': minimum * 1000, 'max_ms': maximum * 1000}
+                for percent in (50, 95, 99):
+                    stats[f'p{percent}_ms'] = min(self._get_percentile(stage, count, percent), maximum) * 1000
+                stages[stage] = stats
+            return {'stages': stages, 'counters': dict(self._counters), 'traces': list(self._traces)}
+
+    # return the upper bound in seconds of the bucket holding the percentile of a stage's durations
+    def _get_percentile(self, stage, count, percent):
+        rank = max(1, math.ceil(count * percent / 100))
+        seen = 0
+        for bucket, bucket_count in sorted(self._histograms[stage].items()):
+            seen += bucket_count
+            if seen >= rank:
+                return 2 ** ((bucket + 1) / BUCKETS_PER_DOUBLING) / 1e6
+        return 0.0
+
+    # forget every duration, counter and trace
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._totals.clear()
+            self._counters.clear()
+            self._traces.clear()
+
+
+# appends every time, count and trace as a JSON object on its own line of a file, for later analysis
+class JsonLinesSink:
+    def __init__(self, file_name):
+        self._lock = threading.Lock()   # lines written from several threads must not interleave
+        self._file = open(file_name, 'a', encoding='utf-8')
+
+    def record_time(self, stage, seconds):
+        self._write({'type': 'time', 'stage': stage, 'ms': seconds * 1000, 'time': time.time()})
+
+    def record_count(self, counter, amount):
+        self._write({'type': 'count', 'counter': counter, 'amount': amount, 'time': time.time()})
+
+    def record_trace(self, trace):
+        self._write(dict(trace, type='trace'))
+
+    def _write(self, record):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self._file.write(line)
+
+    # flush and close the file
+    def close(self):
+        with self._lock:
+            self._file.close()
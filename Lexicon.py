@@ -0,0 +1,65 @@
+import heapq
+
+
+# maintains the term dictionary for the merged indexes
+# each entry locates a token's postings block so it can be read with a single seek
+class Lexicon:
+    def __init__(self):
+        self._entries = {}                              # {field : {token : (file, offset, length, doc_frequency, idf, max_tfs)}}
+
+    # adds a token's postings location to the lexicon
+    # field is 'frequency' for the frequency index, or the tag name for an importance index
+    # max_tfs holds the largest tf of the postings, one per field stored in the block, used for score upper bounds
+    def add_entry(self, field, token, file_name, offset, length, doc_frequency, idf, max_tfs=()):
+        if field not in self._entries:
+            self._entries[field] = {}
+        self._entries[field][token] = (file_name, offset, length, doc_frequency, idf, tuple(max_tfs))
+
+    # given a field and token, return its entry (file, offset, length, doc_frequency, idf, max_tfs) if found
+    def get_entry(self, field, token):
+        field_entries = self._entries.get(field)
+        if field_entries is None:
+            return None
+        return field_entries.get(token)
+
+    # return the number of tokens stored for a field
+    def get_term_count(self, field):
+        return len(self._entries.get(field, {}))
+
+    # return the number of tokens stored in each postings file {file : {field : count}}
+    def get_file_term_counts(self):
+        file_term_counts = {}
+        for field, field_entries in self._entries.items():
+            for postings_file, *_ in field_entries.values():
+                field_counts = file_term_counts.setdefault(postings_file, {})
+                field_counts[field] = field_counts.get(field, 0) + 1
+        return file_term_counts
+
+    # return the count tokens of a field found in the most documents, most documents first
+    def get_top_tokens(self, field, count):
+        field_entries = self._entries.get(field, {})
+        return heapq.nlargest(count, field_entries, key=lambda token: field_entries[token][3])
+
+    # write the lexicon to a text file, one tab separated entry per line
+    def write_lexicon_to_file(self, file_name='Lexicon.txt'):
+        with open(file_name, 'w', encoding='utf-8') as output:
+            for field, field_entries in self._entries.items():
+                for token, (postings_file, offset, length, doc_frequency, idf, max_tfs) in field_entries.items():
+                    max_tfs = ','.join(str(max_tf) for max_tf in max_tfs)
+                    output.write(f'{field}\t{token}\t{postings_file}\t{offset}\t{length}\t{doc_frequency}\t{idf}'
+                                 f'\t{max_tfs}\n')
+
+    # load the lexicon from a text file, returns False if the file does not exist
+    # lexicons written before max_tfs existed have no upper bounds
+    def load_lexicon_from_file(self, file_name='Lexicon.txt'):
+        try:
+            with open(file_name, 'r', encoding='utf-8') as lexicon_file:
+                for line in lexicon_file:
+                    field, token, postings_file, offset, length, doc_frequency, idf, *max_tfs = (
+                        line.rstrip('\n').split('\t'))
+                    max_tfs = [float(max_tf) for max_tf in max_tfs[0].split(',')] if max_tfs and max_tfs[0] else ()
+                    self.add_entry(field, token, postings_file, int(offset), int(length), int(doc_frequency),
+                                   float(idf), max_tfs)
+        except FileNotFoundError:
+            return False
+        return True
@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from nltk.stem import PorterStemmer
+
+
+# normalizes tokens (lowercase + porter stemmer), shared by the indexer and the search engine
+# stems are memoized in a bounded least recently used cache {raw_token : stem}
+# the search engine normalizes queries from several threads without a lock, which would slow down the indexer:
+# every operation on the cache is atomic, a token another thread evicts in between is just not moved to the end,
+# and a hit or miss counted by two threads at once can be lost
+class Normalizer:
+    def __init__(self, max_size=200000):
+        self._stemmer = PorterStemmer()             # one stemmer reused for every token
+        self._cache = OrderedDict()                 # {raw_token : stem}, least recently used first
+        self._max_size = max_size                   # maximum number of cached tokens
+        self._hits = 0                              # tokens found in the cache
+        self._misses = 0                            # tokens that had to be stemmed
+
+    # return the normalized form of a raw token
+    def normalize(self, token):
+        stem = self._cache.get(token)
+        if stem is not None:
+            self._hits += 1
+            try:
+                self._cache.move_to_end(token)
+            except KeyError:
+                pass
+            return stem
+
+        self._misses += 1
+        stem = self._stemmer.stem(token.lower())
+        self._cache[token] = stem
+        # evict the least recently used token once the cache is full
+        if len(self._cache) > self._max_size:
+            try:
+                self._cache.popitem(last=False)
+            except KeyError:
+                pass
+        return stem
+
+    # return the cache counters
+    def get_stats(self):
+        lookups = self._hits + self._misses
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'size': len(self._cache),
+            'hit_rate': self._hits / lookups if lookups else 0.0,
+        }
+
+    # return the cached (raw_token, stem) pairs, least recently used first
+    def get_stems(self):
+        return list(self._cache.items())
+
+    # add (raw_token, stem) pairs to the cache, e.g. the stems found by another process
+    def add_stems(self, stems):
+        for token, stem in stems:
+            self._cache[token] = stem
+            self._cache.move_to_end(token)
+            if len(self._cache) > self._max_size:
+                self._cache.popitem(last=False)
+
+    # persist the cache so it can pre-warm the search engine, least recently used first
+    def write_cache_to_file(self, file_name='StemCache.txt'):
+        with open(file_name, 'w', encoding='utf-8') as output:
+            for token, stem in self._cache.items():
+                output.write(f'{token}\t{stem}\n')
+
+    # pre-warm the cache from a persisted cache, returns False if the file does not exist
+    def load_cache_from_file(self, file_name='StemCache.txt'):
+        try:
+            with open(file_name, 'r', encoding='utf-8') as cache_file:
+                self.add_stems(line.rstrip('\n').split('\t') for line in cache_file)
+        except FileNotFoundError:
+            return False
+        return True
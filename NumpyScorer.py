@@ -0,0 +1,136 @@
+from ResultCursor import ResultCursor
+from BinaryPostings import TF_SCALE
+
+# numpy is optional, the search engine falls back to the pure python scorer without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# queries with fewer postings than the number of documents over this ratio are accumulated in a sparse array
+SPARSE_RATIO = 16
+
+
+# decodes the binary postings stored in buffer[offset:offset + length] into arrays (doc_ids, tfs)
+# the variable-byte numbers are decoded all at once: each byte is shifted by 7 bits per byte before it
+# in its number, then the bytes of every number are added up
+def decode_postings_arrays(buffer, offset, length):
+    if not length:
+        return np.empty(0, np.int64), np.empty(0, np.float64)
+
+    data = np.frombuffer(buffer, dtype=np.uint8, count=length, offset=offset)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shifts = 7 * (np.arange(length) - np.repeat(starts, ends - starts + 1))
+    values = np.add.reduceat((data & 0x7f).astype(np.int64) << shifts, starts)
+
+    # numbers alternate between doc_id gaps and tfs in hundredths
+    doc_ids = np.cumsum(values[0::2])
+    tfs = values[1::2] / TF_SCALE
+    return doc_ids, tfs
+
+
+# converts postings {doc_id : tf} into arrays (doc_ids, tfs), keeping their order
+def postings_to_arrays(postings):
+    doc_ids = np.fromiter(postings.keys(), dtype=np.int64, count=len(postings))
+    tfs = np.fromiter(postings.values(), dtype=np.float64, count=len(postings))
+    return doc_ids, tfs
+
+
+# scores queries with vectorized operations over postings arrays
+# ranks exactly like the python scorer: the weight of every distinct tf is computed with score_function,
+# each document's score adds its fields in the same token and field order, and documents with equal
+# scores keep the order the python scorer first saw them in
+class NumpyScorer:
+    def __init__(self, importance_weights, score_function, num_docs=0):
+        self._importance_weights = importance_weights   # [(tag, weight)] in field order
+        self._score_function = score_function           # the search engine's tf-idf weight
+        self._num_docs = num_docs                       # documents in the index, 0 if unknown
+
+    # rank the documents of the tokens of a query
+    # term_arrays holds for each token (freq_idf, [(doc_ids, tfs)]) with the frequency field first then each tag
+    # returns a cursor over the ranked (doc_id, relevance_score)
+    def score(self, term_arrays):
+        fields_doc_ids = []
+        fields_weights = []
+        for freq_idf, fields in term_arrays:
+            for field_index, (doc_ids, tfs) in enumerate(fields):
+                if not len(doc_ids):
+                    continue
+                fields_doc_ids.append(doc_ids)
+                fields_weights.append(self._weigh(tfs, freq_idf, field_index))
+
+        if not fields_doc_ids:
+            return ArrayResultCursor(np.empty(0, np.int64), np.empty(0), np.empty(0, np.int64))
+
+        # every posting in the order the python scorer adds them
+        doc_ids = np.concatenate(fields_doc_ids)
+        weights = np.concatenate(fields_weights)
+
+        # bincount adds the weights of a document one after another in that order, like the python scorer
+        if self._num_docs and len(doc_ids) * SPARSE_RATIO >= self._num_docs:
+            return self._accumulate_dense(doc_ids, weights, fields_doc_ids)
+        return self._accumulate_sparse(doc_ids, weights)
+
+    # the score of every posting of a field
+    # weights are only computed once per distinct tf, with the same function as the python scorer
+    def _weigh(self, tfs, idf, field_index):
+        distinct_tfs, inverse = np.unique(tfs, return_inverse=True)
+        if field_index == 0:
+            distinct_weights = [self._score_function(tf, idf) for tf in distinct_tfs.tolist()]
+        else:
+            weight = self._importance_weights[field_index - 1][1]
+            distinct_weights = [self._score_function(tf, idf, weight=weight, log=True)
+                                for tf in distinct_tfs.tolist()]
+        return np.array(distinct_weights, dtype=np.float64)[inverse]
+
+    # accumulate into an array with a slot per document of the index
+    def _accumulate_dense(self, doc_ids, weights, fields_doc_ids):
+        num_docs = max(self._num_docs, int(doc_ids.max()) + 1)
+        scores = np.bincount(doc_ids, weights=weights, minlength=num_docs)
+
+        # position of each document's first posting, fields are assigned last to first so the first one stays
+        # doc_ids are unique within a field
+        first_seen = np.full(num_docs, len(doc_ids), dtype=np.int64)
+        end = len(doc_ids)
+        for field_doc_ids in reversed(fields_doc_ids):
+            start = end - len(field_doc_ids)
+            first_seen[field_doc_ids] = np.arange(start, end)
+            end = start
+
+        matches = np.flatnonzero(first_seen < len(doc_ids))
+        return ArrayResultCursor(matches, scores[matches], first_seen[matches])
+
+    # accumulate into an array with a slot per matching document
+    def _accumulate_sparse(self, doc_ids, weights):
+        matches, first_seen, inverse = np.unique(doc_ids, return_index=True, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights, minlength=len(matches))
+        return ArrayResultCursor(matches, scores, first_seen)
+
+
+# ranked results held in arrays, the best results are selected with argpartition as they are read
+class ArrayResultCursor(ResultCursor):
+    def __init__(self, doc_ids, scores, first_seen, batch_size=10):
+        super().__init__(scores, batch_size)
+        self._doc_ids = doc_ids                         # doc_id of every matching document
+        self._first_seen = first_seen                   # rank of the first posting of each document, breaks ties
+
+    # make sure the best count results are selected
+    def _select(self, count):
+        if count <= len(self._ranked) or len(self._ranked) == len(self._scores):
+            return
+        count = max(count, 2 * len(self._ranked), self._batch_size)
+        self._selections += 1
+
+        # every document scoring at least the count-th best score, ties at the boundary included
+        if count >= len(self._scores):
+            candidates = np.arange(len(self._scores))
+        else:
+            best = np.argpartition(-self._scores, count - 1)[:count]
+            candidates = np.flatnonzero(self._scores >= self._scores[best].min())
+
+        # best score first, equal scores in the order their documents were first seen
+        order = candidates[np.lexsort((self._first_seen[candidates], -self._scores[candidates]))][:count]
+        self._ranked = list(zip(self._doc_ids[order].tolist(), self._scores[order].tolist()))
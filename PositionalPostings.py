@@ -0,0 +1,100 @@
+import bisect
+from BinaryPostings import encode_varint, decode_varint, gallop_left, SKIP_INTERVAL
+
+# positional postings format, an optional side index next to the frequency postings for phrase queries
+# a token's postings hold for every document, in doc_id order: doc_id gap, byte length of the document's
+# positions, then the gaps between its positions, every number variable-byte encoded like the binary format
+# the byte length lets a lookup step over the positions of the documents it does not need without decoding them
+# tokens in more than SKIP_INTERVAL documents also get a skip table, in the binary format's skip table encoding
+
+# every token of the position index is stored under this lexicon field
+POSITIONS = 'positions'
+
+
+# encodes a list of (doc_id, [positions]) sorted by doc_id, positions in increasing order
+# if skips is a list, a skip entry (last doc_id, byte offset) is appended to it before every block after the first
+def encode_positions(postings, skips=None):
+    buffer = bytearray()
+    previous_doc_id = 0
+    for index, (doc_id, positions) in enumerate(postings):
+        if skips is not None and index and not index % SKIP_INTERVAL:
+            skips.append((previous_doc_id, len(buffer)))
+
+        encoded = bytearray()
+        previous_position = 0
+        for position in positions:
+            encode_varint(position - previous_position, encoded)
+            previous_position = position
+        encode_varint(doc_id - previous_doc_id, buffer)
+        encode_varint(len(encoded), buffer)
+        buffer += encoded
+        previous_doc_id = doc_id
+    return bytes(buffer)
+
+
+# decodes the position gaps stored in buffer[start:end] into positions
+# most gaps fit in a single byte, they are read without a call
+def _decode_position_gaps(buffer, start, end):
+    positions = []
+    position = 0
+    while start < end:
+        gap = buffer[start]
+        if gap & 0x80:
+            gap, start = decode_varint(buffer, start)
+        else:
+            start += 1
+        position += gap
+        positions.append(position)
+    return positions
+
+
+# returns {doc_id : [positions]} of the positional postings stored in buffer[offset:offset + length] for the
+# sorted doc_ids, only the positions of these documents are decoded, and the number of bytes decoded
+# skips are the decoded skip entries of the postings (last doc_ids, byte offsets), empty lists if it has none
+def lookup_positions(buffer, offset, length, skips, doc_ids):
+    last_doc_ids, block_offsets = skips
+    postings = {}
+    bytes_read = 0
+    block = 0
+    position = offset
+    end = offset + length
+    previous_doc_id = 0                 # the doc_id the next gap is added to
+    doc_id = -1                         # the last doc_id read, or the last one before the block
+    start = size = 0                    # location of the positions of doc_id
+    for target in doc_ids:
+        # block i > 0 starts after last_doc_ids[i - 1]
+        next_block = gallop_left(last_doc_ids, target, block)
+        if next_block != block:
+            block = next_block
+            position = offset + block_offsets[block - 1]
+            previous_doc_id = doc_id = last_doc_ids[block - 1]
+
+        # the positions of the documents before the target are stepped over, only their headers are decoded
+        while doc_id < target and position < end:
+            header = position
+            gap, position = decode_varint(buffer, position)
+            size, start = decode_varint(buffer, position)
+            position = start + size
+            previous_doc_id += gap
+            doc_id = previous_doc_id
+            bytes_read += start - header
+        if doc_id == target:
+            postings[target] = _decode_position_gaps(buffer, start, start + size)
+            bytes_read += size
+    return postings, bytes_read
+
+
+# return the positions a phrase token can be matched at, given the positions the phrase matched up to the token
+# before it (reachable) and the positions of the token, both sorted
+# with slop the token may start up to slop positions further than right after the token before it
+# the window after each reachable position is found with a binary search, so the cost follows the reachable
+# positions, which shrink as the phrase goes on, rather than every position of the token
+def extend_phrase(reachable, positions, slop=0):
+    next_reachable = []
+    index = 0
+    for position in reachable:
+        index = bisect.bisect_right(positions, position, index)
+        while index < len(positions) and positions[index] <= position + slop + 1:
+            next_reachable.append(positions[index])
+            index += 1
+    return next_reachable
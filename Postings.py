@@ -1,49 +1,135 @@
-# contains a tokens contextual information (frequency postings, and importance postings)
+from array import array
+from bisect import bisect_left, bisect_right
+
+# importance tags are stored as small integer ids packed with their counts
+IMPORTANCE_TAGS = ['title', 'h1', 'h2', 'h3', 'b', 'i', 'strong', 'em']
+TAG_IDS = {tag: tag_id for tag_id, tag in enumerate(IMPORTANCE_TAGS)}
+TAG_BITS = 3                                # low bits of a packed importance posting hold the tag id
+TAG_MASK = (1 << TAG_BITS) - 1
+COUNT_STEP = 1 << TAG_BITS                  # adding this to a packed importance posting increments its count
+
+
+# contains a tokens contextual information (frequency postings, importance postings, and positions if kept)
+# postings are kept in parallel typed arrays sorted by doc_id, documents are indexed in order,
+# so a token's postings almost always grow at the tail
 class Postings:
+    __slots__ = ('_frequency_doc_ids', '_frequency_counts', '_importance_doc_ids', '_importance_tags', '_positions')
+
+    # estimated bytes of memory used by each part of the postings, measured with tracemalloc
+    # used by the indexer to decide when to spill the partial index to disk
+    TOKEN_BYTES = 330                       # the token's key in the index and a Postings with empty frequency arrays
+    FREQUENCY_POSTING_BYTES = 9             # a new doc_id in the frequency postings
+    IMPORTANCE_POSTING_BYTES = 13           # a new (doc_id, tag) in the importance postings
+    IMPORTANCE_ARRAYS_BYTES = 128           # the importance arrays, created for the token's first importance posting
+    POSITIONS_BYTES = 72                    # the positions dict, created for the token's first positions
+    POSITIONS_DOC_BYTES = 145               # a new doc_id in the positions
+    POSITION_BYTES = 6                      # a position of a token in a document
+
     def __init__(self):
-        self._doc_id = None
-        self._frequency_postings = {}       # {doc_id : frequency}
-        self._importance_postings = {}      # {doc_id : (tag, frequency)} ; tags can be h1,h2,h3,i,em,b,title,strong
+        self._frequency_doc_ids = array('I')    # doc_ids containing the token, sorted
+        self._frequency_counts = array('I')     # parallel to _frequency_doc_ids, number of occurrences
+        self._importance_doc_ids = None         # doc_ids with the token inside an importance tag, created on first use
+        self._importance_tags = None            # parallel to _importance_doc_ids, count << TAG_BITS | tag id
+        self._positions = None                  # {doc_id : array of positions}, only kept for a positional index
 
     # FREQUENCY INDEX METHODS
     # -----------------------
     #
     # increments frequency for a given token and doc_id
+    # returns the estimated number of bytes the postings grew by
     def increment_frequency_posting(self, doc_id):
-        if doc_id in self._frequency_postings:
-            self._frequency_postings[doc_id] += 1
-        else:
-            self._frequency_postings[doc_id] = 1
+        doc_ids = self._frequency_doc_ids
+        # the current document is always at the tail, unless a duplicate url revisits an earlier doc_id
+        if doc_ids and doc_ids[-1] >= doc_id:
+            if doc_ids[-1] == doc_id:
+                self._frequency_counts[-1] += 1
+                return 0
+            position = bisect_left(doc_ids, doc_id)
+            if doc_ids[position] == doc_id:
+                self._frequency_counts[position] += 1
+                return 0
+            doc_ids.insert(position, doc_id)
+            self._frequency_counts.insert(position, 1)
+            return self.FREQUENCY_POSTING_BYTES
+
+        doc_ids.append(doc_id)
+        self._frequency_counts.append(1)
+        return self.FREQUENCY_POSTING_BYTES
 
-    # return frequency posting
+    # return frequency posting, (doc_id, frequency) sorted by doc_id
     def get_frequency_posting(self):
-        return self._frequency_postings
+        return zip(self._frequency_doc_ids, self._frequency_counts)
 
     # IMPORTANCE INDEX METHODS
     # ------------------------
     #
     # increments frequency for a given token, doc_id, and tag
+    # returns the estimated number of bytes the postings grew by
     def increment_importance_postings(self, doc_id, new_tag):
-        # increment a token's tag frequency if it exists within a document
-        found = False
-
-        # check if token has an importance posting
-        if doc_id in self._importance_postings:
-            # check if the tag exists in the document
-            for existing_tag in self._importance_postings[doc_id]:
-                if new_tag == existing_tag:
-                    found = True
-                    # increment tag frequency if found
-                    self._importance_postings[doc_id][existing_tag] += 1
-            # tag doesn't exist yet, create one
-            if not found:
-                self._importance_postings[doc_id][new_tag] = 1
-
-        # create new importance posting and tag for token
+        grown = 0
+        if self._importance_doc_ids is None:
+            self._importance_doc_ids = array('I')
+            self._importance_tags = array('Q')
+            grown = self.IMPORTANCE_ARRAYS_BYTES
+        doc_ids = self._importance_doc_ids
+        packed_tags = self._importance_tags
+        tag_id = TAG_IDS[new_tag]
+
+        # find the document's postings, one per tag, at the tail unless a duplicate url revisits a doc_id
+        if doc_ids and doc_ids[-1] == doc_id:
+            end = len(doc_ids)
+            start = end - 1
+            while start > 0 and doc_ids[start - 1] == doc_id:
+                start -= 1
         else:
-            self._importance_postings[doc_id] = {}
-            self._importance_postings[doc_id][new_tag] = 1
+            start = bisect_left(doc_ids, doc_id)
+            end = bisect_right(doc_ids, doc_id, start)
 
-    # return importance posting
+        # increment a token's tag frequency if it exists within a document
+        for position in range(start, end):
+            if packed_tags[position] & TAG_MASK == tag_id:
+                packed_tags[position] += COUNT_STEP
+                return grown
+
+        # tag doesn't exist yet, create one
+        doc_ids.insert(end, doc_id)
+        packed_tags.insert(end, COUNT_STEP | tag_id)
+        return grown + self.IMPORTANCE_POSTING_BYTES
+
+    # return importance posting, (doc_id, tag, frequency) sorted by doc_id
     def get_importance_posting(self):
-        return self._importance_postings
+        if self._importance_doc_ids is None:
+            return
+        for doc_id, packed in zip(self._importance_doc_ids, self._importance_tags):
+            yield doc_id, IMPORTANCE_TAGS[packed & TAG_MASK], packed >> TAG_BITS
+
+    # POSITION INDEX METHODS
+    # ----------------------
+    #
+    # adds the positions of the token in a document, in increasing order
+    # offset is the number of tokens of the document's earlier visits, when a duplicate url revisits a doc_id,
+    # every position of the visit is moved past them, so the positions of all tokens read like the text of the
+    # visits one after the other, as their frequency counts are added up
+    # returns the estimated number of bytes the postings grew by
+    def add_positions(self, doc_id, positions, offset=0):
+        grown = 0
+        if self._positions is None:
+            self._positions = {}
+            grown = self.POSITIONS_BYTES
+
+        if offset:
+            positions = [position + offset for position in positions]
+        doc_positions = self._positions.get(doc_id)
+        if doc_positions is None:
+            self._positions[doc_id] = array('I', positions)
+            return grown + self.POSITIONS_DOC_BYTES + len(positions) * self.POSITION_BYTES
+
+        doc_positions.extend(positions)
+        return grown + len(positions) * self.POSITION_BYTES
+
+    # return positions, (doc_id, positions) sorted by doc_id
+    def get_positions(self):
+        if self._positions is None:
+            return []
+        return sorted(self._positions.items())
+
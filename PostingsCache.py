@@ -0,0 +1,129 @@
+import heapq
+import threading
+
+# estimated bytes held by one cached posting {doc_id : tf}, the dict slot and both objects
+POSTING_BYTES = 100
+
+# estimated bytes held by a cached entry besides its postings
+ENTRY_BYTES = 200
+
+# loading postings costs a seek, counted as reading this many bytes, plus the bytes read
+SEEK_COST = 4096
+
+
+# caches decoded postings by (field, token) within a memory budget
+# entries are evicted with greedy dual size frequency: an entry's priority is the clock plus its hits times
+# the cost of loading it again over its size, so one huge list cannot flush many small ones as costly to reload
+# the clock is raised to the priority of every evicted entry, so entries that stop being used age out
+# every method holds a lock, so searches running in several threads share the cache
+class PostingsCache:
+    def __init__(self, max_bytes=128 * 1024 * 1024):
+        self._lock = threading.Lock()               # the entries, priorities and counters are changed by every search
+        self._entries = {}                          # {(field, token) : [postings, size, cost, hits, priority]}
+        self._priorities = []                       # min heap (priority, sequence, key), outdated ones are skipped
+        self._sequence = 0                          # breaks priority ties, oldest first
+        self._clock = 0.0                           # priority of the last evicted entry
+        self._bytes = 0                             # estimated bytes of the cached postings
+        self._max_bytes = max_bytes                 # memory budget, 0 disables the cache
+        self._field_stats = {}                      # {field : {'hits', 'misses', 'bytes', 'entries', 'evictions'}}
+
+    # return the cached postings of a field's token, None if they are not cached
+    def get(self, field, token):
+        with self._lock:
+            entry = self._entries.get((field, token))
+            stats = self._get_field_stats(field)
+            if entry is None:
+                stats['misses'] += 1
+                return None
+            stats['hits'] += 1
+            entry[3] += 1
+            self._set_priority((field, token), entry)
+            return entry[0]
+
+    # cache the postings of a field's token
+    # num_postings estimates their size and read_bytes the cost of reading them again
+    def put(self, field, token, postings, num_postings, read_bytes):
+        with self._lock:
+            size = ENTRY_BYTES + num_postings * POSTING_BYTES
+            if size > self._max_bytes:
+                return
+
+            key = (field, token)
+            stats = self._get_field_stats(field)
+            if key in self._entries:
+                self._remove(key)
+            entry = [postings, size, SEEK_COST + read_bytes, 1, 0.0]
+            self._entries[key] = entry
+            self._set_priority(key, entry)
+            self._bytes += size
+            stats['bytes'] += size
+            stats['entries'] += 1
+
+            # evict the lowest priorities until the budget is respected
+            while self._bytes > self._max_bytes:
+                priority, _, evicted_key = heapq.heappop(self._priorities)
+                evicted = self._entries.get(evicted_key)
+                if evicted is None or evicted[4] != priority:
+                    continue
+                self._clock = priority
+                self._remove(evicted_key)
+                self._get_field_stats(evicted_key[0])['evictions'] += 1
+
+    # remove every cached postings
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._priorities = []
+            self._clock = 0.0
+            self._bytes = 0
+            for stats in self._field_stats.values():
+                stats['bytes'] = 0
+                stats['entries'] = 0
+
+    # return the cache counters, overall and per field
+    def get_stats(self):
+        with self._lock:
+            hits = sum(stats['hits'] for stats in self._field_stats.values())
+            misses = sum(stats['misses'] for stats in self._field_stats.values())
+            fields = {}
+            for field, stats in self._field_stats.items():
+                lookups = stats['hits'] + stats['misses']
+                fields[field] = dict(stats, hit_ratio=stats['hits'] / lookups if lookups else 0.0)
+            return {
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'fields': fields,
+            }
+
+    # return the counters of a field, creating them the first time it is seen
+    def _get_field_stats(self, field):
+        stats = self._field_stats.get(field)
+        if stats is None:
+            stats = self._field_stats[field] = {'hits': 0, 'misses': 0, 'bytes': 0, 'entries': 0, 'evictions': 0}
+        return stats
+
+    # give an entry its greedy dual size frequency priority
+    # the previous priority stays in the heap and is skipped once popped
+    def _set_priority(self, key, entry):
+        _, size, cost, hits, _ = entry
+        entry[4] = self._clock + hits * cost / size
+        self._sequence += 1
+        heapq.heappush(self._priorities, (entry[4], self._sequence, key))
+
+        # drop the outdated priorities once they outnumber the entries
+        if len(self._priorities) > 2 * len(self._entries) + 64:
+            self._priorities = [(priority, sequence, queued_key)
+                                for priority, sequence, queued_key in self._priorities
+                                if queued_key in self._entries and self._entries[queued_key][4] == priority]
+            heapq.heapify(self._priorities)
+
+    # remove a cached entry
+    def _remove(self, key):
+        size = self._entries.pop(key)[1]
+        stats = self._get_field_stats(key[0])
+        self._bytes -= size
+        stats['bytes'] -= size
+        stats['entries'] -= 1
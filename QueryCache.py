@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+
+# estimated bytes held by one cached result (doc_id, relevance_score), the dict slot and both objects
+RESULT_BYTES = 120
+
+
+# caches query results by their normalized tokens, least recently used queries are evicted first
+# the cache is bound to an index generation, results of another generation are dropped
+# every method holds a lock, so searches running in several threads share the cache
+class QueryCache:
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self._lock = threading.Lock()               # the entries and counters are changed by every search
+        self._entries = OrderedDict()               # {key : (results, size)}, least recently used first
+        self._max_entries = max_entries             # maximum number of cached queries, 0 disables the cache
+        self._max_bytes = max_bytes                 # maximum estimated bytes of all cached results
+        self._bytes = 0                             # estimated bytes of the cached results
+        self._generation = None                     # generation of the index the results were found in
+        self._hits = 0                              # queries answered from the cache
+        self._misses = 0                            # queries that had to be searched
+        self._evictions = 0                         # queries evicted to respect the limits
+        self._invalidations = 0                     # times the cache was cleared for a new index generation
+
+    # bind the cache to an index generation, clearing it if the generation changed
+    def set_generation(self, generation):
+        with self._lock:
+            if generation != self._generation:
+                if self._entries:
+                    self._invalidations += 1
+                self._entries.clear()
+                self._bytes = 0
+                self._generation = generation
+
+    # return the cached results of a key, None if they are not cached
+    def get(self, key):
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._entries.move_to_end(key)
+            return cached[0]
+
+    # cache the results of a key, num_results is used to estimate their size
+    def put(self, key, results, num_results):
+        size = num_results * RESULT_BYTES
+        if self._max_entries <= 0 or size > self._max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (results, size)
+            self._bytes += size
+
+            # evict the least recently used queries until both limits are respected
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._evictions += 1
+
+    # remove every cached result
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    # return the cache counters
+    def get_stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+            }
@@ -0,0 +1,61 @@
+import heapq
+import threading
+from operator import itemgetter
+
+
+# ranked results of a query, sorted lazily as they are read
+# only the results up to the furthest position read are selected, with a heap bounded to that many results,
+# reading past them selects a larger batch, so showing the first page never sorts every matching document
+# a cached cursor is shared by every search of its query, results are selected under a lock
+class ResultCursor:
+    def __init__(self, scores, batch_size=10):
+        self._scores = scores                           # {doc_id : relevance_score} of every matching document
+        self._ranked = []                               # [(doc_id, relevance_score)] selected so far, best first
+        self._batch_size = batch_size                   # minimum number of results selected at once
+        self._selections = 0                            # number of times results were selected
+        self._lock = threading.Lock()                   # pages can be read from several threads at once
+
+    # number of matching documents
+    def __len__(self):
+        return len(self._scores)
+
+    # return a result (doc_id, relevance_score) or a list of them for a slice, selecting results as needed
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self._scores))
+            with self._lock:
+                self._select(max(start, stop))
+                return self._ranked[index]
+        if index < 0:
+            index += len(self._scores)
+        if not 0 <= index < len(self._scores):
+            raise IndexError('result index out of range')
+        with self._lock:
+            self._select(index + 1)
+            return self._ranked[index]
+
+    def __iter__(self):
+        for index in range(len(self._scores)):
+            yield self[index]
+
+    # return True if there are results after the first count results
+    def has_more(self, count):
+        return count < len(self._scores)
+
+    # return the cursor counters
+    def get_stats(self):
+        return {'matches': len(self._scores), 'selected': len(self._ranked), 'selections': self._selections}
+
+    # make sure the best count results are selected
+    # the selection at least doubles each time so reading every result costs a bounded number of selections
+    def _select(self, count):
+        if count <= len(self._ranked) or len(self._ranked) == len(self._scores):
+            return
+        count = max(count, 2 * len(self._ranked), self._batch_size)
+        self._selections += 1
+
+        # nlargest is stable like sorted, documents with the same score keep the order they were scored in
+        if count >= len(self._scores):
+            self._ranked = sorted(self._scores.items(), key=itemgetter(1), reverse=True)
+        else:
+            self._ranked = heapq.nlargest(count, self._scores.items(), key=itemgetter(1))
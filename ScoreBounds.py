@@ -0,0 +1,105 @@
+from operator import itemgetter
+from FieldedPostings import read_fielded_records
+
+
+# the score a token adds to a document from its fielded record [tf, b, em, h1, h2, h3, i, strong, title]
+# fields are added in the same order as the search engine adds them
+def score_fielded_record(record, idf, weights, score_function):
+    score = 0.0
+    if record[0]:
+        score += score_function(record[0], idf)
+    for (_, weight), tf in zip(weights, record[1:]):
+        if tf:
+            score += score_function(tf, idf, weight=weight, log=True)
+    return score
+
+
+# the largest score each token can add to a single document, used to prune top k searches
+# bounds depend on the importance weights, so the weights they were computed with are stored alongside them
+# score_function is the search engine's tf-idf weight so the bounds use the exact same arithmetic, it is only
+# needed to add bounds
+class ScoreBounds:
+    def __init__(self, weights=(), score_function=None):
+        self._bounds = {}                               # {token : max_score}
+        self._weights = list(weights)                   # [(tag, weight)] the bounds were computed with
+        self._score_function = score_function           # tf-idf weight of a field of a record
+
+    # score every fielded record {doc_id : [tf, b, em, h1, h2, h3, i, strong, title]} of a token and keep its best
+    # score, documents with the same record have the same score so each distinct record is only scored once
+    def add_bound(self, token, idf, records):
+        self._bounds[token] = max(score_fielded_record(record, idf, self._weights, self._score_function)
+                                  for record in set(map(tuple, records.values())))
+
+    # add a token's bound from the (token, field_index, idf, [(doc_id, tf)]) of each field it has postings in, in
+    # field order, as the indexer merges them
+    # a document without importance postings scores the most with the largest tf, so only that one and the
+    # documents with importance postings are scored field by field
+    def add_field_postings(self, token, field_entries):
+        idf = None
+        body_postings = []
+        records = {}                                    # {doc_id : [tf, b, em, h1, h2, h3, i, strong, title]}
+        for _, field_index, field_idf, postings in field_entries:
+            # the idf the fielded records are scored with, see read_fielded_records
+            if idf is None:
+                idf = field_idf
+            if not field_index:
+                body_postings = postings
+                continue
+            for doc_id, value in postings:
+                record = records.get(doc_id)
+                if record is None:
+                    record = records[doc_id] = [0] * (len(self._weights) + 1)
+                record[field_index] = value
+
+        # the body tf of the documents with importance postings, and the largest one of the others
+        best_doc_id, max_tf = None, 0
+        if records:
+            for doc_id, tf in body_postings:
+                record = records.get(doc_id)
+                if record is not None:
+                    record[0] = tf
+                elif tf > max_tf:
+                    best_doc_id, max_tf = doc_id, tf
+        elif body_postings:
+            best_doc_id, max_tf = max(body_postings, key=itemgetter(1))
+        if best_doc_id is not None:
+            records[best_doc_id] = [max_tf] + [0] * len(self._weights)
+        self.add_bound(token, idf, records)
+
+    # score every document of every token of already merged text indexes, e.g. indexes built without bounds
+    def compute_score_bounds(self, frequency='Frequency_Index', importance='Importance_Index'):
+        self._bounds = {}
+        for token, idf, records in read_fielded_records(frequency, importance):
+            self.add_bound(token, idf, records)
+
+    # return True if the bounds were computed with the given importance weights
+    def has_weights(self, weights):
+        return self._weights == list(weights)
+
+    # return a token's bound, tokens that are not indexed cannot add anything to a score
+    def get_bound(self, token):
+        return self._bounds.get(token, 0.0)
+
+    # write the bounds to a text file, the weights on the first line then one tab separated token per line
+    def write_score_bounds_to_file(self, file_name='ScoreBounds.txt'):
+        with open(file_name, 'w', encoding='utf-8') as output:
+            weights = ','.join(f'{tag}={weight}' for tag, weight in self._weights)
+            output.write(f'weights\t{weights}\n')
+            for token, max_score in self._bounds.items():
+                output.write(f'{token}\t{max_score!r}\n')
+
+    # load the bounds from a text file, returns False if the file does not exist
+    def load_score_bounds_from_file(self, file_name='ScoreBounds.txt'):
+        try:
+            with open(file_name, 'r', encoding='utf-8') as bounds_file:
+                _, weights = bounds_file.readline().rstrip('\n').split('\t')
+                self._weights = []
+                for tag_weight in weights.split(','):
+                    tag, weight = tag_weight.split('=')
+                    self._weights.append((tag, float(weight)))
+                for line in bounds_file:
+                    token, max_score = line.rstrip('\n').split('\t')
+                    self._bounds[token] = float(max_score)
+        except FileNotFoundError:
+            return False
+        return True
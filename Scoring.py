@@ -0,0 +1,15 @@
+import math
+
+# weights applied to the tf of each importance tag (b,em,h1,h2,h3,i,strong,title)
+# shared by the search engine and the indexer, which computes the score bounds and impacts with them
+IMPORTANCE_WEIGHTS = [('b',25), ('em',0), ('h1',100), ('h2',50), ('h3',25), ('i',0), ('strong',25), ('title',100)]
+
+
+# calculates the tf-idf weight for a token
+# a weight is applied for importance tags (h1,h2,h3,i,em,b,title,strong)
+def calculate_tfidf_weight(tf, idf, *, weight=1.0, log=False):
+    # use this if the tf being passed in is the raw tf (log is not applied)
+    if log and weight != 0:
+        return math.log10(tf*weight) * idf
+    # assumed the tf has log applied to it already
+    return tf * idf * weight
@@ -0,0 +1,95 @@
+import os
+import json
+import random
+from itertools import accumulate, product
+from Postings import IMPORTANCE_TAGS
+
+# syllables the words of the synthetic vocabulary are made of
+SYLLABLES = ['ba', 'ce', 'di', 'fo', 'gu', 'ka', 'le', 'mi', 'no', 'pu', 'ra', 'se', 'ti', 'vo', 'zu',
+             'bel', 'dor', 'fen', 'gil', 'har', 'jin', 'kor', 'lum', 'mar', 'nis', 'por', 'ques', 'rin', 'sol', 'tan']
+
+# tags of the body sections that are not importance tags
+PLAIN_TAGS = ['p', 'div', 'span', 'li']
+
+
+# generates a reproducible corpus of crawled pages and a log of queries over it, so the indexer and the search
+# engine can be measured without the DEV crawl
+# word frequencies follow a Zipf distribution over a vocabulary of vocabulary_size made up words, the word of rank r
+# is drawn with a probability proportional to 1 / r ** zipf_exponent
+# the same arguments always generate the same documents and queries, each document only depends on its number
+class SyntheticCorpus:
+    def __init__(self, num_docs=1000, vocabulary_size=5000, zipf_exponent=1.1, words_per_doc=200, num_sites=10,
+                 seed=0):
+        self._num_docs = num_docs                   # documents in the corpus
+        self._words_per_doc = words_per_doc         # average number of words of a document
+        self._num_sites = num_sites                 # documents are spread over this many site directories
+        self._seed = seed
+        self._vocabulary = self._create_vocabulary(vocabulary_size)     # words ordered by rank
+        self._cum_weights = list(accumulate(1 / rank ** zipf_exponent for rank in range(1, vocabulary_size + 1)))
+
+    # made up words of two or more syllables, shuffled so their rank does not follow their spelling
+    def _create_vocabulary(self, vocabulary_size):
+        words = []
+        length = 2
+        while len(words) < vocabulary_size:
+            words.extend(''.join(syllables) for syllables in product(SYLLABLES, repeat=length))
+            length += 1
+        words = words[:max(vocabulary_size, 1)]
+        random.Random(self._seed).shuffle(words)
+        return words
+
+    # draw count words following the Zipf distribution
+    def _sample_words(self, rng, count):
+        return rng.choices(self._vocabulary, cum_weights=self._cum_weights, k=count)
+
+    # return the JSON object of a document, {url, content, encoding} like the files of the crawl
+    # the content has a title and body sections in every importance tag, and plain sections for the other words
+    def generate_document(self, doc_number):
+        rng = random.Random(f'{self._seed}:{doc_number}')
+        num_words = rng.randint(max(self._words_per_doc // 2, 1), max(self._words_per_doc * 3 // 2, 1))
+        words = self._sample_words(rng, num_words)
+
+        title_length = min(rng.randint(2, 6), len(words))
+        sections = []
+        position = title_length
+        while position < len(words):
+            length = rng.randint(1, 12)
+            text = ' '.join(words[position:position + length])
+            # about a third of the sections are in an importance tag
+            tag = rng.choice(IMPORTANCE_TAGS[1:]) if rng.random() < 0.35 else rng.choice(PLAIN_TAGS)
+            sections.append(f'<{tag}>{text}</{tag}>')
+            position += length
+
+        content = (f'<html><head><title>{" ".join(words[:title_length])}</title></head>'
+                   f'<body>{"".join(sections)}</body></html>')
+        site = doc_number % self._num_sites
+        return {'url': f'https://www.site{site}.example.edu/page{doc_number}', 'content': content,
+                'encoding': 'utf-8'}
+
+    # write every document to its own JSON file in one sub directory per site, the layout of the crawl
+    # returns the number of bytes written
+    def write_corpus(self, directory):
+        written = 0
+        for doc_number in range(self._num_docs):
+            site_directory = os.path.join(directory, f'site{doc_number % self._num_sites}')
+            os.makedirs(site_directory, exist_ok=True)
+            with open(os.path.join(site_directory, f'{doc_number:06d}.json'), 'w', encoding='utf-8') as file:
+                written += file.write(json.dumps(self.generate_document(doc_number)))
+        return written
+
+    # return a log of count queries of 1 to max_terms words drawn from the vocabulary
+    # the queries are drawn from distinct_queries distinct ones, also following a Zipf distribution, so popular
+    # queries repeat like in a real query log
+    def generate_queries(self, count, distinct_queries=None, max_terms=3):
+        rng = random.Random(f'{self._seed}:queries')
+        if distinct_queries is None:
+            distinct_queries = max(count // 4, 1)
+        pool = [' '.join(self._sample_words(rng, rng.randint(1, max_terms))) for _ in range(distinct_queries)]
+        pool_weights = list(accumulate(1 / rank for rank in range(1, len(pool) + 1)))
+        return rng.choices(pool, cum_weights=pool_weights, k=count)
+
+    # write a log of count queries, one per line
+    def write_queries(self, file_path, count, distinct_queries=None, max_terms=3):
+        with open(file_path, 'w', encoding='utf-8') as file:
+            for query in self.generate_queries(count, distinct_queries, max_terms):
+                file.write(query + '\n')
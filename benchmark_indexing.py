@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+from pathlib import Path
+from Indexer import Indexer, DEFAULT_MEMORY_BUDGET
+from SyntheticCorpus import SyntheticCorpus
+
+# resource is only available on unix, peak memory is not reported without it
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# the index is built in this sub directory of the benchmark directory, next to the corpus in DEV
+BUILD_FOLDER = 'build'
+
+
+# return the size in bytes of every file under the directory, grouped by the top level file or directory
+def measure_index_size(directory):
+    sizes = {}
+    for file in Path(directory).rglob('*'):
+        if file.is_file():
+            part = file.relative_to(directory).parts[0]
+            sizes[part] = sizes.get(part, 0) + file.stat().st_size
+    return dict(sorted(sizes.items()))
+
+
+# build the index of the corpus in corpus_directory inside build_directory and return the build report
+# the indexer's own output is discarded, only its stage timings are kept
+def run_benchmark(corpus_directory, build_directory, index_format='text', workers=1,
+                  memory_budget=DEFAULT_MEMORY_BUDGET, positional=False, tokenizer='streaming'):
+    num_docs = sum(1 for _ in Path(corpus_directory).rglob('*.json'))
+    corpus_bytes = sum(file.stat().st_size for file in Path(corpus_directory).rglob('*.json'))
+    indexer = Indexer(index_format=index_format, memory_budget=memory_budget, positional=positional,
+                      tokenizer=tokenizer)
+
+    # the indexer writes its files to the current directory
+    cwd = os.getcwd()
+    os.chdir(build_directory)
+    try:
+        started = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            indexer.create_index(corpus_directory, workers=workers)
+        elapsed = time.perf_counter() - started
+    finally:
+        os.chdir(cwd)
+
+    index_sizes = measure_index_size(build_directory)
+    report = {
+        'settings': {'index_format': index_format, 'workers': workers, 'positional': positional,
+                     'memory_budget': memory_budget, 'tokenizer': tokenizer},
+        'documents': num_docs,
+        'corpus_bytes': corpus_bytes,
+        'seconds': elapsed,
+        'docs_per_second': num_docs / elapsed if elapsed else 0.0,
+        'stages_seconds': indexer.get_timings(),
+        'index_bytes': sum(index_sizes.values()),
+        'index_bytes_by_part': index_sizes,
+    }
+    # ru_maxrss is reported in kilobytes on linux
+    if resource is not None:
+        report['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        report['peak_worker_rss_mb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return report
+
+
+# generate a synthetic corpus and measure how fast it is indexed
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Index a reproducible synthetic corpus and report the indexing "
+                                                 "throughput, the time of each stage, the peak memory and the "
+                                                 "index size")
+    parser.add_argument('--directory', default=None,
+                        help="keep the corpus in DIRECTORY/DEV and the index in DIRECTORY/build, the corpus is "
+                             "reused by later runs, a temporary directory is used by default")
+    parser.add_argument('--docs', type=int, default=2000, help="documents of the synthetic corpus")
+    parser.add_argument('--vocabulary', type=int, default=20000, help="distinct words of the synthetic corpus")
+    parser.add_argument('--zipf', type=float, default=1.1, help="Zipf exponent of the synthetic word frequencies")
+    parser.add_argument('--words-per-doc', type=int, default=200, help="average words of a document")
+    parser.add_argument('--sites', type=int, default=10, help="site directories the documents are spread over")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic corpus")
+    parser.add_argument('--index-format', default='text', choices=['text', 'binary', 'fielded', 'impact'],
+                        help="format of the index to build")
+    parser.add_argument('--workers', type=int, default=1, help="number of processes used to build the index")
+    parser.add_argument('--memory-budget', type=int, default=DEFAULT_MEMORY_BUDGET // (1024 * 1024),
+                        help="megabytes of postings held in memory before a partial index is spilled to disk")
+    parser.add_argument('--positional', action='store_true', help="also build the position index")
+    parser.add_argument('--tokenizer', default='streaming', choices=['streaming', 'bs4'],
+                        help="tokenize documents in a single pass over the HTML, or with a beautiful soup tree")
+    parser.add_argument('--output', default=None, help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        directory = args.directory or stack.enter_context(tempfile.TemporaryDirectory())
+        directory = os.path.abspath(directory)
+        corpus_path = os.path.join(directory, 'DEV')
+        build_path = os.path.join(directory, BUILD_FOLDER)
+
+        synthetic_corpus = SyntheticCorpus(args.docs, args.vocabulary, args.zipf, args.words_per_doc, args.sites,
+                                           args.seed)
+        if not os.path.exists(corpus_path):
+            generated = time.perf_counter()
+            written = synthetic_corpus.write_corpus(corpus_path)
+            print(f"Corpus written: {args.docs} documents, {written} bytes in "
+                  f"{time.perf_counter() - generated:.1f}s")
+
+        # every run starts from an empty build directory
+        shutil.rmtree(build_path, ignore_errors=True)
+        os.makedirs(build_path)
+        benchmark = run_benchmark(corpus_path, build_path, args.index_format, args.workers,
+                                  args.memory_budget * 1024 * 1024, args.positional, args.tokenizer)
+
+    benchmark['corpus'] = {'docs': args.docs, 'vocabulary': args.vocabulary, 'zipf': args.zipf,
+                           'words_per_doc': args.words_per_doc, 'sites': args.sites, 'seed': args.seed}
+    print(json.dumps(benchmark, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(benchmark, output, indent=2)
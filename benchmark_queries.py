@@ -0,0 +1,216 @@
+import io
+import os
+import json
+import time
+import argparse
+import contextlib
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from Indexer import Indexer
+from SyntheticCorpus import SyntheticCorpus
+from searchEngine import SearchEngine
+from Instrumentation import Instrumentation, HistogramSink
+from load_generator import percentile
+
+# directory of the index searched by each index format, the index is built if it is missing
+INDEX_DIRECTORIES = {'text': 'Frequency_Index', 'binary': 'Binary_Index', 'fielded': 'Fielded_Index',
+                     'impact': 'Impact_Index'}
+
+# files a search can read, dropped from the page cache before every cold query with drop_page_cache
+SEARCHED_FILES = ['Frequency_Index', 'Importance_Index', 'Binary_Index', 'Fielded_Index', 'Impact_Index',
+                  'Position_Index', 'DocumentStore.bin', 'DocumentManager.txt']
+
+
+# return the files of the indexes of the current directory
+def get_index_files():
+    files = []
+    for name in SEARCHED_FILES:
+        path = Path(name)
+        files.extend(path.rglob('*') if path.is_dir() else [path])
+    return [file for file in files if file.is_file()]
+
+
+# return the number of file descriptors open in this process, None where /proc is not available
+def count_open_fds():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except FileNotFoundError:
+        return None
+
+
+# ask the operating system to drop the files from its page cache, so they are read from the disk again
+# pages memory mapped by the search engine stay cached, only the files read at offsets are dropped
+def drop_page_cache(files):
+    for file in files:
+        fd = os.open(file, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+# replay the queries and return the latency, throughput and bytes read report
+# each query is timed from the search to the urls of its first page, like a search from the gui
+# cold drops the cached results and postings before every query, the operating system's page cache is kept
+# unless page_cache_files are given, so the postings are decoded again but not necessarily read from the disk again
+# with several threads, the queries are searched by a pool of threads sharing the search engine, like the server
+def replay_queries(search_engine, queries, mode='or', top_k=None, page_size=10, cold=False, threads=1,
+                   page_cache_files=None):
+    # search a query, returns its latency and the postings bytes it read
+    def replay_query(query):
+        if cold:
+            search_engine.clear_caches()
+            if page_cache_files:
+                drop_page_cache(page_cache_files)
+        query_started = time.perf_counter()
+        results = search_engine.search_query(query, top_k=top_k, mode=mode)
+        search_engine.get_range_urls_from_docmanager(results, 0, min(page_size, len(results)))
+        return time.perf_counter() - query_started, search_engine.get_query_bytes_read()
+
+    started = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            measured = list(executor.map(replay_query, queries))
+    else:
+        measured = [replay_query(query) for query in queries]
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in measured)
+    bytes_read = sorted(read for _, read in measured)
+    return {
+        'queries': len(queries),
+        'threads': threads,
+        'seconds': elapsed,
+        'queries_per_second': len(queries) / elapsed if elapsed else 0.0,
+        'latency_ms': dict({f'p{percent}': percentile(latencies, percent) * 1000 for percent in (50, 95, 99)},
+                           mean=sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+                           max=latencies[-1] * 1000 if latencies else 0.0),
+        'postings_bytes_per_query': dict({f'p{percent}': percentile(bytes_read, percent) for percent in (50, 95, 99)},
+                                         mean=sum(bytes_read) / len(bytes_read) if bytes_read else 0.0),
+        'query_cache': search_engine.get_cache_stats(),
+        'postings_cache': search_engine.get_postings_cache_stats(),
+    }
+
+
+# run the replay in each cache mode with a freshly opened search engine, so the cache counters are per mode
+# the warm replay is preceded by an unmeasured replay of the same queries filling the caches
+# stages also reports the time of each stage of the searches, measured by the search engine's instrumentation
+# threads searching at once, field_workers, max_open_files and drop_page_cache are passed on to the search engine
+# and replay_queries
+# the time to open the search engine and the file descriptors it holds are reported as its startup, and the index
+# files it opened as open_files
+def run_benchmark(queries, index_format='text', scorer='python', mode='or', top_k=None, page_size=10,
+                  cache_modes=('cold', 'warm'), stages=False, threads=1, field_workers=0, drop_page_cache=False,
+                  max_open_files=64):
+    report = {'settings': {'index_format': index_format, 'scorer': scorer, 'mode': mode, 'top_k': top_k,
+                           'page_size': page_size, 'queries': len(queries), 'distinct_queries': len(set(queries)),
+                           'threads': threads, 'field_workers': field_workers, 'drop_page_cache': drop_page_cache,
+                           'max_open_files': max_open_files}}
+    page_cache_files = get_index_files() if drop_page_cache else None
+    for cache_mode in cache_modes:
+        histogram = HistogramSink()
+        instrumentation = Instrumentation([histogram]) if stages else None
+        fds_before = count_open_fds()
+        opening = time.perf_counter()
+        with SearchEngine(index_format=index_format, scorer=scorer, instrumentation=instrumentation,
+                          field_workers=field_workers, max_open_files=max_open_files) as search_engine:
+            startup = {'ms': (time.perf_counter() - opening) * 1000,
+                       'fds': count_open_fds() - fds_before if fds_before is not None else None}
+            if cache_mode == 'warm':
+                replay_queries(search_engine, queries, mode, top_k, page_size, threads=threads)
+                histogram.clear()
+            report[cache_mode] = replay_queries(search_engine, queries, mode, top_k, page_size,
+                                                cache_mode == 'cold', threads, page_cache_files)
+            report[cache_mode]['startup'] = startup
+            report[cache_mode]['open_files'] = search_engine.get_open_file_stats()
+        if stages:
+            report[cache_mode]['stages'] = histogram.get_stats()['stages']
+    return report
+
+
+# generate a synthetic corpus in DEV and build its index in the current directory, unless it is already built
+def prepare_synthetic_index(corpus, index_format):
+    if os.path.exists(INDEX_DIRECTORIES[index_format]):
+        return
+    if not os.path.exists('DEV'):
+        print(f"Writing the synthetic corpus: {corpus.write_corpus('DEV')} bytes")
+
+    # the indexer reports every file it reads, only the time of the build is kept
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        Indexer(index_format=index_format).create_index('DEV')
+    print(f"Index built in {time.perf_counter() - started:.1f}s")
+
+
+# replay a query log against the indexes of the current directory, or of a synthetic corpus
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a query log against the search engine and report latency "
+                                                 "percentiles, throughput and postings bytes read per query")
+    parser.add_argument('--queries', default=None, help="file with one query per line")
+    parser.add_argument('--synthetic', default=None, metavar='DIRECTORY',
+                        help="search a synthetic corpus indexed in this directory, generated and built if missing, "
+                             "queries default to a synthetic query log")
+    parser.add_argument('--docs', type=int, default=2000, help="documents of the synthetic corpus")
+    parser.add_argument('--vocabulary', type=int, default=20000, help="distinct words of the synthetic corpus")
+    parser.add_argument('--zipf', type=float, default=1.1, help="Zipf exponent of the synthetic word frequencies")
+    parser.add_argument('--num-queries', type=int, default=1000, help="queries of the synthetic query log")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic corpus and queries")
+    parser.add_argument('--index-format', default='text', choices=list(INDEX_DIRECTORIES),
+                        help="format of the index to search")
+    parser.add_argument('--scorer', default='python', choices=['python', 'numpy'], help="scorer adding up scores")
+    parser.add_argument('--mode', default='or', choices=['or', 'and', 'phrase'], help="query mode")
+    parser.add_argument('--top-k', type=int, default=None, help="only rank the best results")
+    parser.add_argument('--page-size', type=int, default=10, help="results of the first page resolved to urls")
+    parser.add_argument('--cache', default='both', choices=['cold', 'warm', 'both'], help="cache modes to replay")
+    parser.add_argument('--stages', action='store_true', help="also report the time of each stage of the searches")
+    parser.add_argument('--threads', type=int, nargs='+', default=[1],
+                        help="threads searching at once, several counts replay the log once per count to report "
+                             "how the throughput scales")
+    parser.add_argument('--field-workers', type=int, default=0,
+                        help="threads reading the fields of a token of the text index at once")
+    parser.add_argument('--max-open-files', type=int, default=64,
+                        help="text index files the search engine keeps open at once")
+    parser.add_argument('--drop-page-cache', action='store_true',
+                        help="drop the index files from the operating system's page cache before every cold query, "
+                             "so they are read from the disk (unix only)")
+    parser.add_argument('--output', default=None, help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    output_path = os.path.abspath(args.output) if args.output else None
+    query_path = os.path.abspath(args.queries) if args.queries else None
+    if args.synthetic:
+        synthetic_corpus = SyntheticCorpus(args.docs, args.vocabulary, args.zipf, seed=args.seed)
+        os.makedirs(args.synthetic, exist_ok=True)
+        os.chdir(args.synthetic)
+        prepare_synthetic_index(synthetic_corpus, args.index_format)
+        if query_path is None:
+            query_path = os.path.abspath('queries.txt')
+            synthetic_corpus.write_queries(query_path, args.num_queries)
+    elif query_path is None:
+        parser.error("--queries is required without --synthetic")
+
+    with open(query_path, 'r', encoding='utf-8') as query_file:
+        replayed_queries = [line.strip() for line in query_file if line.strip()]
+
+    benchmark_modes = ('cold', 'warm') if args.cache == 'both' else (args.cache,)
+    benchmarks = {}
+    for thread_count in args.threads:
+        benchmarks[thread_count] = run_benchmark(replayed_queries, args.index_format, args.scorer, args.mode,
+                                                 args.top_k, args.page_size, benchmark_modes, args.stages,
+                                                 thread_count, args.field_workers, args.drop_page_cache,
+                                                 args.max_open_files)
+
+    # several thread counts are reported side by side, with the throughput of each relative to the first
+    if len(benchmarks) == 1:
+        benchmark = benchmarks[args.threads[0]]
+    else:
+        benchmark = {'threads': benchmarks, 'scaling': {}}
+        for cache_mode in benchmark_modes:
+            baseline_qps = benchmarks[args.threads[0]][cache_mode]['queries_per_second']
+            benchmark['scaling'][cache_mode] = {
+                thread_count: report[cache_mode]['queries_per_second'] / baseline_qps if baseline_qps else 0.0
+                for thread_count, report in benchmarks.items()}
+    print(json.dumps(benchmark, indent=2))
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as output:
+            json.dump(benchmark, output, indent=2)
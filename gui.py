@@ -17,8 +17,9 @@ def callback(url):
     webbrowser.open_new(url)
 
 
-def create_gui():
-    search_engine = SearchEngine()
+# instrumentation, if given, times the stages of every search
+def create_gui(instrumentation=None):
+    search_engine = SearchEngine(instrumentation=instrumentation)
 
     results = []
     current_page = 1
@@ -121,7 +122,7 @@ def create_gui():
             )
             prev_button.pack(side="left", padx=10, pady=10)
 
-        if end_index < len(results): # DT: Check if there are more results to show
+        if results.has_more(end_index): # DT: Check if there are more results to show
             next_button = tk.Button(
                 master=bottom_frame,
                 text="Next",
@@ -142,7 +143,7 @@ def create_gui():
 
         query = search_query.get()
         start_time = time.time()
-        results = search_engine.search_query(query)
+        results = search_engine.search_query(query) # results are only sorted up to the pages shown
         execution_time_ms = (time.time() - start_time) * 1000 # DT: Calculate execution time in milliseconds
         if len(results) == 0:
             display_no_results()
@@ -151,7 +152,7 @@ def create_gui():
 
     def next_page(event=None):
         nonlocal current_page
-        if (current_page * results_per_page) < len(results): # DT: Only move to the next page if there are more results
+        if results and results.has_more(current_page * results_per_page): # DT: Only move to the next page if there are more results
             current_page += 1
             display_results()
 
@@ -221,7 +222,11 @@ def create_gui():
     window.bind("<Shift-Left>", prev_page)  # DT: Binds Shift + Left Arrow to prev_page
     window.bind("<Shift-Right>", next_page)  # DT: Binds Shift + Right Arrow to next_page
 
-    window.mainloop()
+    # the indexes are released once the window is closed
+    try:
+        window.mainloop()
+    finally:
+        search_engine.close()
 
 
 if __name__ == "__main__":
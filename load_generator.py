@@ -0,0 +1,132 @@
+import asyncio
+import argparse
+import itertools
+import json
+import time
+from collections import Counter
+from urllib.parse import urlencode
+
+# queries sent when no query file is given
+DEFAULT_QUERIES = ['cristina lopes', 'machine learning', 'ACM', 'master of software engineering',
+                   'computer science', 'informatics', 'graduate courses', 'research']
+
+
+# return the value below which percent of the sorted values fall, nearest rank
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[int(rank) - 1]
+
+
+# send a request on an open connection and read its response, returns (status, payload)
+async def _send_request(reader, writer, host, method, target, body=b''):
+    request = [f'{method} {target} HTTP/1.1', f'Host: {host}', 'Connection: keep-alive',
+               f'Content-Length: {len(body)}']
+    if body:
+        request.append('Content-Type: application/json')
+    writer.write(('\r\n'.join(request) + '\r\n\r\n').encode('latin-1') + body)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed by the server")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    payload = json.loads(await reader.readexactly(int(headers.get('content-length', 0))) or b'{}')
+    if headers.get('connection', '').lower() == 'close':
+        writer.close()
+    return status, payload
+
+
+# one client sending requests back to back on a kept alive connection until the end time or the request count
+# queries are taken in turn from the shared iterator, batch_size > 1 sends them to /batch instead of /search
+async def _run_client(host, port, queries, end_time, requests_left, batch_size, mode, results):
+    reader = writer = None
+    while time.perf_counter() < end_time and requests_left[0] > 0:
+        requests_left[0] -= 1
+        if writer is None or writer.is_closing():
+            reader, writer = await asyncio.open_connection(host, port)
+
+        if batch_size > 1:
+            body = json.dumps({'queries': [{'q': next(queries), 'mode': mode} for _ in range(batch_size)]})
+            method, target, body = 'POST', '/batch', body.encode('utf-8')
+        else:
+            method, target, body = 'GET', '/search?' + urlencode({'q': next(queries), 'mode': mode}), b''
+
+        started = time.perf_counter()
+        try:
+            status, payload = await _send_request(reader, writer, host, method, target, body)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            results['statuses']['connection error'] += 1
+            writer.close()
+            writer = None
+            continue
+        results['latencies'].append(time.perf_counter() - started)
+        results['statuses'][status] += 1
+
+        # server side time spent searching, reported in the timings of every answered query
+        for response in payload.get('responses', [payload]):
+            if 'timings' in response:
+                results['search_ms'].append(response['timings']['search_ms'])
+
+    if writer is not None:
+        writer.close()
+
+
+# replay the queries from concurrent clients and return the throughput and latency report
+async def run_load(host, port, queries, connections=16, duration=10.0, requests=None, batch_size=1, mode='or'):
+    results = {'latencies': [], 'statuses': Counter(), 'search_ms': []}
+    shared_queries = itertools.cycle(queries)
+    requests_left = [requests if requests is not None else float('inf')]
+    started = time.perf_counter()
+    await asyncio.gather(*(_run_client(host, port, shared_queries, started + duration, requests_left, batch_size,
+                                       mode, results) for _ in range(connections)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(results['latencies'])
+    search_ms = sorted(results['search_ms'])
+    return {
+        'requests': len(latencies),
+        'queries': len(search_ms),
+        'seconds': elapsed,
+        'requests_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'latency_ms': {f'p{percent}': percentile(latencies, percent) * 1000 for percent in (50, 95, 99)},
+        'server_search_ms': {f'p{percent}': percentile(search_ms, percent) for percent in (50, 95, 99)},
+        'statuses': {str(status): count for status, count in results['statuses'].items()},
+    }
+
+
+# generate load against a running server.py
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Send concurrent queries to the search server and report "
+                                                 "throughput and latency")
+    parser.add_argument('--host', default='127.0.0.1', help="address of the server")
+    parser.add_argument('--port', type=int, default=8080, help="port of the server")
+    parser.add_argument('--connections', type=int, default=16, help="concurrent clients")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds to send requests for")
+    parser.add_argument('--requests', type=int, default=None, help="stop after this many requests")
+    parser.add_argument('--batch', type=int, default=1, help="queries per request, sent to /batch if more than 1")
+    parser.add_argument('--mode', default='or', choices=['or', 'and', 'phrase'], help="query mode")
+    parser.add_argument('--queries', default=None, help="file with one query per line")
+    parser.add_argument('--output', default=None, help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    if args.queries:
+        with open(args.queries, 'r', encoding='utf-8') as query_file:
+            load_queries = [line.strip() for line in query_file if line.strip()]
+    else:
+        load_queries = DEFAULT_QUERIES
+
+    report = asyncio.run(run_load(args.host, args.port, load_queries, args.connections, args.duration,
+                                  args.requests, args.batch, args.mode))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=2)
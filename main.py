@@ -1,10 +1,24 @@
 import os
+import argparse
 from Indexer import Indexer
+from Instrumentation import Instrumentation
 from gui import create_gui
 
 # creates a frequency and importance index
 # if the index is already constructed, run the gui
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the indexes if needed, then start the search gui")
+    parser.add_argument('--workers', type=int, default=1, help="number of processes used to build the indexes")
+    parser.add_argument('--memory-budget', type=int, default=256,
+                        help="megabytes of postings held in memory before a partial index is spilled to disk")
+    parser.add_argument('--positional', action='store_true',
+                        help="also build the position index used by phrase queries")
+    parser.add_argument('--tokenizer', default='streaming', choices=['streaming', 'bs4'],
+                        help="tokenize documents in a single pass over the HTML, or with a beautiful soup tree")
+    parser.add_argument('--trace', action='store_true',
+                        help="print the time of each stage of the build and of every search")
+    args = parser.parse_args()
+    instrumentation = Instrumentation(trace=True) if args.trace else None
 
     # get directories
     cwd = os.getcwd()
@@ -17,8 +31,9 @@ if __name__ == '__main__':
         directory = 'DEV'
         # create index
         print(f"creating indexes from : {os.path.join(cwd, directory)}")
-        index = Indexer()
-        index.create_index(os.path.join(cwd, directory))
+        index = Indexer(memory_budget=args.memory_budget * 1024 * 1024, positional=args.positional,
+                        instrumentation=instrumentation, tokenizer=args.tokenizer)
+        index.create_index(os.path.join(cwd, directory), workers=args.workers)
 
     # create gui for searching
-    create_gui()
+    create_gui(instrumentation)
@@ -1,7 +1,29 @@
+import io
 import os
+import mmap
+import heapq
+import bisect
+import threading
 from collections import defaultdict
-from nltk.stem import PorterStemmer
-from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from Normalizer import Normalizer
+from Lexicon import Lexicon
+from BinaryPostings import decode_postings, decode_skips, lookup_postings, get_skips_field, FIELDS
+from FieldedPostings import decode_fielded_postings, FIELDED
+from DocStore import DocStore
+from IndexFile import IndexFilePool
+from IndexManifest import IndexManifest
+from ScoreBounds import ScoreBounds
+from Scoring import calculate_tfidf_weight, IMPORTANCE_WEIGHTS
+from ResultCursor import ResultCursor
+from QueryCache import QueryCache
+from PostingsCache import PostingsCache
+from NumpyScorer import NumpyScorer, decode_postings_arrays, postings_to_arrays, np
+from ImpactPostings import read_impact_segments, load_impact_settings, IMPACT
+from PositionalPostings import lookup_positions, extend_phrase, POSITIONS
+from Instrumentation import Instrumentation
+from itertools import accumulate, compress, repeat
 from pathlib import Path
 import math
 import re
@@ -23,99 +45,553 @@ STOP_WORDS = {
     "wouldn't", "you", "you'd", "you'll", "you're", "you've", "your", "yours", "yourself", "yourselves"
 }
 
+# postings cache field of the per-token score contributions top k searches visit
+CONTRIBUTIONS = 'contributions'
+# most postings read from each essential token at a time by top k searches
+TOP_K_BLOCK = 128
+# average postings per token up to which top k searches add up every contribution rather than skip any
+TOP_K_SHORT_POSTINGS = 16384
 
-# calculates the tf-idf weight for a token
-# a weight is applied for importance tags (h1,h2,h3,i,em,b,title,strong)
-def calculate_tfidf_weight(tf, idf, *, weight=1.0, log=False):
-    # use this if the tf being passed in is the raw tf (log is not applied)
-    if log and weight != 0:
-        return math.log10(tf*weight) * idf
-    # assumed the tf has log applied to it already
-    return tf * idf * weight
 
 
 # conducts searching of queries and returns top results
 class SearchEngine:
-    def __init__(self):
-        self.stemmer = PorterStemmer()  # for stemming queries
+    # index_format is 'text' for the merged text indexes, 'binary' for the memory mapped binary index,
+    # or 'fielded' for the memory mapped index holding every field of a (token, doc_id) in one record,
+    # or 'impact' for the memory mapped index of precomputed impacts, searched score at a time
+    # the results of the last cache_entries queries are cached, up to an estimated cache_bytes, 0 disables it
+    # decoded postings are cached up to an estimated postings_cache_bytes, pre-warmed with the postings of the
+    # prewarm tokens found in the most documents
+    # scorer is 'python' to add up scores posting by posting, or 'numpy' to score postings arrays at once
+    # instrumentation times the stages of every search and reports them to its sinks, nothing is recorded without it
+    # searches can run from several threads at once, the indexes are read at offsets without a shared file position
+    # and the caches are locked, with field_workers the 9 fields of a token of the text index are read in parallel
+    # text index files are only opened once read, at most max_open_files of them are kept open
+    # close() releases every index, or use the engine as a context manager: with SearchEngine() as search_engine
+    def __init__(self, index_format='text', cache_entries=1024, cache_bytes=64 * 1024 * 1024,
+                 postings_cache_bytes=128 * 1024 * 1024, prewarm=0, scorer='python', instrumentation=None,
+                 field_workers=0, max_open_files=64):
+        self._normalizer = Normalizer() # for stemming queries, shared logic with the indexer
+        self._instrumentation = instrumentation or Instrumentation()    # stage timers and counters of the searches
+        self._index_format = index_format
+        self._scorer = scorer
+        self._numpy_scorer = None       # vectorized scorer, only used with the 'numpy' scorer
+        self._query_cache = QueryCache(cache_entries, cache_bytes)  # results of repeated queries
+        self._postings_cache = PostingsCache(postings_cache_bytes)  # postings of the tokens searched most
+        # top k searches need the postings cache to keep the contributions they rank between queries
+        self._has_contributions_cache = postings_cache_bytes > 0
+        self._generation = None         # identifies the index files opened, cached results belong to it
+        self._postings_bytes_read = 0   # bytes of postings read from the indexes, postings found in the cache excluded
+        self._bytes_read_lock = threading.Lock()    # searching threads add up their bytes read
+        self._local = threading.local() # bytes read by the query each thread is searching
+        self._field_executor = None     # threads reading the fields of a token, only used with field_workers
+        if field_workers > 0:
+            self._field_executor = ThreadPoolExecutor(max_workers=field_workers, thread_name_prefix='fields')
 
-        self._doc_manager_handle = None # file handle for the document manager
+        self._doc_manager_path = None   # path of the document manager, read through the file pool
+        self._doc_manager_offsets = []  # byte offset of each line of the document manager, one line per doc_id
+        self._manifest = IndexManifest()    # files of the last build, written by the indexer
+        self._has_manifest = False      # indexes built before the manifest existed are found by searching directories
+        self._doc_store = DocStore()    # memory mapped document store, resolves doc_ids in constant time
+        self._has_doc_store = False     # indexes built before the document store existed use the text file
+        self._lexicon = Lexicon()       # term dictionary locating each token's postings
+        self._has_lexicon = False       # indexes built before the lexicon existed are scanned instead
+        self._score_bounds = ScoreBounds()  # best score of each token, for top k searches
+        self._has_score_bounds = False  # without them, bounds are derived from the max tfs in the lexicon
+        self._position_lexicon = Lexicon()  # term dictionary of the optional position index
+        self._has_positions = False     # phrase queries only match documents containing every token without it
 
-        self._freq_file_handles = {}    # file handles for all frequency indexes
+        # text index files are opened on their first read by the file pool, at most max_open_files at once
+        # they are read at offsets, so an open file is shared by every searching thread
+        self._index_files = IndexFilePool(max_open_files)
+        self._freq_files = {}           # paths of all frequency indexes {letter : path}
 
-        self._bold_handles = {}         # file handles for all bold indexes
-        self._emphasis_handles = {}     # file handles for all emphasis indexes
-        self._h1_handles = {}           # file handles for all h1 indexes
-        self._h2_handles = {}           # file handles for all h2 indexes
-        self._h3_handles = {}           # file handles for all h3 indexes
-        self._italics_handles = {}      # file handles for all italics indexes
-        self._strong_handles = {}       # file handles for all strong indexes
-        self._title_handles = {}        # file handles for all titles indexes
+        self._bold_files = {}           # paths of all bold indexes
+        self._emphasis_files = {}       # paths of all emphasis indexes
+        self._h1_files = {}             # paths of all h1 indexes
+        self._h2_files = {}             # paths of all h2 indexes
+        self._h3_files = {}             # paths of all h3 indexes
+        self._italics_files = {}        # paths of all italics indexes
+        self._strong_files = {}         # paths of all strong indexes
+        self._title_files = {}          # paths of all titles indexes
 
-        # aggregate the above file handles for important tags
-        # frequency file handle not included
-        self._important_file_handles = [self._bold_handles, self._emphasis_handles, self._h1_handles, self._h2_handles]
-        self._important_file_handles.extend([self._h3_handles, self._italics_handles, self._strong_handles, self._title_handles])
+        self._binary_postings = {}      # memory mapped binary, fielded, impact or position postings {field : mmap}
+        self._impact_scale = 1.0        # impacts are scores multiplied by this scale
 
-        # parallel arrays for indexing the above file handles and applying weights
-        self._important_handles_index = {'b': 0, 'em': 1, 'h1': 2, 'h2': 3, 'h3': 4, 'i': 5, 'strong': 6, 'title': 7}
-        self._importance_weights = [('b',25), ('em',0), ('h1',100), ('h2',50), ('h3',25), ('i',0), ('strong',25), ('title',100)]
+        # aggregate the above file paths for important tags
+        # frequency file paths not included
+        self._important_files = [self._bold_files, self._emphasis_files, self._h1_files, self._h2_files]
+        self._important_files.extend([self._h3_files, self._italics_files, self._strong_files, self._title_files])
+
+        # parallel arrays for indexing the above file paths and applying weights
+        self._important_files_index = {'b': 0, 'em': 1, 'h1': 2, 'h2': 3, 'h3': 4, 'i': 5, 'strong': 6, 'title': 7}
+        self._importance_weights = list(IMPORTANCE_WEIGHTS)
 
         # open all indexes available for searching
         self._open_all_indexes()
+        self._open_scorer()
+
+        # load the postings of the most common tokens ahead of the first queries
+        if prewarm > 0 and self._has_lexicon:
+            field = FIELDED if self._index_format == 'fielded' else 'frequency'
+            for token in self._lexicon.get_top_tokens(field, prewarm):
+                self._prewarm_token(token)
 
     def _open_all_indexes(self):
         # get cwd
         cwd = os.getcwd()
 
-        # get frequency directory containing indexes and recursively open each one
+        # the manifest lists the files of the last build, so they are not searched for
+        self._has_manifest = self._manifest.load_manifest_from_file(os.path.join(cwd, 'IndexManifest.json'))
+
+        # cached results of another index generation are stale
+        self._generation = self._get_index_generation(cwd)
+        self._query_cache.set_generation(self._generation)
+
+        # open the postings for the chosen index format
+        if self._index_format == 'binary':
+            self._open_binary_indexes(cwd)
+        elif self._index_format == 'fielded':
+            self._open_fielded_index(cwd)
+        elif self._index_format == 'impact':
+            self._open_impact_index(cwd)
+        else:
+            self._open_text_indexes(cwd)
+
+        # the position index is optional and used with any index format
+        self._open_position_index(cwd)
+
+        # load the score bounds, they are only usable if they were computed with the current weights
+        self._has_score_bounds = self._score_bounds.load_score_bounds_from_file(os.path.join(cwd, 'ScoreBounds.txt'))
+        if self._has_score_bounds and not self._score_bounds.has_weights(self._importance_weights):
+            self._has_score_bounds = False
+
+        # pre-warm the normalizer with the stems of the indexed vocabulary
+        self._normalizer.load_cache_from_file(os.path.join(cwd, 'StemCache.txt'))
+
+        # open the document store, fall back to the document manager text file if it does not exist
+        self._has_doc_store = self._doc_store.open_doc_store(os.path.join(cwd, 'DocumentStore.bin'))
+        if self._has_doc_store:
+            return
+
+        # open the document manager
+        path = Path(os.path.join(cwd, 'DocumentManager.txt'))
+        if not path.exists():
+            print("Document Manager directory does not exist!")
+        else:
+            self._open_doc_manager(path)
+
+    # locate the line of every doc_id in the document manager, so a url is read without scanning the lines before it
+    # the file itself is opened by the file pool once a url is read
+    def _open_doc_manager(self, path):
+        self._doc_manager_path = str(path)
+        self._doc_manager_offsets = [0]
+        with open(path, 'rb') as doc_manager:
+            for line in doc_manager:
+                self._doc_manager_offsets.append(self._doc_manager_offsets[-1] + len(line))
+
+    # locate every frequency and importance letter file, opened on their first read, and load the lexicon locating
+    # tokens within them
+    def _open_text_indexes(self, cwd):
+        # the manifest lists the letter files, e.g. Frequency_Index/a.txt or Importance_Index/b/a.txt
+        if self._has_manifest and self._manifest.has_segment('text'):
+            for file in self._manifest.get_segment_files('text'):
+                if not file.endswith('.txt'):
+                    continue
+                parts = file.split(os.sep)
+                if parts[0] == 'Frequency_Index':
+                    self._freq_files[parts[-1][0]] = os.path.join(cwd, file)
+                elif parts[1] in self._important_files_index:
+                    index = self._important_files_index[parts[1]]
+                    self._important_files[index][parts[-1][0]] = os.path.join(cwd, file)
+        else:
+            self._find_text_index_files(cwd)
+
+        # load the term dictionary, fall back to scanning the indexes if it does not exist
+        self._has_lexicon = self._lexicon.load_lexicon_from_file(os.path.join(cwd, 'Lexicon.txt'))
+        if not self._has_lexicon:
+            print("Lexicon does not exist! Postings will be found by scanning the indexes")
+
+    # search the index directories for the letter files of indexes built without a manifest
+    def _find_text_index_files(self, cwd):
+        # get frequency directory containing indexes and recursively find each one
         path = Path(os.path.join(cwd, 'Frequency_Index'))
         if not path.exists():
             print("Frequency Index directory does not exist!")
         else:
             for file in path.rglob('*.txt'):
-                self._freq_file_handles[file.name[0]] = open(file, 'r', encoding='utf-8')
+                self._freq_files[file.name[0]] = str(file)
 
-        # get importance directory containing indexes and recursively open each one
-        for directory, index in self._important_handles_index.items():
+        # get importance directory containing indexes and recursively find each one
+        for directory, index in self._important_files_index.items():
             path = Path(os.path.join(cwd, 'Importance_Index', directory))
             if not path.exists():
                 print("Importance Index directory does not exist!")
             else:
                 for file in path.rglob('*.txt'):
-                    self._important_file_handles[index][file.name[0]] = open(file, 'r', encoding='utf-8')
+                    self._important_files[index][file.name[0]] = str(file)
 
-        # open the document manager
-        path = Path(os.path.join(cwd, 'DocumentManager.txt'))
+    # memory map each field of the binary index and load its lexicon
+    def _open_binary_indexes(self, cwd):
+        path = Path(os.path.join(cwd, 'Binary_Index'))
         if not path.exists():
-            print("Document Manager directory does not exist!")
+            print("Binary Index directory does not exist!")
+            return
+
+        # binary indexes built before skip tables existed are intersected by decoding whole postings
+        for field in FIELDS:
+            for key, file_path in [(field, os.path.join(path, f'{field}.bin')),
+                                   (get_skips_field(field), os.path.join(path, f'{field}.skips'))]:
+                # empty files cannot be memory mapped and have no postings anyway
+                if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+                    with open(file_path, 'rb') as file:
+                        self._binary_postings[key] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._has_lexicon = self._lexicon.load_lexicon_from_file(os.path.join(path, 'Lexicon.txt'))
+        if not self._has_lexicon:
+            print("Binary Index lexicon does not exist!")
+
+    # memory map the fielded index and load its lexicon
+    def _open_fielded_index(self, cwd):
+        file_path = os.path.join(cwd, 'Fielded_Index', 'postings.bin')
+        if not os.path.exists(file_path):
+            print("Fielded Index does not exist!")
+            return
+
+        # empty files cannot be memory mapped and have no postings anyway
+        if os.path.getsize(file_path) > 0:
+            with open(file_path, 'rb') as file:
+                self._binary_postings[FIELDED] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._has_lexicon = self._lexicon.load_lexicon_from_file(os.path.join(cwd, 'Fielded_Index', 'Lexicon.txt'))
+        if not self._has_lexicon:
+            print("Fielded Index lexicon does not exist!")
+
+    # memory map the impact index and load its lexicon and the scale of its impacts
+    def _open_impact_index(self, cwd):
+        path = os.path.join(cwd, 'Impact_Index')
+        file_path = os.path.join(path, 'postings.bin')
+        if not os.path.exists(file_path):
+            print("Impact Index does not exist!")
+            return
+
+        # empty files cannot be memory mapped and have no postings anyway
+        if os.path.getsize(file_path) > 0:
+            with open(file_path, 'rb') as file:
+                self._binary_postings[IMPACT] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._has_lexicon = self._lexicon.load_lexicon_from_file(os.path.join(path, 'Lexicon.txt'))
+        if not self._has_lexicon:
+            print("Impact Index lexicon does not exist!")
+
+        # the impacts already include the importance weights they were built with
+        settings = load_impact_settings(os.path.join(path, 'Settings.txt'))
+        if settings is None:
+            print("Impact Index settings do not exist!")
+            return
+        self._impact_scale, weights = settings
+        if weights != self._importance_weights:
+            print("Impact Index was built with other importance weights, rebuild it to apply the current ones")
+
+    # memory map the position index and load its lexicon, if the index was built with positions
+    def _open_position_index(self, cwd):
+        path = os.path.join(cwd, 'Position_Index')
+        for key, file_name in [(POSITIONS, 'positions.bin'), (get_skips_field(POSITIONS), 'positions.skips')]:
+            file_path = os.path.join(path, file_name)
+            # empty files cannot be memory mapped and have no postings anyway
+            if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+                with open(file_path, 'rb') as file:
+                    self._binary_postings[key] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._has_positions = self._position_lexicon.load_lexicon_from_file(os.path.join(path, 'Lexicon.txt'))
+
+    # return the generation of the index files, it changes whenever the index is rebuilt
+    # built from the size and modification time of the files written last by the indexer, the manifest included,
+    # which is rewritten with a new generation id by every build
+    def _get_index_generation(self, cwd):
+        if self._index_format == 'binary':
+            lexicon_path = os.path.join(cwd, 'Binary_Index', 'Lexicon.txt')
+        elif self._index_format == 'fielded':
+            lexicon_path = os.path.join(cwd, 'Fielded_Index', 'Lexicon.txt')
+        elif self._index_format == 'impact':
+            lexicon_path = os.path.join(cwd, 'Impact_Index', 'Lexicon.txt')
         else:
-            self._doc_manager_handle = open("DocumentManager.txt", 'r', encoding='utf-8')
+            lexicon_path = os.path.join(cwd, 'Lexicon.txt')
+
+        generation = []
+        for file_path in [lexicon_path, os.path.join(cwd, 'Position_Index', 'Lexicon.txt'),
+                          os.path.join(cwd, 'ScoreBounds.txt'), os.path.join(cwd, 'DocumentStore.bin'),
+                          os.path.join(cwd, 'IndexManifest.json')]:
+            if os.path.exists(file_path):
+                stat = os.stat(file_path)
+                generation.append((os.path.basename(file_path), stat.st_size, stat.st_mtime_ns))
+        return tuple(generation)
+
+    # reopen the indexes if they were rebuilt since they were opened, which also drops the cached results
+    # returns True if the indexes were reopened, no search may run while the indexes are reopened
+    def reload_indexes(self):
+        if self._get_index_generation(os.getcwd()) == self._generation:
+            return False
 
-    # close all opened file handles
+        self._close_all_indexes()
+        self._freq_files.clear()
+        for files in self._important_files:
+            files.clear()
+        self._binary_postings.clear()
+        self._doc_manager_path = None
+        self._doc_manager_offsets = []
+        self._manifest = IndexManifest()
+        self._doc_store = DocStore()
+        self._lexicon = Lexicon()
+        self._position_lexicon = Lexicon()
+        self._score_bounds = ScoreBounds()
+        self._postings_cache.clear()
+        self._open_all_indexes()
+        self._open_scorer()
+        return True
+
+    # create the numpy scorer for the documents of the index, fall back to the python scorer without numpy
+    def _open_scorer(self):
+        if self._scorer != 'numpy':
+            return
+        if np is None:
+            print("NumPy is not installed! Scores will be added up by the python scorer")
+            self._scorer = 'python'
+            return
+        num_docs = len(self._doc_store) if self._has_doc_store else 0
+        self._numpy_scorer = NumpyScorer(self._importance_weights, calculate_tfidf_weight, num_docs)
+
+    # load the postings of every token of the given queries, e.g. the most frequent queries of a query log
+    def prewarm_postings_cache(self, queries):
+        for query in queries:
+            for token in self._parse_query(query):
+                self._prewarm_token(token)
+
+    # load a token's postings into the postings cache in the form the scorer uses
+    def _prewarm_token(self, token):
+        if self._scorer == 'numpy':
+            self._load_term_arrays(token)
+        else:
+            self._load_term_postings(token)
+
+    # return the query cache counters
+    def get_cache_stats(self):
+        return self._query_cache.get_stats()
+
+    # return the postings cache counters, overall and per field
+    def get_postings_cache_stats(self):
+        return self._postings_cache.get_stats()
+
+    # return the number of bytes of postings read from the indexes since the engine was opened
+    def get_postings_bytes_read(self):
+        return self._postings_bytes_read
+
+    # return the number of bytes of postings read by the last query searched in the current thread
+    def get_query_bytes_read(self):
+        return getattr(self._local, 'bytes_read', 0)
+
+    # add up bytes of postings read, overall and for the query the current thread is searching
+    def _count_bytes_read(self, read_bytes):
+        with self._bytes_read_lock:
+            self._postings_bytes_read += read_bytes
+        self._local.bytes_read = getattr(self._local, 'bytes_read', 0) + read_bytes
+
+    # drop the cached query results and postings, e.g. to measure searches on a cold cache
+    def clear_caches(self):
+        self._query_cache.clear()
+        self._postings_cache.clear()
+
+    # return the counters of the text index files opened on their first read, and the number of memory mapped files
+    def get_open_file_stats(self):
+        return dict(self._index_files.get_stats(), memory_mapped=len(self._binary_postings) + self._has_doc_store)
+
+    # return the manifest of the indexes opened, None for indexes built before the manifest existed
+    def get_manifest(self):
+        return self._manifest if self._has_manifest else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # release every index and the field workers, no search may run once the engine is closed
+    def close(self):
+        self._close_all_indexes()
+        self._binary_postings.clear()
+        self._has_doc_store = False
+        if self._field_executor is not None:
+            self._field_executor.shutdown(wait=True)
+            self._field_executor = None
+
+    # close all opened files
     def _close_all_indexes(self):
-        for handle in self._freq_file_handles.values():
-            handle.close()
-        for handle in self._important_file_handles:
-            for file in handle.values():
-                file.close()
-        self._doc_manager_handle.close()
+        self._index_files.close()
+        for binary_postings in self._binary_postings.values():
+            binary_postings.close()
+        self._doc_store.close()
+
+    # retrieve a token's frequency postings and idf, and its postings for every importance tag
+    # the fielded index returns all of them from a single lookup, the other formats load each field
+    def _load_term_postings(self, token):
+        if self._index_format == 'fielded':
+            cached = self._postings_cache.get(FIELDED, token)
+            if cached is not None:
+                return cached
+            entry = self._lexicon.get_entry(FIELDED, token)
+            if entry is None or FIELDED not in self._binary_postings:
+                return {}, None, [{} for _ in self._importance_weights]
+            _, offset, length, _, idf, _ = entry
+            with self._instrumentation.timer('search.postings.fielded'):
+                freq_postings, importance_postings = decode_fielded_postings(self._binary_postings[FIELDED], offset,
+                                                                             length)
+            self._count_bytes_read(length)
+            num_postings = len(freq_postings) + sum(len(postings) for postings in importance_postings)
+            self._postings_cache.put(FIELDED, token, (freq_postings, idf, importance_postings), num_postings, length)
+            return freq_postings, idf, importance_postings
+
+        # each field of the text index is a file of its own, the reads wait on the disk in parallel
+        # the other formats decode memory mapped postings, which does not release the GIL
+        if self._field_executor is not None and self._index_format == 'text':
+            trace = self._instrumentation.get_trace()
+            loaded = list(self._field_executor.map(self._load_field_in_worker, repeat(trace), repeat(token),
+                                                   [None] + list(self._important_files_index.values())))
+            self._local.bytes_read = getattr(self._local, 'bytes_read', 0) + sum(read for _, read in loaded)
+            fields = [field for field, _ in loaded]
+        else:
+            # load the token's frequency postings and idf, then its importance postings for each tag
+            # [b,em,h1,h2,h3,i,strong,title]
+            fields = [self._load_postings_for_token(token, postings_type='frequency')]
+            for tag, index in self._important_files_index.items():
+                fields.append(self._load_postings_for_token(token, postings_type='importance', tag_index=index))
+
+        (freq_postings, freq_idf), importance_fields = fields[0], fields[1:]
+        importance_postings = [postings for postings, _ in importance_fields]
+        return freq_postings, self._get_term_idf(freq_idf, importance_fields), importance_postings
+
+    # return the idf a token is scored with, given its frequency idf and the (postings, idf) of its importance fields
+    # importance postings are scored with the frequency idf, a token only seen inside importance tags falls back to
+    # the idf of the first tag it appears in, like the fielded and impact indexes
+    @staticmethod
+    def _get_term_idf(freq_idf, importance_fields):
+        if freq_idf is not None:
+            return freq_idf
+        return next((idf for postings, idf in importance_fields if postings), None)
+
+    # load a field of a token in a field worker thread, the frequency field if tag_index is None
+    # returns the field's (postings, idf) and the bytes read, added to the query of the thread that asked for them
+    # its stages are timed into trace, the trace of the query that thread is searching
+    def _load_field_in_worker(self, trace, token, tag_index):
+        self._local.bytes_read = 0
+        with self._instrumentation.use_trace(trace):
+            if tag_index is None:
+                loaded = self._load_postings_for_token(token, postings_type='frequency')
+            else:
+                loaded = self._load_postings_for_token(token, postings_type='importance', tag_index=tag_index)
+        return loaded, self._local.bytes_read
+
+    # retrieve a token's frequency idf and its postings arrays (doc_ids, tfs), frequency first then each tag
+    # the binary index is decoded straight into arrays, the other formats convert their decoded postings
+    def _load_term_arrays(self, token):
+        if self._index_format != 'binary':
+            freq_postings, freq_idf, importance_postings = self._load_term_postings(token)
+            return freq_idf, [postings_to_arrays(postings) for postings in [freq_postings] + importance_postings]
+
+        fields = []
+        freq_idf = None
+        for field in FIELDS:
+            cached = self._postings_cache.get(field, token)
+            if cached is None:
+                entry = self._lexicon.get_entry(field, token)
+                if entry is None or field not in self._binary_postings:
+                    cached = (decode_postings_arrays(b'', 0, 0), None)
+                    read_bytes = 0
+                else:
+                    _, offset, length, _, idf, _ = entry
+                    with self._instrumentation.timer(f'search.postings.{field}'):
+                        cached = (decode_postings_arrays(self._binary_postings[field], offset, length), idf)
+                    read_bytes = length
+                    self._count_bytes_read(length)
+                self._postings_cache.put(field, token, cached, len(cached[0][0]), read_bytes)
+            arrays, idf = cached
+            if field == 'frequency':
+                freq_idf = idf
+            elif freq_idf is None and len(arrays[0]):
+                freq_idf = idf
+            fields.append(arrays)
+        return freq_idf, fields
 
     # retrieve postings for a token from the frequency and important indexes
     def _load_postings_for_token(self, token, *, postings_type, tag_index=None):
         if postings_type.lower() == 'frequency':
-            return self._helper_load_postings_for_token(token, self._freq_file_handles[token[0]])
-        if postings_type.lower() == 'importance':
-            return self._helper_load_postings_for_token(token, self._important_file_handles[tag_index][token[0]])
+            field = 'frequency'
+            file_path = self._freq_files.get(token[0])
+        elif postings_type.lower() == 'importance':
+            field = self._importance_weights[tag_index][0]
+            file_path = self._important_files[tag_index].get(token[0])
+        else:
+            return {}, None
+
+        # postings of tokens searched recently or often are already decoded
+        cached = self._postings_cache.get(field, token)
+        if cached is not None:
+            return cached
+
+        # tokens missing from the lexicon are not in the index, no need to touch the disk
+        entry = self._lexicon.get_entry(field, token)
+        if self._index_format != 'binary' and self._has_lexicon and (entry is None or not file_path):
+            return {}, None
+
+        with self._instrumentation.timer(f'search.postings.{field}'):
+            if self._index_format == 'binary':
+                postings, idf = self._read_binary_postings(field, token)
+            elif not self._has_lexicon:
+                postings, idf = self._helper_load_postings_for_token(token, file_path)
+            else:
+                postings, idf = self._read_postings_block(file_path, entry)
+
+        # without a lexicon the whole file was scanned, otherwise only the token's block was read
+        if entry is not None:
+            read_bytes = entry[2]
+        elif file_path:
+            read_bytes = self._index_files.get_size(file_path)
+        else:
+            read_bytes = 0
+        self._count_bytes_read(read_bytes)
+        self._postings_cache.put(field, token, (postings, idf), len(postings), read_bytes)
+        return postings, idf
+
+    # retrieve postings for a token from the memory mapped binary index
+    def _read_binary_postings(self, field, token):
+        entry = self._lexicon.get_entry(field, token)
+        if entry is None or field not in self._binary_postings:
+            return {}, None
+        _, offset, length, _, idf, _ = entry
+        return decode_postings(self._binary_postings[field], offset, length), idf
+
+    # retrieve postings for a token by jumping straight to its block using its lexicon entry
+    def _read_postings_block(self, file_path, entry):
+        _, offset, length, _, idf, _ = entry
+
+        # index files only contain ascii, so byte offsets and character counts are the same
+        block = self._index_files.read(file_path, offset, length).decode('utf-8')
+
+        # skip the token and idf lines, read postings (doc_id, tf)
+        postings = {}
+        for line in block.split('\n')[2:]:
+            if line:
+                data = line.strip("()").split(',')
+                postings[int(data[0])] = float(data[1])
+
+        return postings, idf
 
     # retrieve postings for a token from the frequency and important indexes
-    def _helper_load_postings_for_token(self, token, file_handle):
+    def _helper_load_postings_for_token(self, token, file_path):
         # if file doesnt exist, return nothing
-        if not file_handle:
+        if not file_path:
             return {}, 0
 
-        # reset file marker before searching
-        file_handle.seek(0)
+        # read the whole file, its lines are scanned with a file marker of their own
+        file_handle = io.StringIO(self._index_files.read_all(file_path).decode('utf-8'))
 
         # retrieved postings and idf
         postings = {}
@@ -150,21 +626,37 @@ class SearchEngine:
     # search document manager for top n results
     # top 5 --> index_start = 0, index_end = 5
     # next 5 --> index_start = 5, index_end = 10
+    # a result cursor only sorts the documents up to the page read, the sort is timed apart from the url lookups
     def get_range_urls_from_docmanager(self, ranked_docs, index_start, index_end):
-        urls = []
-        scores = []
-        for i in range(index_start, index_end):
-            url = self.get_url_from_docmanager(ranked_docs[i][0])
-            urls.append(url)
-            scores.append(ranked_docs[i][1])
-        return urls, scores
+        instrumentation = self._instrumentation
+        with instrumentation.timer('search.sort'):
+            page = ranked_docs[index_start:index_end]
+
+        with instrumentation.timer('search.urls'):
+            # resolve the whole range at once from the document store
+            if self._has_doc_store:
+                return self._doc_store.get_urls([doc_id for doc_id, _ in page]), [score for _, score in page]
+
+            urls = []
+            scores = []
+            for doc_id, score in page:
+                url = self.get_url_from_docmanager(doc_id)
+                urls.append(url)
+                scores.append(score)
+            return urls, scores
 
     # search document manager for a single result
     def get_url_from_docmanager(self, doc_id):
-        # use islice to directly seek the desired line to efficiently search DocumentManager.txt
+        # the document store locates the url directly from the doc_id
+        if self._has_doc_store:
+            return self._doc_store.get_url(doc_id)
+
+        # read the doc_id's line straight from its offset in DocumentManager.txt
         # a doc_id is always 1 less than the file line. e.g. line 432 contains doc_id 431
-        self._doc_manager_handle.seek(0)
-        line = next(islice(self._doc_manager_handle, doc_id, doc_id + 1), None)
+        if not 0 <= doc_id < len(self._doc_manager_offsets) - 1:
+            return None
+        start, end = self._doc_manager_offsets[doc_id], self._doc_manager_offsets[doc_id + 1]
+        line = self._index_files.read(self._doc_manager_path, start, end - start).decode('utf-8')
         if line:
             # extract the url from the line
             parts = line.split("\t")
@@ -172,8 +664,47 @@ class SearchEngine:
             return url
         return None
 
-    # given a query, return the top results based on tf-idf and importance
-    def search_query(self, query):
+    # return the largest score a token can add to a document
+    # without score bounds it is derived from the max tf of each field stored in the lexicon,
+    # tokens without recorded max tfs (e.g. indexes built before they existed) are unbounded
+    def _get_upper_bound(self, token):
+        if self._has_score_bounds:
+            return self._score_bounds.get_bound(token)
+        if not self._has_lexicon:
+            return math.inf
+
+        if self._index_format == 'fielded':
+            entry = self._lexicon.get_entry(FIELDED, token)
+            if entry is None:
+                return 0.0
+            idf, max_tfs = entry[4], entry[5]
+            if len(max_tfs) != len(FIELDS):
+                return math.inf
+        else:
+            max_tfs = []
+            idf = None
+            for field in FIELDS:
+                entry = self._lexicon.get_entry(field, token)
+                if entry is None:
+                    max_tfs.append(0.0)
+                    continue
+                if not entry[5]:
+                    return math.inf
+                if idf is None:
+                    idf = entry[4]
+                max_tfs.append(entry[5][0])
+            # importance postings are weighted with the frequency idf, or the idf of the first tag
+            if idf is None:
+                return 0.0
+
+        upper_bound = calculate_tfidf_weight(max_tfs[0], idf)
+        for (_, weight), max_tf in zip(self._importance_weights, max_tfs[1:]):
+            if weight > 0 and max_tf > 0:
+                upper_bound += max(calculate_tfidf_weight(max_tf, idf, weight=weight, log=True), 0.0)
+        return upper_bound
+
+    # tokenize, remove stop words and normalize a query, returns the distinct tokens in query order
+    def _parse_query(self, query):
         # get query
         token_pattern = r'\b[a-zA-Z-0-9]+\b'
         query_tokens = re.findall(token_pattern, query)
@@ -183,40 +714,568 @@ class SearchEngine:
             query_tokens = [token for token in query_tokens if token not in STOP_WORDS]
 
         # normalize query tokens
-        query_tokens = [self.stemmer.stem(token.lower()) for token in query_tokens]
+        query_tokens = [self._normalizer.normalize(token) for token in query_tokens]
+
+        # only process tokens once (avoid duplicates from the query)
+        return list(dict.fromkeys(query_tokens))
+
+    # tokenize and normalize a phrase like the indexer tokenizes documents, returns every token in phrase order
+    # stop words and repeated tokens are kept, they are part of the phrase
+    def _parse_phrase(self, query):
+        return [self._normalizer.normalize(token) for token in re.findall(r'\b[a-zA-Z0-9]+\b', query)]
+
+    # given a query, return the results ranked by tf-idf and importance as a cursor that sorts them as they are read
+    # with top_k the cursor only holds the top_k best documents, found with max score pruning, so its length and
+    # has_more stop at top_k
+    # mode is 'or' to rank every document containing any query token, 'and' for documents containing all of them,
+    # or 'phrase' for documents containing the query as a phrase, each word at most slop positions further than
+    # right after the one before it
+    # with instrumentation, parsing the query and ranking its documents are timed as search.parse and search.rank,
+    # the postings read while ranking as search.postings.<field>, once per field of every token read
+    def search_query(self, query, top_k=None, mode='or', slop=0):
+        instrumentation = self._instrumentation
+        instrumentation.start_trace('search_query', query=query, top_k=top_k, mode=mode, slop=slop)
+        self._local.bytes_read = 0
+        with instrumentation.timer('search.parse'):
+            query_tokens = self._parse_phrase(query) if mode == 'phrase' else self._parse_query(query)
+
+        # queries normalizing to the same tokens have the same results
+        # the token order is kept, it decides the order documents with equal scores are ranked in
+        cache_key = (tuple(query_tokens), top_k, mode, slop)
+        results = self._query_cache.get(cache_key)
+        if results is None:
+            instrumentation.increment('search.query_cache_misses')
+            with instrumentation.timer('search.rank'):
+                results = self._search_tokens(query_tokens, top_k, mode, slop)
+                # the top k come ranked, the cursor keeps their order as their scores are sorted stably
+                if top_k is not None:
+                    results = ResultCursor(dict(results))
+            self._query_cache.put(cache_key, results, len(results))
+        else:
+            instrumentation.increment('search.query_cache_hits')
+
+        if instrumentation.enabled:
+            instrumentation.increment('search.queries')
+            instrumentation.increment('search.postings_bytes', self._local.bytes_read)
+            instrumentation.end_trace(tokens=query_tokens, results=len(results))
+        return results
+
+    # rank the documents of distinct normalized query tokens, or of the tokens of a phrase in phrase mode
+    def _search_tokens(self, query_tokens, top_k, mode='or', slop=0):
+        # the documents containing every token of a phrase are only kept if their positions match the phrase
+        doc_filter = None
+        if mode == 'phrase':
+            phrase_tokens = query_tokens
+            query_tokens = list(dict.fromkeys(phrase_tokens))
+            if len(phrase_tokens) > 1:
+                doc_filter = lambda doc_ids: self._match_phrase(phrase_tokens, doc_ids, slop)
+
+        # a single token matches the same documents in every mode
+        conjunctive = mode == 'and' and len(query_tokens) > 1 or doc_filter is not None
+
+        # impacts are already scores, they are added up score at a time
+        if self._index_format == 'impact':
+            return self._search_impacts(query_tokens, top_k, conjunctive, doc_filter)
+
+        # only the documents containing every token are scored
+        if conjunctive:
+            return self._search_conjunctive(query_tokens, top_k, doc_filter)
+
+        # score every document at once, the top k are selected with argpartition
+        if self._scorer == 'numpy':
+            results = self._numpy_scorer.score([self._load_term_arrays(token) for token in query_tokens])
+            return results if top_k is None else results[:max(top_k, 0)]
+
+        # a single token has nothing to prune, its documents are all scored and only the best kept
+        # contributions that cannot be cached are computed for each query, at the cost of scoring every document
+        if top_k is not None and len(query_tokens) > 1 and self._has_contributions_cache:
+            return self._search_top_k(query_tokens, top_k)
 
         # create a score for each relevant document {doc_id:relevance_score}
         scores = defaultdict(float)
 
-        # account for multiple occurrences of the same token
-        seen_tokens = set()
         # score each token in the query
         for token in query_tokens:
-            # only process tokens once (avoid duplicates from the query)
-            if token not in seen_tokens:
-                # load the token's frequency postings and idf
-                freq_postings, freq_idf = self._load_postings_for_token(token, postings_type='frequency')
-
-                # store the frequency score (tf-idf) for each relevant document
-                for doc_id, tf in freq_postings.items():
-                    scores[doc_id] += calculate_tfidf_weight(tf, freq_idf)
-
-                # keep track of each tag's postings and idfs [h1,h2,h3,i,em,b,title,strong]
-                importance_postings = []
-                importance_idfs = []
-                # load the token's importance postings and idf for each tag
-                for tag, index in self._important_handles_index.items():
-                    postings, idf = self._load_postings_for_token(token, postings_type='importance', tag_index=index)
-                    importance_postings.append(postings)
-                    importance_idfs.append(freq_idf)
-
-                # store the importance score (weighted tf-idf) for each relevant document
-                for i, postings in enumerate(importance_postings):
-                    for doc_id, tf in postings.items():
-                        weight = self._importance_weights[i][1]
-                        scores[doc_id] += calculate_tfidf_weight(tf, importance_idfs[i], weight=weight, log=True)
-            seen_tokens.add(token)
-        # sort the docs by their relevance scores {doc_id:relevance_score}
-        ranked_docs = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-
-        return ranked_docs
+            # load the token's frequency postings and idf, and the postings of each tag
+            freq_postings, freq_idf, importance_postings = self._load_term_postings(token)
+
+            # store the frequency score (tf-idf) for each relevant document
+            for doc_id, tf in freq_postings.items():
+                scores[doc_id] += calculate_tfidf_weight(tf, freq_idf)
+
+            # store the importance score (weighted tf-idf) for each relevant document
+            # importance postings are weighted with the frequency idf
+            for i, postings in enumerate(importance_postings):
+                for doc_id, tf in postings.items():
+                    weight = self._importance_weights[i][1]
+                    scores[doc_id] += calculate_tfidf_weight(tf, freq_idf, weight=weight, log=True)
+
+        # the top k of the stable sort below, without sorting every document
+        if top_k is not None:
+            return heapq.nlargest(top_k, scores.items(), key=itemgetter(1)) if top_k > 0 else []
+
+        # the docs are sorted by their relevance scores {doc_id:relevance_score} as the pages are read
+        return ResultCursor(scores)
+
+    # rank the documents containing every query token
+    # their scores are the scores of the exhaustive search, added up in the same order, and documents with equal
+    # scores are ranked by doc_id, the order the exhaustive search first sees them in the first token's postings
+    # doc_filter, given the sorted doc_ids found in every token, returns the ones to rank
+    def _search_conjunctive(self, query_tokens, top_k, doc_filter=None):
+        if top_k is not None and top_k <= 0:
+            return []
+
+        # {doc_id : score} of the documents found in every token, in doc_id order
+        doc_ids, term_postings = self._intersect_tokens(query_tokens)
+        doc_ids = list(doc_ids)
+        if doc_filter is not None:
+            doc_ids = doc_filter(doc_ids)
+        scores = dict.fromkeys(doc_ids, 0.0)
+
+        # only the postings of the surviving documents are scored, the postings the intersection loaded are reused
+        for token in query_tokens:
+            # tokens left after the intersection found no document were never loaded
+            if not scores:
+                break
+            freq_postings, freq_idf, importance_postings = term_postings[token]
+            freq_postings = self._filter_postings(freq_postings, scores)
+            if importance_postings is None:
+                importance_postings = [self._lookup_postings(token, i + 1, scores)[0]
+                                       for i in range(len(self._importance_weights))]
+            else:
+                importance_postings = [self._filter_postings(postings, scores) for postings in importance_postings]
+            for field_index, postings, idf, weight in self._get_term_fields(freq_postings, freq_idf,
+                                                                            importance_postings):
+                for doc_id, tf in postings.items():
+                    if weight is None:
+                        scores[doc_id] += calculate_tfidf_weight(tf, idf)
+                    else:
+                        scores[doc_id] += calculate_tfidf_weight(tf, idf, weight=weight, log=True)
+
+        if top_k is not None:
+            return heapq.nlargest(top_k, scores.items(), key=itemgetter(1))
+        return ResultCursor(scores)
+
+    # return the documents containing every query token, in doc_id order, as the postings {doc_id : tf} of the
+    # token intersected last, and the postings loaded for each token {token : (freq_postings, idf, importance_postings)}
+    # so scoring does not load them again, tokens after the documents ran out are left out
+    # a document contains a token if it has a frequency posting for it, the text of the importance tags is
+    # also part of the text counted in the frequency index
+    # the shortest postings are decoded first and every other token, shortest first, only looks up the
+    # documents still left, so the cost follows the shortest postings rather than the longest
+    # the fielded index decodes every field of a token at once, so its importance postings are kept too, the other
+    # formats leave them None and only look up the importance postings of the documents left
+    def _intersect_tokens(self, query_tokens):
+        term_postings = {}
+        doc_ids = None
+        for token in sorted(query_tokens, key=self._get_doc_frequency):
+            if doc_ids is not None and not doc_ids:
+                break
+            if self._index_format == 'fielded':
+                freq_postings, idf, importance_postings = self._load_term_postings(token)
+                if doc_ids is not None:
+                    freq_postings = self._filter_postings(freq_postings, doc_ids)
+            else:
+                freq_postings, idf = self._lookup_postings(token, 0, doc_ids)
+                importance_postings = None
+            term_postings[token] = (freq_postings, idf, importance_postings)
+            doc_ids = freq_postings
+        return doc_ids, term_postings
+
+    # return the number of documents a token has frequency postings in, estimated by the records of the fielded index
+    def _get_doc_frequency(self, token):
+        if self._has_lexicon:
+            entry = self._lexicon.get_entry(FIELDED if self._index_format == 'fielded' else 'frequency', token)
+            return entry[3] if entry is not None else 0
+        return len(self._load_postings_for_token(token, postings_type='frequency')[0])
+
+    # retrieve a field's postings of a token and its idf, field 0 is the frequency field and 1 to 8 the tags
+    # with doc_ids, a dict of documents in doc_id order, only the postings of these documents are returned
+    def _lookup_postings(self, token, field_index, doc_ids=None):
+        field = FIELDS[field_index]
+        if self._index_format == 'binary' and doc_ids is not None:
+            entry = self._lexicon.get_entry(field, token)
+            if entry is None or field not in self._binary_postings:
+                return {}, None
+
+            # when most blocks hold one of the documents, decoding the whole postings once is cheaper
+            skips_entry = self._lexicon.get_entry(get_skips_field(field), token)
+            if skips_entry is not None and len(doc_ids) * 2 < entry[3]:
+                return self._lookup_skipped_postings(field, token, entry, skips_entry, doc_ids), entry[4]
+
+        if self._index_format == 'fielded':
+            freq_postings, idf, importance_postings = self._load_term_postings(token)
+            postings = importance_postings[field_index - 1] if field_index else freq_postings
+        elif field_index:
+            postings, idf = self._load_postings_for_token(token, postings_type='importance', tag_index=field_index - 1)
+        else:
+            postings, idf = self._load_postings_for_token(token, postings_type='frequency')
+
+        if doc_ids is None:
+            return postings, idf
+        return self._filter_postings(postings, doc_ids), idf
+
+    # return the postings {doc_id : tf} of the documents of doc_ids, going through the shorter of the two
+    # decoded postings are in doc_id order so the result is in doc_id order either way
+    @staticmethod
+    def _filter_postings(postings, doc_ids):
+        if len(postings) < len(doc_ids):
+            return {doc_id: tf for doc_id, tf in postings.items() if doc_id in doc_ids}
+        return {doc_id: postings[doc_id] for doc_id in doc_ids if doc_id in postings}
+
+    # look up the postings of the sorted doc_ids in the binary index with the token's skip table
+    # postings already decoded in the cache are looked up directly
+    def _lookup_skipped_postings(self, field, token, entry, skips_entry, doc_ids):
+        cached = self._postings_cache.get(field, token)
+        if cached is not None:
+            return self._filter_postings(cached[0], doc_ids)
+
+        skips_field = get_skips_field(field)
+        skips = self._postings_cache.get(skips_field, token)
+        if skips is None:
+            _, skips_offset, skips_length, num_skips, _, _ = skips_entry
+            skips = decode_skips(self._binary_postings[skips_field], skips_offset, skips_length)
+            self._count_bytes_read(skips_length)
+            self._postings_cache.put(skips_field, token, skips, num_skips, skips_length)
+        _, offset, length, _, _, _ = entry
+        with self._instrumentation.timer(f'search.postings.{field}'):
+            postings, bytes_read = lookup_postings(self._binary_postings[field], offset, length, skips, doc_ids)
+        self._count_bytes_read(bytes_read)
+        return postings
+
+    # return the sorted doc_ids whose positions match the phrase, out of the sorted doc_ids containing every token
+    # the phrase is matched token by token, and the positions of the next token are only decoded for the
+    # documents that still match, so a phrase failing on its first tokens skips the positions of the others
+    # without a position index every document is kept, so phrases match like conjunctive queries
+    def _match_phrase(self, phrase_tokens, doc_ids, slop):
+        if not self._has_positions:
+            return doc_ids
+
+        # {doc_id : positions the phrase matched up to the current token}
+        reachable = self._lookup_positions(phrase_tokens[0], doc_ids)
+        token_positions = {phrase_tokens[0]: reachable}
+        for token in phrase_tokens[1:]:
+            # a repeated token reuses the positions already decoded, the documents left are always among them
+            positions = token_positions.get(token)
+            if positions is None:
+                positions = token_positions[token] = self._lookup_positions(token, reachable)
+
+            next_reachable = {}
+            for doc_id, doc_positions in reachable.items():
+                matched = extend_phrase(doc_positions, positions.get(doc_id, ()), slop)
+                if matched:
+                    next_reachable[doc_id] = matched
+            reachable = next_reachable
+        return list(reachable)
+
+    # return {doc_id : [positions]} of a token for the sorted doc_ids, from the position index
+    def _lookup_positions(self, token, doc_ids):
+        entry = self._position_lexicon.get_entry(POSITIONS, token)
+        if entry is None or POSITIONS not in self._binary_postings:
+            return {}
+
+        # tokens in few documents have no skip table, their postings are read from the start
+        skips_field = get_skips_field(POSITIONS)
+        skips = self._postings_cache.get(skips_field, token)
+        if skips is None:
+            skips_entry = self._position_lexicon.get_entry(skips_field, token)
+            if skips_entry is None:
+                skips = ([], [])
+                self._postings_cache.put(skips_field, token, skips, 0, 0)
+            else:
+                _, skips_offset, skips_length, num_skips, _, _ = skips_entry
+                skips = decode_skips(self._binary_postings[skips_field], skips_offset, skips_length)
+                self._count_bytes_read(skips_length)
+                self._postings_cache.put(skips_field, token, skips, num_skips, skips_length)
+
+        _, offset, length, _, _, _ = entry
+        with self._instrumentation.timer('search.postings.positions'):
+            positions, bytes_read = lookup_positions(self._binary_postings[POSITIONS], offset, length, skips,
+                                                     doc_ids)
+        self._count_bytes_read(bytes_read)
+        return positions
+
+    # return the fields of a token that have postings [(field_index, postings, idf, weight)]
+    # field 0 holds the frequency postings and has no weight, fields 1 to 8 are the importance tags
+    def _get_term_fields(self, freq_postings, freq_idf, importance_postings):
+        fields = []
+        if freq_postings:
+            fields.append((0, freq_postings, freq_idf, None))
+        for i, postings in enumerate(importance_postings):
+            if postings:
+                fields.append((i + 1, postings, freq_idf, self._importance_weights[i][1]))
+        return fields
+
+    # return a token's contributions to the score of the documents it is found in, as
+    # (doc_ids, contributions, scores, fields), contributions[i] is what the token adds to the score of doc_ids[i],
+    # its fields added up in field order like its score bound, scores {doc_id : contribution} looks them up and
+    # fields are the token's [(field_index, postings, idf, weight)] the exact scores of the top documents are
+    # added up from
+    # computed once from the token's postings then cached, so top k searches visit each document with one lookup
+    def _load_term_contributions(self, token):
+        cached = self._postings_cache.get(CONTRIBUTIONS, token)
+        if cached is not None:
+            return cached
+
+        scores = {}
+        fields = self._get_term_fields(*self._load_term_postings(token))
+        for field_index, postings, idf, weight in fields:
+            # the frequency field comes first, its documents have no other field yet
+            if weight is None:
+                scores = {doc_id: calculate_tfidf_weight(tf, idf) for doc_id, tf in postings.items()}
+                continue
+            for doc_id, tf in postings.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + calculate_tfidf_weight(tf, idf, weight=weight, log=True)
+
+        # documents only found in importance fields were added after the others
+        scores = dict(sorted(scores.items()))
+        cached = (list(scores), list(scores.values()), scores, fields)
+        num_postings = 3 * len(scores) + sum(len(postings) for _, postings, _, _ in fields)
+        self._postings_cache.put(CONTRIBUTIONS, token, cached, num_postings, 0)
+        return cached
+
+    # return the top_k documents of the exhaustive search without scoring every document (block max score)
+    # query tokens are sorted by their score upper bound, the tokens whose bounds add up to less than the
+    # current k-th best score are non-essential: a document only found in them cannot enter the top k,
+    # so only documents of the essential tokens are visited and only looked up in the non-essential tokens
+    # documents are visited a block of doc_ids at a time, bounded by the largest contribution of each token in the
+    # block: a block that cannot reach the k-th best score is skipped, otherwise a document is only visited if its
+    # contribution to one of the essential tokens, with the block bounds of the other tokens, can reach it
+    def _search_top_k(self, query_tokens, top_k):
+        if top_k <= 0:
+            return []
+
+        # (doc_ids, contributions, scores, fields) of each token
+        terms = [self._load_term_contributions(token) for token in query_tokens]
+        # short postings are added up faster than they are skipped
+        if sum(len(doc_ids) for doc_ids, _, _, _ in terms) <= TOP_K_SHORT_POSTINGS * len(terms):
+            return self._rank_contributions(terms, top_k)
+
+        # tokens by increasing upper bound and the sum of the bounds up to each of them
+        upper_bounds = [self._get_upper_bound(token) for token in query_tokens]
+        order = sorted(range(len(terms)), key=upper_bounds.__getitem__)
+        bound_sums = list(accumulate(upper_bounds[term] for term in order))
+
+        first_essential = 0             # order[first_essential:] are the essential tokens
+        positions = [0] * len(terms)    # position of the next block in each token
+        # the first blocks are small and filled with top_k documents, so the k-th best score rises before most
+        # postings are read, then they double up to TOP_K_BLOCK
+        block_size = top_k
+        # score a document must reach to enter the top k, the k-th best score less a tolerance so rounding in the
+        # bounds never drops a top document
+        minimum_score = -math.inf
+        top_docs = []                   # min heap of the entries of the k best documents
+
+        while first_essential < len(order):
+            essential = order[first_essential:]
+            # the non-essential tokens with the largest bounds are looked up first, to drop a document sooner
+            non_essential = order[first_essential - 1::-1] if first_essential else []
+
+            # the block ends at the first doc_id one of the essential tokens cannot read past in block_size postings
+            block_ends = [terms[term][0][min(positions[term] + block_size, len(terms[term][0])) - 1]
+                          for term in essential if positions[term] < len(terms[term][0])]
+            if not block_ends:
+                break
+            last_doc_id = min(block_ends)
+            block_size = min(2 * block_size, TOP_K_BLOCK)
+
+            # the postings of each token in the block and their largest contribution
+            blocks = []
+            block_bounds = []
+            for term, (doc_ids, contributions, _, _) in enumerate(terms):
+                start = positions[term]
+                end = positions[term] = bisect.bisect_right(doc_ids, last_doc_id, start)
+                blocks.append((start, end))
+                block_bounds.append(max(contributions[start:end], default=0.0))
+            block_bound = sum(block_bounds)
+            if block_bound < minimum_score:
+                continue
+
+            # the documents of the block whose contribution to an essential token can still reach the top k
+            candidates = set()
+            for term in essential:
+                doc_ids, contributions, _, _ = terms[term]
+                start, end = blocks[term]
+                cutoff = minimum_score - (block_bound - block_bounds[term])
+                candidates.update(compress(doc_ids[start:end], map(cutoff.__le__, contributions[start:end])))
+
+            essential_scores = [terms[term][2] for term in essential]
+            non_essential_bound = sum(block_bounds[term] for term in non_essential)
+            for doc_id in candidates:
+                # skip the document if its essential contributions and the non-essential bounds cannot reach the top k
+                bound = non_essential_bound
+                for scores in essential_scores:
+                    bound += scores.get(doc_id, 0.0)
+                if bound < minimum_score:
+                    continue
+
+                # replace each non-essential bound with the contribution, while the document can reach the top k
+                for term in non_essential:
+                    bound += terms[term][2].get(doc_id, 0.0) - block_bounds[term]
+                    if bound < minimum_score:
+                        break
+                else:
+                    entry = self._get_top_k_entry(terms, doc_id)
+                    if len(top_docs) < top_k:
+                        heapq.heappush(top_docs, entry)
+                    elif entry > top_docs[0]:
+                        heapq.heapreplace(top_docs, entry)
+                    else:
+                        continue
+                    if len(top_docs) == top_k:
+                        minimum_score = top_docs[0][0] - 1e-9 * max(1.0, abs(top_docs[0][0]))
+
+            while first_essential < len(order) and bound_sums[first_essential] < minimum_score:
+                first_essential += 1
+
+        # best first, the same order as the exhaustive search
+        top_docs.sort(reverse=True)
+        return [(doc_id, score) for score, _, _, _, doc_id in top_docs]
+
+    # return the top_k documents of the exhaustive search by adding up every contribution of the tokens
+    # contributions are added up in another order than the exhaustive search adds the fields, so every document
+    # within rounding of the k-th best total is scored exactly
+    def _rank_contributions(self, terms, top_k):
+        totals = dict(terms[0][2])
+        for _, _, scores, _ in terms[1:]:
+            for doc_id, contribution in scores.items():
+                totals[doc_id] = totals.get(doc_id, 0.0) + contribution
+        if not totals:
+            return []
+
+        minimum_total = min(heapq.nlargest(top_k, totals.values()))
+        minimum_total -= 1e-9 * max(1.0, abs(minimum_total))
+        top_docs = heapq.nlargest(top_k, (self._get_top_k_entry(terms, doc_id)
+                                          for doc_id, total in totals.items() if total >= minimum_total))
+        return [(doc_id, score) for score, _, _, _, doc_id in top_docs]
+
+    # return the top k heap entry (score, -first token, -first field, -doc_id, doc_id) of a document
+    # the score is added up in the same order and with the same arithmetic as the exhaustive search, which breaks
+    # score ties by the first (token, field, doc_id) a document was seen in
+    def _get_top_k_entry(self, terms, doc_id):
+        score = 0.0
+        first_seen = None
+        for term, (_, _, _, fields) in enumerate(terms):
+            for field_index, postings, idf, weight in fields:
+                tf = postings.get(doc_id)
+                if tf is None:
+                    continue
+                if weight is None:
+                    score += calculate_tfidf_weight(tf, idf)
+                else:
+                    score += calculate_tfidf_weight(tf, idf, weight=weight, log=True)
+                if first_seen is None:
+                    first_seen = (term, field_index)
+        return (score, -first_seen[0], -first_seen[1], -doc_id, doc_id)
+
+    # rank documents by adding up their precomputed impacts, score at a time
+    # the segments of all tokens are visited from the highest impact down, so the largest contributions come first
+    # with top_k the search stops as soon as the impacts left cannot change which documents are the top_k nor
+    # their order, the scores returned then lack the impacts that were not read
+    # documents with equal scores are ranked in the order they were first seen
+    # conjunctive only ranks the documents found in every token, impact ordered postings cannot be intersected
+    # in doc_id order so every segment is read before the other documents are dropped
+    # doc_filter, given the sorted doc_ids found in every token, returns the ones to rank
+    def _search_impacts(self, query_tokens, top_k, conjunctive=False, doc_filter=None):
+        buffer = self._binary_postings.get(IMPACT)
+        if top_k is not None and top_k <= 0:
+            return []
+
+        # (-impact, token, impact, doc_ids, bytes) of the next segment of each token
+        segments = []
+        next_segments = []
+        remaining = [0] * len(query_tokens)     # impact of the next segment of each token, 0 once all are read
+        for term, token in enumerate(query_tokens):
+            entry = self._lexicon.get_entry(IMPACT, token)
+            if entry is None or buffer is None:
+                next_segments.append(iter(()))
+                continue
+            _, offset, length, _, _, _ = entry
+            next_segments.append(read_impact_segments(buffer, offset, length))
+            segment = next(next_segments[term], None)
+            if segment is not None:
+                heapq.heappush(segments, (-segment[0], term) + segment)
+                remaining[term] = segment[0]
+                self._count_bytes_read(segment[2])
+
+        # {doc_id : sum of impacts << number of tokens | bit of each token the document was found in}
+        # a document is found once per token so the bits never carry into the impacts, keeping both in one value
+        # makes adding a posting a single dict update, documents are kept in the order they were first seen
+        shift = len(query_tokens)
+        scores = {}
+        top_docs = None
+        postings_added = 0
+        next_check = top_k or 0         # number of postings added before checking if the top k is settled
+        while segments:
+            _, term, impact, doc_ids, _ = heapq.heappop(segments)
+            increment = impact << shift | 1 << term
+            for doc_id in doc_ids:
+                scores[doc_id] = scores.get(doc_id, 0) + increment
+            postings_added += len(doc_ids)
+
+            segment = next(next_segments[term], None)
+            remaining[term] = 0
+            if segment is not None:
+                heapq.heappush(segments, (-segment[0], term) + segment)
+                remaining[term] = segment[0]
+                self._count_bytes_read(segment[2])
+
+            # checking costs a pass over the documents, so checks are spaced by half the documents seen
+            if top_k is not None and not conjunctive and postings_added >= next_check and len(scores) >= top_k:
+                next_check = postings_added + len(scores) // 2
+                top_docs = self._get_settled_ranking(scores, top_k, remaining)
+                if top_docs is not None:
+                    break
+
+        if conjunctive:
+            token_bits = (1 << shift) - 1
+            scores = {doc_id: value for doc_id, value in scores.items() if value & token_bits == token_bits}
+            if doc_filter is not None:
+                kept = set(doc_filter(sorted(scores)))
+                scores = {doc_id: value for doc_id, value in scores.items() if doc_id in kept}
+
+        if top_k is None:
+            return ResultCursor({doc_id: (value >> shift) / self._impact_scale for doc_id, value in scores.items()})
+        if top_docs is None:
+            top_docs = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1] >> shift)
+        return [(doc_id, (value >> shift) / self._impact_scale) for doc_id, value in top_docs]
+
+    # return the top_k (doc_id, value) of the scores if the impacts left cannot change them nor their order,
+    # None otherwise
+    # a document can still gain the next impact of every token it was not found in yet, remaining holds them
+    @staticmethod
+    def _get_settled_ranking(scores, top_k, remaining):
+        shift = len(remaining)
+        token_bits = (1 << shift) - 1
+        gains = {}                      # {token bits : impacts a document found in these tokens can still gain}
+
+        def get_gain(bits):
+            gain = gains.get(bits)
+            if gain is None:
+                gain = gains[bits] = sum(impact for term, impact in enumerate(remaining) if not bits >> term & 1)
+            return gain
+
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1] >> shift)
+        kth_impact = best[-1][1] >> shift
+
+        # a document not seen yet scores at most the remaining impacts and ranks after the ones seen before it
+        max_gain = sum(remaining)
+        if kth_impact < max_gain:
+            return None
+
+        # each document stays ahead of the next one even if only the next one gains
+        for (_, value), (_, next_value) in zip(best, best[1:]):
+            gain = get_gain(next_value & token_bits)
+            if gain and value >> shift <= (next_value >> shift) + gain:
+                return None
+
+        # no other document can reach the k-th score, documents that can gain nothing are already behind it
+        top_doc_ids = {doc_id for doc_id, _ in best}
+        lowest_reaching = (kth_impact - max_gain) << shift
+        for doc_id, value in scores.items():
+            if value < lowest_reaching:
+                continue
+            gain = get_gain(value & token_bits)
+            if gain and (value >> shift) + gain >= kth_impact and doc_id not in top_doc_ids:
+                return None
+        return best
@@ -0,0 +1,310 @@
+import asyncio
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+from searchEngine import SearchEngine
+from Instrumentation import Instrumentation, LogSink, HistogramSink, JsonLinesSink
+
+# reason phrase sent with each status code
+STATUS_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                  413: 'Payload Too Large', 503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+# largest request body accepted, a batch request holds a list of queries
+MAX_BODY_BYTES = 1024 * 1024
+
+# query modes accepted by the search engine
+MODES = ('or', 'and', 'phrase')
+
+
+# serves search results as JSON over HTTP, with a single search engine loaded once for every client
+# connections are handled by an asyncio event loop, searches run in a pool of worker threads so the index reads
+# never block the loop
+# at most max_pending searches or batches are accepted at once, the ones over it are turned away with a 503
+# straight away rather than queued behind the others, and each one must answer within deadline seconds
+class SearchServer:
+    # histogram, if given, is the sink timing the search engine's stages, reported by /stats
+    def __init__(self, search_engine, workers=4, max_pending=64, deadline=2.0, page_size=10, max_batch=50,
+                 histogram=None):
+        self._search_engine = search_engine
+        self._histogram = histogram
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='search')
+        self._pending = asyncio.Semaphore(max_pending)  # searches and batches accepted and not answered yet
+        self._deadline = deadline               # seconds a request has to be answered before a 504
+        self._page_size = page_size             # results per page
+        self._max_batch = max_batch             # queries accepted in a single batch request
+        self._stats = {'requests': 0, 'rejected': 0, 'timeouts': 0, 'bad_requests': 0}
+
+    # accept connections until the server is stopped
+    async def serve(self, host='127.0.0.1', port=8080):
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        print(f"Serving search results on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    # release the worker threads
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # answer the requests of a connection one after another, connections are kept alive unless the client closes them
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except ValueError as error:
+                    self._stats['bad_requests'] += 1
+                    status = 413 if 'too large' in str(error) else 400
+                    writer.write(_format_response(status, {'error': str(error)}, keep_alive=False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+
+                method, target, keep_alive, body = request
+                started = time.perf_counter()
+                status, payload = await self._dispatch(method, target, body)
+                if 'timings' in payload:
+                    payload['timings']['total_ms'] = (time.perf_counter() - started) * 1000
+                writer.write(_format_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    # route a request, returns (status, payload)
+    async def _dispatch(self, method, target, body):
+        self._stats['requests'] += 1
+        url = urlsplit(target)
+        routes = {'/search': ('GET', self._handle_search), '/batch': ('POST', self._handle_batch),
+                  '/stats': ('GET', self._handle_stats)}
+        if url.path not in routes:
+            return 404, {'error': f'unknown path {url.path}'}
+        allowed_method, handler = routes[url.path]
+        if method != allowed_method:
+            return 405, {'error': f'{url.path} only accepts {allowed_method}'}
+
+        try:
+            return await handler(parse_qs(url.query), body)
+        except ValueError as error:
+            self._stats['bad_requests'] += 1
+            return 400, {'error': str(error)}
+
+    # GET /search?q=&page=&mode=&slop=, one page of results of a query
+    async def _handle_search(self, params, body):
+        search = self._parse_search(params.get('q', [None])[0], params.get('page', [1])[0],
+                                    params.get('mode', ['or'])[0], params.get('slop', [0])[0])
+        if self._pending.locked():
+            self._stats['rejected'] += 1
+            return 503, {'error': 'too many pending requests, retry later'}
+
+        async with self._pending:
+            deadline_at = time.perf_counter() + self._deadline
+            try:
+                response = await asyncio.wait_for(self._submit_search(search, deadline_at), self._deadline)
+            except asyncio.TimeoutError:
+                response = None
+        if response is None:
+            self._stats['timeouts'] += 1
+            return 504, {'error': f'deadline of {self._deadline}s exceeded'}
+        return 200, response
+
+    # POST /batch with a JSON body {"queries": ["query", {"q": "query", "page": 2, "mode": "and", "slop": 0}]}
+    # the queries run concurrently within one deadline, the ones still running when it passes answer with an error
+    async def _handle_batch(self, params, body):
+        try:
+            queries = json.loads(body or b'{}').get('queries')
+        except (json.JSONDecodeError, AttributeError):
+            raise ValueError("the body must be a JSON object with a list of queries")
+        if not isinstance(queries, list):
+            raise ValueError("the body must be a JSON object with a list of queries")
+        if len(queries) > self._max_batch:
+            raise ValueError(f"a batch holds at most {self._max_batch} queries")
+
+        searches = []
+        for query in queries:
+            if isinstance(query, str):
+                query = {'q': query}
+            if not isinstance(query, dict):
+                raise ValueError("each query is a string or an object with q, page, mode and slop")
+            searches.append(self._parse_search(query.get('q'), query.get('page', 1), query.get('mode', 'or'),
+                                               query.get('slop', 0)))
+        if self._pending.locked():
+            self._stats['rejected'] += 1
+            return 503, {'error': 'too many pending requests, retry later'}
+
+        async with self._pending:
+            started = time.perf_counter()
+            deadline_at = started + self._deadline
+            tasks = [asyncio.ensure_future(self._submit_search(search, deadline_at)) for search in searches]
+            done, not_done = await asyncio.wait(tasks, timeout=self._deadline) if tasks else (set(), set())
+            for task in not_done:
+                task.cancel()
+
+        responses = []
+        for task in tasks:
+            if task in done and task.result() is not None:
+                responses.append(task.result())
+            else:
+                self._stats['timeouts'] += 1
+                responses.append({'error': f'deadline of {self._deadline}s exceeded'})
+        return 200, {'responses': responses, 'timings': {'batch_ms': (time.perf_counter() - started) * 1000}}
+
+    # GET /stats, the server counters, the search engine caches and open index files, the generation of the indexes
+    # from their manifest, and the search stages if they are timed
+    async def _handle_stats(self, params, body):
+        manifest = self._search_engine.get_manifest()
+        stats = {'server': dict(self._stats), 'query_cache': self._search_engine.get_cache_stats(),
+                 'postings_cache': self._search_engine.get_postings_cache_stats(),
+                 'open_files': self._search_engine.get_open_file_stats(),
+                 'index_generation': manifest.get_generation() if manifest is not None else None}
+        if self._histogram is not None:
+            stats['stages'] = self._histogram.get_stats()
+        return 200, stats
+
+    # validate the parameters of a search, returns (query, page, mode, slop)
+    @staticmethod
+    def _parse_search(query, page, mode, slop):
+        if not isinstance(query, str) or not query.strip():
+            raise ValueError("q is required")
+        try:
+            page = int(page)
+            slop = int(slop)
+        except (TypeError, ValueError):
+            raise ValueError("page and slop must be integers")
+        if page < 1 or slop < 0:
+            raise ValueError("page starts at 1 and slop cannot be negative")
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        return query, page, mode, slop
+
+    # run a search in the worker pool, returns None if its deadline passed before it started
+    async def _submit_search(self, search, deadline_at):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run_search, search, time.perf_counter(), deadline_at)
+
+    # search a query and resolve the urls of the requested page, runs in a worker thread
+    # the search engine runs searches from every worker thread at once
+    # a search whose deadline passed while it waited for a worker is skipped, its request was already answered
+    def _run_search(self, search, submitted, deadline_at):
+        query, page, mode, slop = search
+        started = time.perf_counter()
+        if started > deadline_at:
+            return None
+        results = self._search_engine.search_query(query, mode=mode, slop=slop)
+        searched = time.perf_counter()
+
+        # the results are only sorted up to the page read
+        start = (page - 1) * self._page_size
+        end = min(start + self._page_size, len(results))
+        urls, scores = self._search_engine.get_range_urls_from_docmanager(results, start, max(start, end))
+        has_more = results.has_more(end)
+        resolved = time.perf_counter()
+
+        return {
+            'query': query,
+            'page': page,
+            'mode': mode,
+            'total_results': len(results),
+            'has_more': has_more,
+            'results': [{'url': url, 'score': score} for url, score in zip(urls, scores)],
+            'timings': {
+                'queue_ms': (started - submitted) * 1000,
+                'search_ms': (searched - started) * 1000,
+                'urls_ms': (resolved - searched) * 1000,
+            },
+        }
+
+
+# read a request from the connection, returns (method, target, keep_alive, body), or None once the client is done
+# raises ValueError for requests that cannot be parsed
+async def _read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, version = request_line.decode('latin-1').split()
+    except ValueError:
+        raise ValueError("malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise ValueError("malformed content-length")
+    if length > MAX_BODY_BYTES:
+        raise ValueError(f"request body too large, at most {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b''
+
+    # HTTP/1.1 connections stay open unless closed, HTTP/1.0 ones only if asked to
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+    return method, target, keep_alive, body
+
+
+# format a JSON response
+def _format_response(status, payload, keep_alive):
+    body = json.dumps(payload).encode('utf-8')
+    headers = [f'HTTP/1.1 {status} {STATUS_REASONS[status]}', 'Content-Type: application/json',
+               f'Content-Length: {len(body)}', f'Connection: {"keep-alive" if keep_alive else "close"}']
+    if status == 503:
+        headers.append('Retry-After: 1')
+    return ('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body
+
+
+# serve the indexes of the current directory, built beforehand with main.py
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve search results as JSON over HTTP")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    parser.add_argument('--port', type=int, default=8080, help="port to listen on")
+    parser.add_argument('--workers', type=int, default=4, help="threads running searches")
+    parser.add_argument('--max-pending', type=int, default=64,
+                        help="searches and batches accepted at once, more are answered with 503")
+    parser.add_argument('--deadline', type=float, default=2.0, help="seconds a request has to be answered")
+    parser.add_argument('--page-size', type=int, default=10, help="results per page")
+    parser.add_argument('--index-format', default='text', choices=['text', 'binary', 'fielded', 'impact'],
+                        help="format of the index to search")
+    parser.add_argument('--scorer', default='python', choices=['python', 'numpy'], help="scorer adding up scores")
+    parser.add_argument('--field-workers', type=int, default=0,
+                        help="threads reading the fields of a token of the text index at once, 0 reads them in turn")
+    parser.add_argument('--max-open-files', type=int, default=64,
+                        help="text index files kept open at once, the least recently read one is closed for another")
+    parser.add_argument('--stages', action='store_true',
+                        help="time the stages of every search, their histograms are reported by /stats")
+    parser.add_argument('--metrics', default=None, help="append the time of every search stage to this JSON lines file")
+    parser.add_argument('--trace', action='store_true', help="print the trace of every search")
+    args = parser.parse_args()
+
+    stage_histogram = HistogramSink() if args.stages else None
+    metrics_sink = JsonLinesSink(args.metrics) if args.metrics else None
+    sinks = [sink for sink in [stage_histogram, metrics_sink] if sink is not None]
+    # traces are printed, the instrumentation prints them on its own if no other sink records them
+    if args.trace and sinks:
+        sinks.append(LogSink(times=False))
+    search_instrumentation = Instrumentation(sinks, trace=args.trace)
+
+    search_engine = SearchEngine(index_format=args.index_format, scorer=args.scorer,
+                                 instrumentation=search_instrumentation, field_workers=args.field_workers,
+                                 max_open_files=args.max_open_files)
+    search_server = SearchServer(search_engine, workers=args.workers, max_pending=args.max_pending,
+                                 deadline=args.deadline, page_size=args.page_size, histogram=stage_histogram)
+    try:
+        asyncio.run(search_server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Server stopped")
+    finally:
+        search_server.close()
+        search_engine.close()
+        if metrics_sink is not None:
+            metrics_sink.close()
@@ -0,0 +1,88 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from Indexer import Indexer
+from Instrumentation import HistogramSink, Instrumentation
+from searchEngine import SearchEngine
+
+
+# builds small indexes in a temporary directory, the indexer and the search engine work in the current directory
+class IndexerTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._directory = tempfile.TemporaryDirectory()
+        os.chdir(self._directory.name)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._directory.cleanup()
+
+    # write one JSON file per (file_name, url, text) under DEV
+    def _write_documents(self, documents):
+        for file_name, url, text in documents:
+            path = Path('DEV', 'site', file_name)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            content = f'<html><body><p>{text}</p></body></html>'
+            path.write_text(json.dumps({'url': url, 'content': content, 'encoding': 'utf-8'}), encoding='utf-8')
+
+    # build the index of DEV, without its progress output
+    def _build(self, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            Indexer(**kwargs).create_index('DEV')
+
+    # return the urls of a phrase query's results
+    def _search_phrase(self, phrase):
+        with contextlib.redirect_stdout(io.StringIO()), SearchEngine(cache_entries=0) as search_engine:
+            results = search_engine.search_query(phrase, mode='phrase')
+            return [search_engine.get_url_from_docmanager(doc_id) for doc_id, _ in results[:len(results)]]
+
+    # the positions of a duplicate url's second visit follow the whole text of its first visit
+    def test_phrase_over_duplicate_url(self):
+        self._write_documents([('a.json', 'https://www.example.com/page', 'banana zebra zebra apple'),
+                               ('b.json', 'https://www.example.com/page', 'apple queen banana')])
+        self._build(positional=True)
+
+        self.assertEqual(self._search_phrase('apple queen'), ['https://www.example.com/page'])
+        self.assertEqual(self._search_phrase('apple apple'), ['https://www.example.com/page'])
+        self.assertEqual(self._search_phrase('banana apple'), [])
+        self.assertEqual(self._search_phrase('queen zebra'), [])
+
+    # a Runs folder left behind by an interrupted build is not merged into the next build
+    def test_leftover_runs_folder(self):
+        self._write_documents([('a.json', 'https://www.example.com/a', 'apple banana apple'),
+                               ('b.json', 'https://www.example.com/b', 'banana cherry')])
+        self._build()
+        built = {path: path.read_bytes() for path in sorted(Path('Frequency_Index').rglob('*.txt'))}
+
+        # an interrupted build leaves its spilled runs behind
+        indexer = Indexer()
+        with contextlib.redirect_stdout(io.StringIO()):
+            indexer._create_index_serial(Path('DEV'))
+        self.assertTrue(Path('Runs').exists())
+
+        self._build()
+        self.assertFalse(Path('Runs').exists())
+        self.assertEqual({path: path.read_bytes() for path in sorted(Path('Frequency_Index').rglob('*.txt'))}, built)
+
+    # the postings read by field workers are timed into the trace of the query they are read for
+    def test_field_worker_stages_in_trace(self):
+        self._write_documents([('a.json', 'https://www.example.com/a', 'apple <b>banana</b> apple'),
+                               ('b.json', 'https://www.example.com/b', 'banana cherry')])
+        self._build()
+
+        histogram = HistogramSink(keep_traces=1)
+        instrumentation = Instrumentation([histogram], trace=True)
+        with SearchEngine(cache_entries=0, instrumentation=instrumentation, field_workers=2) as search_engine:
+            search_engine.search_query('apple banana')
+        stages = histogram.get_stats()['traces'][0]['stages_ms']
+        self.assertIn('search.postings.frequency', stages)
+        self.assertIn('search.postings.b', stages)
+
+
+if __name__ == '__main__':
+    unittest.main()